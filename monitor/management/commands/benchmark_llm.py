@@ -0,0 +1,67 @@
+import asyncio
+import time
+from django.core.management.base import BaseCommand
+from monitor.services.llm_client import LLMClient
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * fraction))], 2)
+
+
+class Command(BaseCommand):
+    help = "Замер пропускной способности и задержек клиента модели (например, против manage.py mock_openai)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8765/v1')
+        parser.add_argument('--api-key', default='mock')
+        parser.add_argument('--requests', type=int, default=50)
+        parser.add_argument('--concurrency', type=int, default=10, help='Одновременно отправляемых запросов')
+        parser.add_argument('--max-tokens', type=int, default=200)
+        parser.add_argument('--stream', action='store_true', help='Замерять TTFT в режиме stream')
+
+    def handle(self, *args, **options):
+        client = LLMClient(api_key=options['api_key'], base_url=options['base_url'])
+        messages = [{"role": "user", "content": "Как дела у сервера?"}]
+        latencies, ttfts, errors = [], [], []
+
+        async def one():
+            started = time.monotonic()
+            try:
+                if options['stream']:
+                    first = None
+                    async for _ in client.astream(messages, max_tokens=options['max_tokens']):
+                        if first is None:
+                            first = time.monotonic()
+                    ttfts.append((first - started) * 1000 if first else None)
+                else:
+                    await client.acomplete(messages, max_tokens=options['max_tokens'])
+                latencies.append((time.monotonic() - started) * 1000)
+            except Exception as e:
+                errors.append(str(e))
+
+        async def run_all():
+            # Ограничение со стороны "пользователей"; внутри клиента действует свой семафор
+            gate = asyncio.Semaphore(options['concurrency'])
+
+            async def limited():
+                async with gate:
+                    await one()
+
+            await asyncio.gather(*(limited() for _ in range(options['requests'])))
+
+        started = time.monotonic()
+        client.run(run_all())
+        elapsed = time.monotonic() - started
+
+        self.stdout.write(f"📊 Запросов: {options['requests']}, успешно: {len(latencies)}, ошибок: {len(errors)}")
+        self.stdout.write(f"⏱️ Всего {elapsed:.2f} с, {len(latencies) / elapsed:.2f} запросов/с")
+        self.stdout.write(f"   задержка p50 {percentile(latencies, 0.5)} мс, p95 {percentile(latencies, 0.95)} мс")
+        ttfts = [value for value in ttfts if value is not None]
+        if ttfts:
+            self.stdout.write(f"   TTFT p50 {percentile(ttfts, 0.5)} мс, p95 {percentile(ttfts, 0.95)} мс")
+        if errors:
+            self.stdout.write(f"   первая ошибка: {errors[0]}")
+        self.stdout.write(f"🔌 Клиент: {client.stats()}")
@@ -0,0 +1,165 @@
+import json
+import random
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+
+MOCK_WORDS = ("Система", "работает", "стабильно,", "нагрузка", "CPU", "в", "норме.", "Проверьте",
+              "`docker ps -a`", "и", "`df -h`", "для", "контроля", "диска.")
+
+
+class MockCompletionHandler(BaseHTTPRequestHandler):
+    """Ответы в формате /v1/chat/completions (обычные и stream) с настраиваемой задержкой
+
+    Если переданы tools и результатов инструментов в диалоге еще нет,
+    ответ - вызов первых двух инструментов (как при параллельных вызовах).
+    """
+    protocol_version = "HTTP/1.1"
+    options = {}
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self._send_json(400, {"error": {"message": "Invalid JSON", "type": "invalid_request_error"}})
+            return
+
+        options = self.options
+        roll = random.random()
+        if roll < options["error_rate"]:
+            self._send_json(500, {"error": {"message": "Mock server error", "type": "server_error"}})
+            return
+        if roll < options["error_rate"] + options["rate_limit_rate"]:
+            self._send_json(429, {"error": {"message": "Mock rate limit", "type": "rate_limit_error"}},
+                            headers={"Retry-After": "1"})
+            return
+
+        tokens = [MOCK_WORDS[i % len(MOCK_WORDS)] for i in
+                  range(min(options["tokens"], int(payload.get("max_tokens") or options["tokens"])))]
+        model = payload.get("model", "mock")
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        time.sleep(options["ttft_ms"] / 1000)
+
+        tool_calls = self._tool_calls(payload)
+        if payload.get("stream"):
+            self._stream(completion_id, model, [] if tool_calls else tokens, tool_calls)
+            return
+
+        time.sleep(len(tokens) / options["tokens_per_second"])
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": None, "tool_calls": tool_calls} if tool_calls
+                else {"role": "assistant", "content": ' '.join(tokens)},
+                "finish_reason": "tool_calls" if tool_calls else "stop"
+            }],
+            "usage": {"prompt_tokens": length // 4, "completion_tokens": len(tokens),
+                      "total_tokens": length // 4 + len(tokens)}
+        })
+
+    @staticmethod
+    def _tool_calls(payload):
+        tools = payload.get("tools") or []
+        if not tools or payload.get("tool_choice") == "none" \
+                or any(message.get("role") == "tool" for message in payload.get("messages", [])):
+            return []
+        return [{"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                 "function": {"name": tool["function"]["name"], "arguments": "{}"}} for tool in tools[:2]]
+
+    def _stream(self, completion_id, model, tokens, tool_calls=None):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta, finish_reason=None):
+            return {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            }
+
+        interval = 1 / self.options["tokens_per_second"]
+        self._write_event(chunk({"role": "assistant", "content": ""}))
+        for i, token in enumerate(tokens):
+            self._write_event(chunk({"content": token if i == 0 else ' ' + token}))
+            time.sleep(interval)
+        for i, call in enumerate(tool_calls or []):
+            # Как у OpenAI: сначала id и имя, затем аргументы отдельным куском
+            self._write_event(chunk({"tool_calls": [{"index": i, "id": call["id"], "type": "function",
+                                                     "function": {"name": call["function"]["name"],
+                                                                  "arguments": ""}}]}))
+            self._write_event(chunk({"tool_calls": [{"index": i, "function": {
+                "arguments": call["function"]["arguments"]}}]}))
+        self._write_event(chunk({}, "tool_calls" if tool_calls else "stop"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"")
+
+    def _write_event(self, data):
+        self._write_chunk(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8'))
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _send_json(self, code, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.options.get("verbose"):
+            super().log_message(format, *args)
+
+
+class Command(BaseCommand):
+    help = ("Локальный сервер, совместимый с OpenAI /v1/chat/completions, для офлайн-замеров. "
+            "Запуск агента против него: OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--ttft-ms', type=float, default=300, help='Задержка до первого токена')
+        parser.add_argument('--tokens-per-second', type=float, default=50)
+        parser.add_argument('--tokens', type=int, default=60, help='Длина ответа в токенах')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 500')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Доля ответов 429')
+        parser.add_argument('--verbose', action='store_true')
+
+    def handle(self, *args, **options):
+        MockCompletionHandler.options = {
+            "ttft_ms": options['ttft_ms'],
+            "tokens_per_second": max(options['tokens_per_second'], 0.001),
+            "tokens": options['tokens'],
+            "error_rate": options['error_rate'],
+            "rate_limit_rate": options['rate_limit_rate'],
+            "verbose": options['verbose'],
+        }
+        server = ThreadingHTTPServer((options['host'], options['port']), MockCompletionHandler)
+        server.daemon_threads = True
+        self.stdout.write(f"🧪 Mock OpenAI: http://{options['host']}:{options['port']}/v1 "
+                          f"(TTFT {options['ttft_ms']} мс, {options['tokens_per_second']} ток/с)")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
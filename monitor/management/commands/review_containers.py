@@ -0,0 +1,43 @@
+import argparse
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from monitor.models import AnalysisJob
+
+
+class Command(BaseCommand):
+    help = "Пакетный обзор всех Docker контейнеров фоновыми задачами (для cron, если Celery beat не используется)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--priority', default=None, help='high, normal, low или 0-9 (по умолчанию REVIEW_PRIORITY)')
+        parser.add_argument('--wait', action=argparse.BooleanOptionalAction, default=None,
+                            help='Дождаться завершения задач (по умолчанию - если задачи выполняет '
+                                 'пул потоков этой команды, т.е. BACKEND не celery)')
+
+    def handle(self, *args, **options):
+        from monitor.views import ssh_service, analysis_jobs
+
+        local_workers = settings.AI_JOBS['BACKEND'] != 'celery'
+        wait = options['wait'] if options['wait'] is not None else local_workers
+        if local_workers and not wait:
+            # Потоки пула завершатся вместе с командой, и задачи останутся в очереди навсегда
+            raise CommandError("Без Celery задачи выполняет эта команда: --no-wait недоступен")
+
+        if not ssh_service.connected and not ssh_service.connect():
+            raise CommandError("Не удалось подключиться к серверу по SSH")
+
+        review = analysis_jobs.review_containers(priority=options['priority'])
+        self.stdout.write(f"🌙 Пакет {review['batch']}: задач {len(review['jobs'])}, "
+                          f"уже в работе {review['deduplicated']}")
+
+        if not wait:
+            return
+        deadline = time.time() + settings.AI_JOBS['QUEUE_TIMEOUT'] + settings.AI_JOBS['TIMEOUT']
+        while time.time() < deadline and AnalysisJob.objects.filter(
+                batch=review['batch'], status__in=AnalysisJob.ACTIVE_STATUSES).exists():
+            time.sleep(1)
+
+        summary = analysis_jobs.batch_summary(review['batch'])
+        self.stdout.write(f"📊 Итог: {summary['by_status']}")
+        for item in summary['critical']:
+            self.stdout.write(f"🔴 {item['container']}: {item['title']}")
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.7 on 2026-10-19 07:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitor', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LogChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64, unique=True)),
+                ('data', models.BinaryField()),
+                ('raw_size', models.IntegerField()),
+                ('compressed_size', models.IntegerField()),
+                ('lines_count', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'log_chunks',
+            },
+        ),
+        migrations.AddField(
+            model_name='servicelog',
+            name='host',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.AlterField(
+            model_name='servicelog',
+            name='log_content',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='servicelog',
+            name='log_file_path',
+            field=models.CharField(blank=True, default='', max_length=500),
+        ),
+        migrations.AddIndex(
+            model_name='servicelog',
+            index=models.Index(fields=['host', 'service_name', 'fetched_at'], name='service_logs_source_idx'),
+        ),
+        migrations.AddField(
+            model_name='servicelog',
+            name='chunk',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='snapshots', to='monitor.logchunk'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitor', '0002_log_chunks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AIResponseCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=40, unique=True)),
+                ('kind', models.CharField(max_length=20)),
+                ('query', models.TextField()),
+                ('response', models.JSONField()),
+                ('hits', models.IntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+            ],
+            options={
+                'db_table': 'ai_response_cache',
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitor', '0004_ai_conversations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('system', 'System'), ('logs', 'Logs'), ('container', 'Container')], max_length=20)),
+                ('query', models.TextField()),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('dedupe_key', models.CharField(max_length=40)),
+                ('priority', models.IntegerField(default=5)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('progress', models.IntegerField(default=0)),
+                ('stage', models.CharField(blank=True, default='', max_length=50)),
+                ('batch', models.CharField(blank=True, default='', max_length=64)),
+                ('task_id', models.CharField(blank=True, default='', max_length=64)),
+                ('result', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'ai_analysis_jobs',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'priority', 'created_at'], name='ai_jobs_queue_idx'), models.Index(fields=['batch'], name='ai_jobs_batch_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='analysisjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('dedupe_key',), name='ai_jobs_active_dedupe'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-19 08:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('monitor', '0005_ai_analysis_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicelog',
+            name='is_open',
+            field=models.BooleanField(default=False),
+        ),
+    ]
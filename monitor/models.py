@@ -26,6 +26,19 @@ class CommandExecution(models.Model):
         ordering = ['-executed_at']
 
 
+class LogChunk(models.Model):
+    """Сжатый (zlib) блок строк лога; одинаковое содержимое хранится один раз"""
+    content_hash = models.CharField(max_length=64, unique=True)
+    data = models.BinaryField()
+    raw_size = models.IntegerField()
+    compressed_size = models.IntegerField()
+    lines_count = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'log_chunks'
+
+
 class ServiceLog(models.Model):
     SERVICE_TYPES = [
         ('system', 'System'),
@@ -36,11 +49,108 @@ class ServiceLog(models.Model):
 
     service_name = models.CharField(max_length=100)
     service_type = models.CharField(max_length=20, choices=SERVICE_TYPES)
-    log_content = models.TextField()
-    log_file_path = models.CharField(max_length=500)
+    host = models.CharField(max_length=255, blank=True, default='')
+    # Текст открытого снимка (is_open), в который дописываются свежие строки;
+    # закрытые снимки хранят текст в сжатом chunk (у старых записей - здесь же)
+    log_content = models.TextField(blank=True, default='')
+    is_open = models.BooleanField(default=False)
+    chunk = models.ForeignKey(LogChunk, null=True, blank=True, on_delete=models.PROTECT, related_name='snapshots')
+    log_file_path = models.CharField(max_length=500, blank=True, default='')
     lines_count = models.IntegerField()
     fetched_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         db_table = 'service_logs'
-        ordering = ['-fetched_at']
\ No newline at end of file
+        ordering = ['-fetched_at']
+        indexes = [
+            models.Index(fields=['host', 'service_name', 'fetched_at'], name='service_logs_source_idx'),
+        ]
+
+
+class AIResponseCacheEntry(models.Model):
+    """Сохраненный ответ ИИ: ключ - смысл вопроса и хэш состояния системы"""
+    key = models.CharField(max_length=40, unique=True)
+    kind = models.CharField(max_length=20)
+    query = models.TextField()
+    response = models.JSONField()
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = 'ai_response_cache'
+
+
+class Conversation(models.Model):
+    """Разговор с ИИ одной сессии: сводка свернутых реплик"""
+    session_key = models.CharField(max_length=64, unique=True)
+    summary = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'ai_conversations'
+
+
+class ConversationMessage(models.Model):
+    ROLES = [
+        ('user', 'User'),
+        ('assistant', 'Assistant'),
+    ]
+
+    conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
+    role = models.CharField(max_length=20, choices=ROLES)
+    content = models.TextField()
+    tokens = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'ai_conversation_messages'
+        ordering = ['id']
+
+
+class AnalysisJob(models.Model):
+    """Фоновый анализ ИИ: очередь с приоритетом, прогресс и результат"""
+    KINDS = [
+        ('system', 'System'),
+        ('logs', 'Logs'),
+        ('container', 'Container'),
+    ]
+    STATUSES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    ACTIVE_STATUSES = ('queued', 'running')
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    query = models.TextField()
+    params = models.JSONField(default=dict, blank=True)
+    # Хэш вида, запроса и параметров: одинаковые задачи в работе не дублируются
+    dedupe_key = models.CharField(max_length=40)
+    # 0 - самый высокий приоритет (как у Celery с redis)
+    priority = models.IntegerField(default=5)
+    status = models.CharField(max_length=20, choices=STATUSES, default='queued')
+    progress = models.IntegerField(default=0)
+    stage = models.CharField(max_length=50, blank=True, default='')
+    batch = models.CharField(max_length=64, blank=True, default='')
+    task_id = models.CharField(max_length=64, blank=True, default='')
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'ai_analysis_jobs'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'priority', 'created_at'], name='ai_jobs_queue_idx'),
+            models.Index(fields=['batch'], name='ai_jobs_batch_idx'),
+        ]
+        constraints = [
+            # Гонка двух одинаковых запросов решается на уровне БД
+            models.UniqueConstraint(fields=['dedupe_key'], condition=models.Q(status__in=['queued', 'running']),
+                                    name='ai_jobs_active_dedupe'),
+        ]
@@ -0,0 +1,168 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from django.conf import settings
+from .log_templates import TemplateMiner
+from .prompt_budget import truncate_lines
+
+
+def _tool(name: str, description: str, properties: Dict = None, required: List[str] = None) -> Dict:
+    return {
+        "type": "function",
+        "function": {
+            "name": name,
+            "description": description,
+            "parameters": {"type": "object", "properties": properties or {}, "required": required or []}
+        }
+    }
+
+
+# Описания инструментов в формате OpenAI tools
+TOOL_SPECS = [
+    _tool("get_resources", "Текущая загрузка CPU, памяти и диска сервера"),
+    _tool("get_top_processes", "Топ процессов по CPU и по памяти"),
+    _tool("list_containers", "Docker контейнеры: имя, образ, статус, запущен ли"),
+    _tool("get_container_logs", "Последние логи Docker контейнера, сгруппированные в шаблоны", {
+        "container": {"type": "string", "description": "Имя или ID контейнера"},
+        "lines": {"type": "integer", "description": "Сколько последних строк просмотреть (по умолчанию 200)"}
+    }, ["container"]),
+    _tool("get_services_status", "Статус системных сервисов systemd"),
+    _tool("get_network_sockets", "Слушающие TCP/UDP сокеты и процессы (ss/netstat -tulpn)"),
+]
+
+
+class AgentToolbox:
+    """Сборщики данных сервера как инструменты модели
+
+    Инструменты разделов снимка (ресурсы, процессы, контейнеры, сервисы,
+    сеть) отдают данные SnapshotStore и обновляют только свой раздел, поэтому
+    вопрос о логах одного контейнера не запускает systemctl и netstat.
+    Вызовы одного раунда выполняются параллельно; результат каждого
+    ограничен RESULT_TOKENS.
+    """
+
+    def __init__(self, snapshots, docker_service, log_service=None):
+        self.snapshots = snapshots
+        self.docker_service = docker_service
+        self.log_service = log_service
+        self.config = settings.AI_TOOLS
+        self._handlers = {
+            "get_resources": self._get_resources,
+            "get_top_processes": self._get_top_processes,
+            "list_containers": self._list_containers,
+            "get_container_logs": self._get_container_logs,
+            "get_services_status": self._get_services_status,
+            "get_network_sockets": self._get_network_sockets,
+        }
+        self._stats = {name: {"calls": 0, "errors": 0, "total_ms": 0.0} for name in self._handlers}
+        self._lock = threading.Lock()
+
+    def execute_all(self, tool_calls: List[Dict]) -> List[Dict]:
+        """Параллельное выполнение вызовов [{"id", "name", "arguments"}] в исходном порядке"""
+        if len(tool_calls) == 1:
+            return [self.execute(tool_calls[0])]
+        with ThreadPoolExecutor(max_workers=min(len(tool_calls), self.config['PARALLELISM'])) as executor:
+            return list(executor.map(self.execute, tool_calls))
+
+    def execute(self, tool_call: Dict) -> Dict:
+        name = tool_call.get("name", "")
+        started = time.monotonic()
+        success = False
+        try:
+            handler = self._handlers.get(name)
+            if handler is None:
+                raise ValueError(f"Неизвестный инструмент: {name}")
+            arguments = json.loads(tool_call.get("arguments") or "{}")
+            if not isinstance(arguments, dict):
+                raise ValueError("Аргументы должны быть JSON объектом")
+            content = handler(**arguments)
+            success = True
+        except TypeError as e:
+            content = f"Ошибка: неверные аргументы {name}: {e}"
+        except Exception as e:
+            content = f"Ошибка: {e}"
+        elapsed = round((time.monotonic() - started) * 1000, 2)
+
+        if name in self._stats:
+            with self._lock:
+                self._stats[name]["calls"] += 1
+                self._stats[name]["errors"] += 0 if success else 1
+                self._stats[name]["total_ms"] += elapsed
+        return {
+            "id": tool_call.get("id", ""),
+            "name": name,
+            "content": truncate_lines(content, self.config['RESULT_TOKENS']),
+            "success": success,
+            "ms": elapsed
+        }
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                name: {
+                    "calls": item["calls"],
+                    "errors": item["errors"],
+                    "avg_ms": round(item["total_ms"] / item["calls"], 2) if item["calls"] else None
+                }
+                for name, item in self._stats.items()
+            }
+
+    # --- инструменты ---
+
+    def _section(self, name: str):
+        data = self.snapshots.get([name]).get(name)
+        if data is None:
+            raise RuntimeError(f"Данные раздела {name} недоступны")
+        return data
+
+    def _get_resources(self) -> str:
+        return self._json(self._section("resources"))
+
+    def _get_top_processes(self) -> str:
+        processes = self._section("processes")
+        fields = ("name", "pid", "cpu_percent", "memory_percent")
+        return self._json({
+            "total_count": processes.get("total_count"),
+            "top_cpu": [{key: p.get(key) for key in fields} for p in processes.get("top_cpu", [])],
+            "top_memory": [{key: p.get(key) for key in fields} for p in processes.get("top_memory", [])]
+        })
+
+    def _list_containers(self) -> str:
+        docker = self._section("docker")
+        return '\n'.join([f"Запущено {docker.get('running', 0)} из {docker.get('total', 0)}"] + [
+            f"{c.get('name', 'N/A')} | {c.get('image', '')} | {c.get('status', '')}"
+            for c in docker.get("running_list", []) + docker.get("stopped_list", [])
+        ])
+
+    def _get_container_logs(self, container: str, lines: int = 200) -> str:
+        # Только контейнеры из инвентаря: аргумент модели не попадает в команду как есть
+        inventory = self.docker_service.get_inventory()
+        match = self.docker_service.find_container(container, inventory)
+        if match is None:
+            names = ', '.join(c.get("name", "") for c in inventory)
+            raise ValueError(f"Контейнер {container} не найден. Есть: {names}")
+
+        lines = max(1, min(int(lines), self.config['MAX_LOG_LINES']))
+        result = self.docker_service.get_container_logs(match["id"], lines=lines)
+        if not result["success"]:
+            raise RuntimeError(result.get("error") or "Не удалось получить логи")
+        if self.log_service is None:
+            return result["logs"]
+        records = self.log_service.parse_log_buffer(result["logs"], "docker")
+        return f"Контейнер {match['name']} ({match['status']})\n" + TemplateMiner().add_records(records).summary_text()
+
+    def _get_services_status(self) -> str:
+        services = self._section("services")
+        return '\n'.join([f"Всего {services.get('total', 0)}, запущено {services.get('running', 0)}, "
+                          f"с ошибками {services.get('failed', 0)}"] + [
+            f"{s.get('name', 'N/A')} - {s.get('status', 'N/A')}" for s in services.get("services_list", [])
+        ])
+
+    def _get_network_sockets(self) -> str:
+        return self._section("network").get("connections") or "Нет данных о сокетах"
+
+    @staticmethod
+    def _json(data) -> str:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
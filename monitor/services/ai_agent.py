@@ -1,8 +1,22 @@
 import json
+import hashlib
 import re
 import random
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 from django.conf import settings
 import os
+from .snapshot_store import SnapshotStore
+from .response_cache import INTENT_SECTIONS, ResponseCache, semantic_query_key
+from .prompt_budget import PromptBudget, format_budget_report
+from .llm_client import LLMClient
+from .conversation_memory import ConversationMemory
+from .agent_tools import TOOL_SPECS, AgentToolbox
+from .log_service import LOG_FIELDS, LogFilter
+from .log_templates import TemplateMiner
+from .system_analysis import (SNAPSHOT_COLLECTORS, format_findings, mentioned_containers, parse_findings,
+                              plan_collectors, rule_findings, sort_findings, summarize_container)
 
 try:
     from openai import OpenAI
@@ -12,24 +26,57 @@ except ImportError:
     OPENAI_NEW_API = False
     import openai
 
+# Сессия для вызовов без пользователя (анализ, фоновые задачи)
+DEFAULT_SESSION = "default"
+
+CHAT_INSTRUCTIONS = """# ИНСТРУКЦИИ
+1. ОТВЕЧАЙ ТОЛЬКО НА ОСНОВЕ РЕАЛЬНЫХ ДАННЫХ
+2. Будь полезным и конкретным
+3. Если данных нет для ответа - честно скажи об этом
+4. Используй естественный язык, можно с юмором
+5. Для технических вопросов давай конкретные рекомендации
+6. Предлагай команды только если они действительно нужны
+
+ОТВЕТ:"""
+
 
 class AIAgent:
-    def __init__(self, ssh_service, diagnostic_service, docker_service):
+    def __init__(self, ssh_service, diagnostic_service, docker_service, log_service=None):
         self.ssh_service = ssh_service
         self.diagnostic_service = diagnostic_service
         self.docker_service = docker_service
-        self.conversation_history = []
+        # Источник логов для анализа системы (без него анализ идет без логов)
+        self.log_service = log_service
+        # История разговоров по сессиям: БД + LRU горячих сессий в памяти
+        self.memory = ConversationMemory()
+        # Последние замеры стриминга: время до первого токена и полное время ответа (мс)
+        self.ttft_samples = deque(maxlen=settings.AI_STREAMING['METRICS_WINDOW'])
+        self.total_samples = deque(maxlen=settings.AI_STREAMING['METRICS_WINDOW'])
+        # Общий снимок состояния: каждое сообщение обновляет только устаревшие разделы
+        self.snapshots = SnapshotStore(ssh_service, {
+            "resources": self._load_resources,
+            "processes": self._load_processes,
+            "docker": self._load_docker,
+            "services": self._load_services,
+            "network": self.diagnostic_service.get_network_info,
+        }, settings.AI_SNAPSHOT_TTL)
+        # Повторный вопрос при том же состоянии системы не тратит токены
+        self.response_cache = ResponseCache()
+        # Разделы снимка и логи контейнеров как инструменты модели
+        self.toolbox = AgentToolbox(self.snapshots, docker_service, log_service)
+        # Стоимость разделов последнего промпта в токенах
+        self.last_prompt_report = None
         self.openai_available = self._check_openai_availability()
         self.client = self._create_openai_client()
 
     def _create_openai_client(self):
-        """Создает клиент OpenAI для новой версии API"""
+        """Создает клиент модели для новой версии API (общий пул, лимиты, повторы)"""
         if not self.openai_available:
             return None
 
         try:
             if OPENAI_NEW_API:
-                return OpenAI(api_key=settings.OPENAI_API_KEY)
+                return LLMClient()
             else:
                 return None
         except Exception as e:
@@ -48,37 +95,52 @@ class AIAgent:
             print(f"❌ Ошибка проверки OpenAI: {e}")
             return False
 
-    def chat_with_ai(self, message):
+    def chat_with_ai(self, message, session_key=DEFAULT_SESSION):
         """Умный метод чата с ИИ, который всегда использует реальные данные"""
         try:
             print(f"💬 AI запрос: {message}")
 
-            # Добавляем в историю
-            self.conversation_history.append({"role": "user", "content": message})
-
-            # Всегда собираем ВСЕ реальные данные системы
-            system_data = self._collect_all_real_system_data()
+            use_tools = self._tools_enabled()
+            if use_tools:
+                # Данные запрашивает сама модель: собираются только нужные разделы
+                system_data = None
+                cache_key = self._tool_cache_key(message)
+            else:
+                # Всегда собираем ВСЕ реальные данные системы
+                system_data = self._collect_all_real_system_data()
+                cache_key = self._chat_cache_key(message, system_data, session_key)
 
-            # Формируем умный промпт с реальными данными
-            prompt = self._build_smart_prompt(message, system_data)
+            # Добавляем в историю после ключа кэша: ключ строится по истории до вопроса
+            self.memory.append(session_key, "user", message)
 
-            # Получаем ответ
-            ai_response = self._get_ai_response(prompt)
+            cached = self.response_cache.get(cache_key) if cache_key else None
+            if cached:
+                print("⚡ Ответ ИИ из кэша")
+                ai_response = cached["response"]
+            else:
+                source = {}
+                if use_tools:
+                    ai_response = ''.join(self._answer_with_tools(message, session_key, source, stream=False))
+                else:
+                    # Формируем умный промпт с реальными данными
+                    prompt = self._build_smart_prompt(message, system_data, session_key)
+
+                    # Получаем ответ
+                    ai_response = self._get_ai_response(prompt, source)
+                if cache_key and source.get("model"):
+                    self.response_cache.put(cache_key, "chat", message, {"response": ai_response})
 
             # Извлекаем команды
             suggested_commands = self._extract_commands_from_response(ai_response)
 
-            # Сохраняем в историю
-            self.conversation_history.append({"role": "assistant", "content": ai_response})
-
-            # Ограничиваем историю
-            if len(self.conversation_history) > 20:
-                self.conversation_history = self.conversation_history[-20:]
+            # Сохраняем в историю (объем ограничивает сворачивание старых реплик)
+            self.memory.append(session_key, "assistant", ai_response)
 
             return {
                 "success": True,
                 "response": ai_response,
-                "suggested_commands": suggested_commands
+                "suggested_commands": suggested_commands,
+                "cached": bool(cached)
             }
 
         except Exception as e:
@@ -95,71 +157,455 @@ class AIAgent:
                 "suggested_commands": []
             }
 
-    def _collect_all_real_system_data(self):
-        """Собирает ВСЕ реальные данные системы"""
-        data = {}
-
+    def stream_chat(self, message, session_key=DEFAULT_SESSION):
+        """Чат с ИИ по частям: события delta по мере генерации, в конце done
+
+        Каждое событие - словарь с полем type. Время до первого токена
+        (TTFT) и полное время ответа сохраняются в метриках агента.
+        """
+        started = time.time()
+        ttft_ms = None
+        parts = []
+        # Вопрос без записанного ответа убирается из истории в finally
+        unanswered = None
         try:
-            # 1. Базовые ресурсы
-            resources = self.diagnostic_service.get_system_resources()
-            data["resources"] = {
-                "cpu_usage": resources.get('cpu_usage', 0),
-                "memory": {
-                    "usage_percent": resources.get('memory', {}).get('usage_percent', 0),
-                    "used": resources.get('memory', {}).get('used', 'N/A'),
-                    "total": resources.get('memory', {}).get('total', 'N/A')
-                },
-                "disk": {
-                    "usage_percent": resources.get('disk', {}).get('usage_percent', 0),
-                    "used": resources.get('disk', {}).get('used', 'N/A'),
-                    "total": resources.get('disk', {}).get('total', 'N/A')
-                }
+            print(f"💬 AI запрос (стриминг): {message}")
+
+            use_tools = self._tools_enabled()
+            if use_tools:
+                system_data = None
+                cache_key = self._tool_cache_key(message)
+            else:
+                system_data = self._collect_all_real_system_data()
+                cache_key = self._chat_cache_key(message, system_data, session_key)
+            unanswered = self.memory.append(session_key, "user", message)
+            cached = self.response_cache.get(cache_key) if cache_key else None
+            source = {}
+            if cached:
+                print("⚡ Ответ ИИ из кэша")
+                deltas = [cached["response"]]
+            elif use_tools:
+                deltas = self._answer_with_tools(message, session_key, source)
+            else:
+                deltas = self._stream_ai_response(self._build_smart_prompt(message, system_data, session_key), source)
+
+            for delta in deltas:
+                if not delta:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = round((time.time() - started) * 1000, 2)
+                parts.append(delta)
+                yield {"type": "delta", "text": delta}
+
+            ai_response = ''.join(parts).strip()
+            if cache_key and source.get("model"):
+                self.response_cache.put(cache_key, "chat", message, {"response": ai_response})
+            self.memory.append(session_key, "assistant", ai_response)
+            unanswered = None
+
+            total_ms = round((time.time() - started) * 1000, 2)
+            self._record_latency(ttft_ms if ttft_ms is not None else total_ms, total_ms)
+            print(f"⏱️ AI стриминг: первый токен {ttft_ms} мс, весь ответ {total_ms} мс")
+
+            yield {
+                "type": "done",
+                "success": True,
+                "response": ai_response,
+                "suggested_commands": self._extract_commands_from_response(ai_response),
+                "ttft_ms": ttft_ms,
+                "total_ms": total_ms,
+                "cached": bool(cached)
             }
 
-            # 2. Процессы (топ по CPU и памяти)
-            processes_cpu = self.diagnostic_service.get_running_processes(limit=10, sort_by='cpu')
-            processes_memory = self.diagnostic_service.get_running_processes(limit=10, sort_by='memory')
+        except Exception as e:
+            print(f"❌ Ошибка AI стриминга: {str(e)}")
+            yield {
+                "type": "error",
+                "success": False,
+                "error": str(e),
+                "response": ''.join(parts),
+                "ttft_ms": ttft_ms
+            }
+        finally:
+            # Ошибка модели или отключение клиента (GeneratorExit): иначе следующий
+            # запрос увидел бы в истории вопрос без ответа
+            if unanswered is not None:
+                self.memory.discard(session_key, unanswered)
+
+    def _stream_ai_response(self, prompt, source=None):
+        """Части ответа ИИ; если OpenAI недоступен или упал до первого токена - fallback
+
+        source["model"] выставляется, когда ответ целиком получен от модели.
+        """
+        if self.openai_available and self.client:
+            received = False
+            try:
+                for delta in self._stream_openai_response(prompt):
+                    received = True
+                    yield delta
+                if source is not None:
+                    source["model"] = True
+                return
+            except Exception as e:
+                print(f"❌ Ошибка стриминга ответа ИИ: {e}")
+                if received:
+                    # Часть ответа уже ушла пользователю - подмешивать fallback нельзя
+                    raise
+
+        fallback = self._get_smart_fallback_with_real_data_from_prompt(prompt)
+        # Fallback готов целиком, отдаем его строками, чтобы интерфейс работал одинаково
+        for line in fallback.splitlines(keepends=True):
+            yield line
+
+    def _tools_enabled(self):
+        """Инструменты есть только у клиента новой версии API"""
+        return settings.AI_TOOLS['ENABLED'] and self.openai_available and isinstance(self.client, LLMClient)
+
+    def _chat_cache_key(self, message, system_data, session_key):
+        """Ключ кэша чата: типовой вопрос - общий, свободный - в пределах истории разговора
+
+        Ответ на свободный вопрос ("а почему?") зависит от предыдущих реплик,
+        поэтому в его ключ входят сессия и отпечаток истории: другой сессии или
+        другому месту разговора этот ответ не достанется. Вызывается до записи
+        вопроса в историю: ключ описывает разговор, в котором вопрос задан.
+        """
+        if semantic_query_key(message).startswith("intent:"):
+            return self.response_cache.make_key("chat", message, system_data)
+        history = json.dumps([session_key, self.memory.get_summary(session_key),
+                              self.memory.get_messages(session_key)], ensure_ascii=False)
+        context = hashlib.sha1(history.encode('utf-8')).hexdigest()
+        return self.response_cache.make_key("chat", message, system_data, context=context)
+
+    def _tool_cache_key(self, message):
+        """Ключ кэша для типового вопроса; его разделы снимка известны заранее
+
+        Для свободного вопроса нужные данные выбирает модель, поэтому такой
+        ответ не кэшируется: собирать все разделы ради ключа - то, от чего
+        избавляют инструменты.
+        """
+        query_key = semantic_query_key(message)
+        if not query_key.startswith("intent:"):
+            return None
+        sections = INTENT_SECTIONS.get(query_key[len("intent:"):], ())
+        return self.response_cache.make_key("chat", message, self.snapshots.get(sections), sections=sections)
+
+    def _answer_with_tools(self, message, session_key, source=None, stream=True):
+        """Ответ модели с инструментами; при ошибке до первого токена - fallback
+
+        Модель получает только историю и вопрос и в каждом раунде запрашивает
+        нужные данные; вызовы раунда выполняются параллельно. В последнем
+        раунде вызовы запрещены (tool_choice="none"), чтобы ответ был текстом.
+        Без stream ответ каждого раунда приходит целиком.
+        """
+        received = False
+        try:
+            messages = self._tool_messages(message, session_key)
+            max_rounds = settings.AI_TOOLS['MAX_ROUNDS']
+            for round_number in range(max_rounds + 1):
+                tool_calls = []
+                options = {
+                    "max_tokens": 800,
+                    "temperature": 0.7,
+                    "tools": TOOL_SPECS,
+                    "tool_calls_out": tool_calls,
+                    "tool_choice": "auto" if round_number < max_rounds else "none"
+                }
+                if stream:
+                    content = []
+                    for delta in self.client.stream(messages, **options):
+                        received = True
+                        content.append(delta)
+                        yield delta
+                    content = ''.join(content)
+                else:
+                    content = self.client.complete(messages, **options)
+                    if not tool_calls:
+                        received = True
+                        yield content
+
+                if not tool_calls:
+                    if source is not None:
+                        source["model"] = True
+                    return
+
+                results = self.toolbox.execute_all(tool_calls)
+                print("🛠️ Инструменты: " + ", ".join(f"{r['name']} {r['ms']} мс" for r in results))
+                if stream and content:
+                    # Пояснение перед вызовами уже у пользователя - отделяем от ответа
+                    yield "\n\n"
+                messages.append({
+                    "role": "assistant",
+                    "content": content or None,
+                    "tool_calls": [{"id": call["id"], "type": "function",
+                                    "function": {"name": call["name"], "arguments": call["arguments"]}}
+                                   for call in tool_calls]
+                })
+                messages.extend({"role": "tool", "tool_call_id": result["id"], "content": result["content"]}
+                                for result in results)
+        except Exception as e:
+            print(f"❌ Ошибка ответа ИИ с инструментами: {e}")
+            if received:
+                raise
+
+        fallback = self._get_smart_fallback_with_real_data(message)
+        for line in fallback.splitlines(keepends=True):
+            yield line
+
+    def _tool_messages(self, message, session_key):
+        """Сообщения для чата с инструментами: данных сервера в промпте нет"""
+        budget = PromptBudget()
+        budget.add("context", """# КОНТЕКСТ СИСТЕМЫ
+Ты - умный AI ассистент системы мониторинга. Данные сервера получай через инструменты:
+запрашивай только то, что нужно для ответа, независимые инструменты вызывай вместе.""", required=True)
+        budget.add("query", f'# ЗАПРОС ПОЛЬЗОВАТЕЛЯ\n"{message}"', required=True)
+        budget.add("history", f"""# ИСТОРИЯ РАЗГОВОРА
+{self._format_conversation_history(session_key)}""", priority=60,
+                   compressor=lambda text: self._compress_history(session_key), keep="tail")
+        budget.add("instructions", CHAT_INSTRUCTIONS, required=True)
+
+        prompt, report = budget.compile()
+        self.last_prompt_report = report
+        print(f"🧮 Промпт (инструменты): {format_budget_report(report)}")
+        return self._chat_messages(prompt)
+
+    def _stream_openai_response(self, prompt):
+        """Дельты ответа OpenAI (stream=True) по мере генерации"""
+        if OPENAI_NEW_API:
+            yield from self.client.stream(self._chat_messages(prompt), max_tokens=800, temperature=0.7)
+        else:
+            stream = openai.ChatCompletion.create(
+                model=settings.OPENAI_MODEL,
+                messages=self._chat_messages(prompt),
+                max_tokens=800,
+                temperature=0.7,
+                stream=True,
+            )
+            for chunk in stream:
+                content = chunk.choices[0].delta.get("content")
+                if content:
+                    yield content
+
+    @staticmethod
+    def _chat_messages(prompt):
+        return [
+            {
+                "role": "system",
+                "content": "Ты - экспертный системный администратор. Отвечай точно на основе предоставленных данных. Будь полезным и конкретным."
+            },
+            {"role": "user", "content": prompt}
+        ]
+
+    def _record_latency(self, ttft_ms, total_ms):
+        self.ttft_samples.append(ttft_ms)
+        self.total_samples.append(total_ms)
+
+    @staticmethod
+    def _latency_summary(samples):
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return {
+            "last": samples[-1],
+            "p50": ordered[len(ordered) // 2],
+            "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+            "samples": len(ordered)
+        }
+
+    def analyze_system_state(self, query, sources=None, progress=None):
+        """Анализ состояния системы конвейером: план -> сбор -> сводка -> модель
+
+        Сборщики выбираются по намерению запроса (или передаются в sources) и
+        работают параллельно. Логи и docker inspect до промпта сворачиваются
+        в шаблоны и краткие сводки, модель вызывается один раз, ее ответ
+        разбирается в находки вместе с пороговыми проверками. В timings_ms -
+        время этапов, в sources - время и ошибки каждого сборщика.
+        progress(stage, percent) вызывается перед каждым этапом (фоновые задачи).
+        """
+        started = time.monotonic()
+        timings = {}
+        report_progress = progress or (lambda stage, percent: None)
+        try:
+            stage = time.monotonic()
+            intent, collectors = plan_collectors(query)
+            if sources is not None:
+                collectors = tuple(sources)
+            timings["plan"] = self._elapsed_ms(stage)
+
+            report_progress("collect", 10)
+            stage = time.monotonic()
+            collected, source_report = self._run_collectors(query, collectors)
+            timings["collect"] = self._elapsed_ms(stage)
+
+            report_progress("summarize", 50)
+            stage = time.monotonic()
+            system_data = {name: collected[name] for name in SNAPSHOT_COLLECTORS if collected.get(name)}
+            log_templates, log_summary = [], ""
+            if collected.get("logs"):
+                miner = TemplateMiner().add_records(collected["logs"])
+                log_templates, log_summary = miner.templates(), miner.summary_text()
+            containers_summary = "\n\n".join(
+                summarize_container(item["info"]) + (
+                    "\nЛоги:\n" + TemplateMiner().add_records(item["logs"]).summary_text() if item["logs"] else "")
+                for item in collected.get("containers") or [])
+            prompt, prompt_report = self._build_analysis_prompt(query, system_data, log_summary, containers_summary)
+            rules = rule_findings(system_data, log_templates)
+            timings["summarize"] = self._elapsed_ms(stage)
+
+            # Ключ кэша - огрубленные данные без времени и счетчиков строк логов
+            report_progress("model", 60)
+            stage = time.monotonic()
+            cache_state = dict(system_data)
+            if log_templates:
+                cache_state["logs"] = sorted((t["level"], t["template"]) for t in log_templates)
+            if collected.get("containers"):
+                cache_state["containers"] = [item["info"] for item in collected["containers"]]
+            cache_key = self.response_cache.make_key("analysis", query, cache_state, sections=list(cache_state))
+            cached = self.response_cache.get(cache_key)
+            analysis = cached["analysis"] if cached else None
+            if analysis is None and self.openai_available and self.client:
+                try:
+                    analysis = self._get_openai_response(prompt)
+                    self.response_cache.put(cache_key, "analysis", query, {"analysis": analysis})
+                except Exception as e:
+                    print(f"⚠️ Анализ без модели: {e}")
+            timings["model"] = self._elapsed_ms(stage)
+
+            model_used = analysis is not None
+            if model_used:
+                findings = sort_findings(parse_findings(analysis) + rules)
+            else:
+                findings = sort_findings(rules)
+                analysis = "Модель недоступна, выводы по пороговым проверкам:\n" + format_findings(findings)
+            timings["total"] = self._elapsed_ms(started)
+            print(f"🔬 Анализ ({intent or 'общий'}): {', '.join(source_report)} за {timings['total']} мс")
 
-            data["processes"] = {
-                "top_cpu": processes_cpu[:5],
-                "top_memory": processes_memory[:5],
-                "total_count": len(processes_cpu)
+            return {
+                "success": True,
+                "query": query,
+                "intent": intent,
+                "analysis": analysis,
+                "findings": findings,
+                "suggested_commands": self._extract_commands_from_response(analysis),
+                "sources": source_report,
+                "timings_ms": timings,
+                "prompt": prompt_report,
+                "cached": bool(cached),
+                "model_used": model_used
             }
 
-            # 3. Docker контейнеры
-            containers = self.docker_service.list_containers(all_containers=True)
-            running_containers = [c for c in containers if c.get("is_running", False)]
-            stopped_containers = [c for c in containers if not c.get("is_running", False)]
-
-            data["docker"] = {
-                "total": len(containers),
-                "running": len(running_containers),
-                "stopped": len(stopped_containers),
-                "containers": containers[:8],  # Первые 8 контейнеров
-                "running_list": running_containers[:4],
-                "stopped_list": stopped_containers[:2]
+        except Exception as e:
+            print(f"❌ Ошибка анализа системы: {e}")
+            import traceback
+            traceback.print_exc()
+            timings["total"] = self._elapsed_ms(started)
+            return {
+                "success": False,
+                "error": str(e),
+                "query": query,
+                "analysis": self._get_smart_fallback_with_real_data(query),
+                "findings": [],
+                "suggested_commands": [],
+                "timings_ms": timings
             }
 
-            # 4. Системные сервисы
-            services = self.diagnostic_service.get_services_status()
-            running_services = [s for s in services if s.get('status') == 'running']
-            failed_services = [s for s in services if s.get('status') == 'failed']
+    def _run_collectors(self, query, collectors):
+        """Параллельный запуск сборщиков; результат и отчет {имя: время, успех, ошибка}"""
+        loaders = {name: (lambda name=name: self.snapshots.get([name]).get(name)) for name in SNAPSHOT_COLLECTORS}
+        loaders["logs"] = self._collect_analysis_logs
+        loaders["containers"] = lambda: self._collect_mentioned_containers(query)
+        chosen = [name for name in dict.fromkeys(collectors) if name in loaders]
+
+        def timed(name):
+            started = time.monotonic()
+            try:
+                return loaders[name](), None, self._elapsed_ms(started)
+            except Exception as e:
+                return None, str(e), self._elapsed_ms(started)
+
+        collected, report = {}, {}
+        if not chosen:
+            return collected, report
+        executor = ThreadPoolExecutor(max_workers=len(chosen))
+        futures = {executor.submit(timed, name): name for name in chosen}
+        done, not_done = wait(futures, timeout=settings.AI_ANALYSIS['COLLECT_TIMEOUT'])
+        # Не ждем зависший сборщик: анализ идет по тому, что успело собраться
+        executor.shutdown(wait=False)
+
+        for future in done:
+            data, error, elapsed = future.result()
+            collected[futures[future]] = data
+            report[futures[future]] = {"ms": elapsed, "success": error is None, "error": error}
+        for future in not_done:
+            report[futures[future]] = {"ms": None, "success": False, "error": "Превышено время сбора"}
+        return collected, {name: report[name] for name in chosen}
+
+    def _collect_analysis_logs(self):
+        """Системные логи уровня warning и выше (фильтр выполняется на хосте)"""
+        if self.log_service is None:
+            raise RuntimeError("Сервис логов не подключен к агенту")
+        result = self.log_service.query_logs('system', settings.AI_ANALYSIS['LOG_LINES'], LogFilter(level="warning"))
+        if not result["success"]:
+            raise RuntimeError(result.get("error") or "Не удалось получить логи")
+        return [tuple(entry[field] for field in LOG_FIELDS) for entry in result["entries"]]
+
+    def _collect_mentioned_containers(self, query):
+        """docker inspect и свежие логи контейнеров, упомянутых в запросе"""
+        config = settings.AI_ANALYSIS
+        items = []
+        for container in mentioned_containers(query, self.docker_service.get_inventory(), config['MAX_CONTAINERS']):
+            info = self.docker_service.get_container_info(container["id"])
+            if "error" in info:
+                continue
+            logs = self.docker_service.get_container_logs(container["id"], lines=config['CONTAINER_LOG_LINES'])
+            records = []
+            if logs.get("success") and self.log_service is not None:
+                records = self.log_service.parse_log_buffer(logs.get("logs", ""), "docker")
+            items.append({"info": info, "logs": records})
+        return items
+
+    def _build_analysis_prompt(self, query, system_data, log_summary, containers_summary):
+        """Промпт анализа в пределах бюджета: данные по важности, запрос и формат ответа"""
+        budget = PromptBudget()
+        budget.add("context", """# АНАЛИЗ СИСТЕМЫ
+Ниже РЕАЛЬНЫЕ данные сервера, собранные для этого анализа.""", required=True)
+        for name, text, priority, compressor in self._format_system_sections(system_data):
+            budget.add(name, text, priority=priority, compressor=compressor)
+        if "network" in system_data:
+            budget.add("network", "## 🌐 СЕТЬ\n" + json.dumps(system_data["network"], ensure_ascii=False,
+                                                            separators=(',', ':'), default=str), priority=50)
+        if containers_summary:
+            budget.add("containers", f"## 📦 КОНТЕЙНЕРЫ ИЗ ЗАПРОСА\n{containers_summary}", priority=15)
+        if log_summary:
+            budget.add("logs", f"## 📜 ЛОГИ (warning и выше, по шаблонам)\n{log_summary}", priority=25)
+        budget.add("query", f"# ЗАПРОС\n{query}", required=True)
+        budget.add("instructions", """# ИНСТРУКЦИИ
+1. Опирайся только на данные выше, не придумывай значения
+2. Сначала перечисли находки, каждую отдельной строкой в формате:
+- [критично|внимание|инфо] проблема — рекомендация
+3. Затем дай краткий общий вывод (2-4 предложения)
+4. Команды для проверки и исправления оформляй в `обратных кавычках`
+
+ОТВЕТ:""", required=True)
+
+        prompt, report = budget.compile()
+        print(f"🧮 Промпт анализа: {format_budget_report(report)}")
+        return prompt, report
+
+    @staticmethod
+    def _elapsed_ms(started):
+        return round((time.monotonic() - started) * 1000, 2)
 
-            data["services"] = {
-                "total": len(services),
-                "running": len(running_services),
-                "failed": len(failed_services),
-                "services_list": services[:6]  # Первые 6 сервисов
-            }
+    def _collect_all_real_system_data(self):
+        """Собирает ВСЕ реальные данные системы (из снимка, обновляя устаревшие разделы)"""
+        data = {}
 
-            # 5. Сетевая информация
-            network_info = self.diagnostic_service.get_network_info()
-            data["network"] = network_info
+        try:
+            data = self.snapshots.get()
 
-            print(f"📊 Собраны реальные данные: CPU {data['resources']['cpu_usage']}%, "
-                  f"Память {data['resources']['memory']['usage_percent']}%, "
-                  f"Docker {data['docker']['running']}/{data['docker']['total']}, "
-                  f"Сервисы {data['services']['running']}/{data['services']['total']}")
+            print(f"📊 Собраны реальные данные: CPU {data.get('resources', {}).get('cpu_usage', 0)}%, "
+                  f"Память {data.get('resources', {}).get('memory', {}).get('usage_percent', 0)}%, "
+                  f"Docker {data.get('docker', {}).get('running', 0)}/{data.get('docker', {}).get('total', 0)}, "
+                  f"Сервисы {data.get('services', {}).get('running', 0)}/{data.get('services', {}).get('total', 0)}")
 
         except Exception as e:
             print(f"⚠️ Ошибка сбора реальных данных: {e}")
@@ -167,55 +613,108 @@ class AIAgent:
 
         return data
 
-    def _build_smart_prompt(self, message, system_data):
-        """Строит умный промпт с реальными данными"""
+    def _load_resources(self):
+        """1. Базовые ресурсы"""
+        resources = self.diagnostic_service.get_system_resources()
+        return {
+            "cpu_usage": resources.get('cpu_usage', 0),
+            "memory": {
+                "usage_percent": resources.get('memory', {}).get('usage_percent', 0),
+                "used": resources.get('memory', {}).get('used', 'N/A'),
+                "total": resources.get('memory', {}).get('total', 'N/A')
+            },
+            "disk": {
+                "usage_percent": resources.get('disk', {}).get('usage_percent', 0),
+                "used": resources.get('disk', {}).get('used', 'N/A'),
+                "total": resources.get('disk', {}).get('total', 'N/A')
+            }
+        }
 
-        # Форматируем данные в читаемый вид
-        system_info = self._format_real_system_data(system_data)
+    def _load_processes(self):
+        """2. Процессы (топ по CPU и памяти)"""
+        processes_cpu = self.diagnostic_service.get_running_processes(limit=10, sort_by='cpu')
+        processes_memory = self.diagnostic_service.get_running_processes(limit=10, sort_by='memory')
 
-        prompt = f"""
-# КОНТЕКСТ СИСТЕМЫ
-Ты - умный AI ассистент системы мониторинга. У тебя есть РЕАЛЬНЫЕ данные о текущем состоянии сервера.
+        return {
+            "top_cpu": processes_cpu[:5],
+            "top_memory": processes_memory[:5],
+            "total_count": len(processes_cpu)
+        }
 
-# РЕАЛЬНЫЕ ДАННЫЕ СИСТЕМЫ
-{system_info}
+    def _load_docker(self):
+        """3. Docker контейнеры (общий инвентарь DockerService)"""
+        containers = self.docker_service.get_inventory(max_age=settings.AI_SNAPSHOT_TTL['docker'])
+        running_containers = [c for c in containers if c.get("is_running", False)]
+        stopped_containers = [c for c in containers if not c.get("is_running", False)]
 
-# ЗАПРОС ПОЛЬЗОВАТЕЛЯ
-"{message}"
+        return {
+            "total": len(containers),
+            "running": len(running_containers),
+            "stopped": len(stopped_containers),
+            "containers": containers[:8],  # Первые 8 контейнеров
+            # Полные списки: при нехватке бюджета промпта раздел сжимается
+            "running_list": running_containers,
+            "stopped_list": stopped_containers
+        }
+
+    def _load_services(self):
+        """4. Системные сервисы"""
+        services = self.diagnostic_service.get_services_status()
+        running_services = [s for s in services if s.get('status') == 'running']
+        failed_services = [s for s in services if s.get('status') == 'failed']
 
-# ИСТОРИЯ РАЗГОВОРА
-{self._format_conversation_history()}
+        return {
+            "total": len(services),
+            "running": len(running_services),
+            "failed": len(failed_services),
+            "services_list": services
+        }
+
+    def _build_smart_prompt(self, message, system_data, session_key=DEFAULT_SESSION):
+        """Строит умный промпт с реальными данными в пределах бюджета токенов"""
+        budget = PromptBudget()
+        budget.add("context", """# КОНТЕКСТ СИСТЕМЫ
+Ты - умный AI ассистент системы мониторинга. У тебя есть РЕАЛЬНЫЕ данные о текущем состоянии сервера.
 
-# ИНСТРУКЦИИ
-1. ОТВЕЧАЙ ТОЛЬКО НА ОСНОВЕ РЕАЛЬНЫХ ДАННЫХ ВЫШЕ
-2. Будь полезным и конкретным
-3. Если данных нет для ответа - честно скажи об этом
-4. Используй естественный язык, можно с юмором
-5. Для технических вопросов давай конкретные рекомендации
-6. Предлагай команды только если они действительно нужны
+# РЕАЛЬНЫЕ ДАННЫЕ СИСТЕМЫ""", required=True)
+
+        # Данные системы: важные разделы первыми, длинные списки сжимаются при нехватке места
+        for name, text, priority, compressor in self._format_system_sections(system_data):
+            budget.add(name, text, priority=priority, compressor=compressor)
 
-ОТВЕТ:
-"""
+        budget.add("query", f'# ЗАПРОС ПОЛЬЗОВАТЕЛЯ\n"{message}"', required=True)
+        budget.add("history", f"""# ИСТОРИЯ РАЗГОВОРА
+{self._format_conversation_history(session_key)}""", priority=60,
+                   compressor=lambda text: self._compress_history(session_key), keep="tail")
+        budget.add("instructions", CHAT_INSTRUCTIONS, required=True)
+
+        prompt, report = budget.compile()
+        self.last_prompt_report = report
+        print(f"🧮 Промпт: {format_budget_report(report)}")
         return prompt
 
     def _format_real_system_data(self, system_data):
         """Форматирует реальные данные системы"""
-        lines = []
+        return "\n\n".join(text for _, text, _, _ in self._format_system_sections(system_data))
+
+    def _format_system_sections(self, system_data):
+        """Разделы данных системы: (имя, текст, приоритет, сжатая форма)"""
+        sections = []
 
         # Ресурсы
         if "resources" in system_data:
             res = system_data["resources"]
-            lines.append("## 📊 РЕСУРСЫ")
+            lines = ["## 📊 РЕСУРСЫ"]
             lines.append(f"- CPU: {res['cpu_usage']}% загрузки")
             lines.append(
                 f"- Память: {res['memory']['usage_percent']}% ({res['memory']['used']} / {res['memory']['total']})")
             lines.append(f"- Диск: {res['disk']['usage_percent']}% ({res['disk']['used']} / {res['disk']['total']})")
-            lines.append("")
+            sections.append(("resources", "\n".join(lines), 10, None))
 
         # Процессы
         if "processes" in system_data:
             procs = system_data["processes"]
-            lines.append("## 🔥 ПРОЦЕССЫ")
+            lines = ["## 🔥 ПРОЦЕССЫ"]
             lines.append(f"Всего процессов: {procs['total_count']}")
 
             lines.append("Топ по CPU:")
@@ -227,12 +726,13 @@ class AIAgent:
             for i, proc in enumerate(procs["top_memory"][:3], 1):
                 lines.append(
                     f"  {i}. {proc.get('name', 'N/A')} - {proc.get('memory_percent', 0)}% памяти, {proc.get('cpu_percent', 0)}% CPU")
-            lines.append("")
+
+            sections.append(("processes", "\n".join(lines), 30, lambda text: self._compress_processes_section(procs)))
 
         # Docker
         if "docker" in system_data:
             docker = system_data["docker"]
-            lines.append("## 🐳 DOCKER")
+            lines = ["## 🐳 DOCKER"]
             lines.append(f"Контейнеры: {docker['running']}/{docker['total']} запущено")
 
             if docker["running_list"]:
@@ -244,41 +744,92 @@ class AIAgent:
                 lines.append("Остановленные:")
                 for container in docker["stopped_list"]:
                     lines.append(f"  🔴 {container.get('name', 'N/A')} - {container.get('status', 'N/A')}")
-            lines.append("")
+
+            sections.append(("docker", "\n".join(lines), 20, lambda text: self._compress_docker_section(docker)))
 
         # Сервисы
         if "services" in system_data:
             services = system_data["services"]
-            lines.append("## ⚙️ СЕРВИСЫ")
+            lines = ["## ⚙️ СЕРВИСЫ"]
             lines.append(
                 f"Всего: {services['total']}, запущено: {services['running']}, с ошибками: {services['failed']}")
 
-            for service in services["services_list"][:4]:
+            for service in services["services_list"]:
                 status_icon = "🟢" if service.get('status') == 'running' else "🔴" if service.get(
                     'status') == 'failed' else "🟡"
                 lines.append(f"  {status_icon} {service.get('name', 'N/A')} - {service.get('status', 'N/A')}")
 
+            sections.append(("services", "\n".join(lines), 40, lambda text: self._compress_services_section(services)))
+
+        return sections
+
+    @staticmethod
+    def _compress_docker_section(docker):
+        """Контейнеры одной строкой на состояние, без статусов"""
+        lines = ["## 🐳 DOCKER", f"Контейнеры: {docker['running']}/{docker['total']} запущено"]
+        if docker["running_list"]:
+            lines.append("Запущенные: " + ", ".join(c.get('name', 'N/A') for c in docker["running_list"]))
+        if docker["stopped_list"]:
+            lines.append("Остановленные: " + ", ".join(
+                f"{c.get('name', 'N/A')} ({c.get('status', 'N/A')})" for c in docker["stopped_list"]))
         return "\n".join(lines)
 
-    def _format_conversation_history(self):
-        """Форматирует историю разговора"""
-        if len(self.conversation_history) < 2:
-            return "История пуста"
+    @staticmethod
+    def _compress_processes_section(procs):
+        """Только имена топовых процессов"""
+        def names(items, key):
+            return ", ".join(f"{p.get('name', 'N/A')} {p.get(key, 0)}%" for p in items[:3])
+
+        return "\n".join([
+            "## 🔥 ПРОЦЕССЫ",
+            f"Всего: {procs['total_count']}; CPU: {names(procs['top_cpu'], 'cpu_percent')}; "
+            f"память: {names(procs['top_memory'], 'memory_percent')}"
+        ])
+
+    @staticmethod
+    def _compress_services_section(services):
+        """Работающие сервисы - только числом, проблемные - по именам"""
+        lines = ["## ⚙️ СЕРВИСЫ",
+                 f"Всего: {services['total']}, запущено: {services['running']}, с ошибками: {services['failed']}"]
+        by_status = {}
+        for service in services["services_list"]:
+            if service.get('status') != 'running':
+                by_status.setdefault(service.get('status', 'N/A'), []).append(service.get('name', 'N/A'))
+        for service_status, names in by_status.items():
+            lines.append(f"{service_status}: " + ", ".join(names))
+        return "\n".join(lines)
 
-        history_text = ""
-        recent_history = self.conversation_history[-4:]  # Последние 2 пары
+    def _compress_history(self, session_key):
+        """Только последняя пара реплик, каждая не длиннее 300 символов"""
+        lines = ["# ИСТОРИЯ РАЗГОВОРА"]
+        for msg in self.memory.get_messages(session_key)[-2:]:
+            role = "Пользователь" if msg["role"] == "user" else "Ассистент"
+            content = msg['content'].replace('\n', ' ')
+            lines.append(f"{role}: {content[:300]}{'...' if len(content) > 300 else ''}")
+        return "\n".join(lines)
+
+    def _format_conversation_history(self, session_key=DEFAULT_SESSION):
+        """Форматирует историю разговора: сводка свернутых реплик и последние реплики"""
+        summary = self.memory.get_summary(session_key)
+        messages = self.memory.get_messages(session_key)
+        if len(messages) < 2 and not summary:
+            return "История пуста"
 
-        for msg in recent_history:
+        history_text = f"Ранее в разговоре:\n{summary}\n\n" if summary else ""
+        for msg in messages:
             role = "Пользователь" if msg["role"] == "user" else "Ассистент"
             history_text += f"{role}: {msg['content']}\n"
 
         return history_text
 
-    def _get_ai_response(self, prompt):
-        """Получает ответ от ИИ"""
+    def _get_ai_response(self, prompt, source=None):
+        """Получает ответ от ИИ (source["model"] - ответ дала модель, а не fallback)"""
         try:
             if self.openai_available and self.client:
-                return self._get_openai_response(prompt)
+                response = self._get_openai_response(prompt)
+                if source is not None:
+                    source["model"] = True
+                return response
             else:
                 # Всегда используем умный fallback с реальными данными
                 return self._get_smart_fallback_with_real_data_from_prompt(prompt)
@@ -290,29 +841,11 @@ class AIAgent:
         """Получает ответ от OpenAI"""
         try:
             if OPENAI_NEW_API:
-                response = self.client.chat.completions.create(
-                    model="gpt-4",  # Используем GPT-4
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "Ты - экспертный системный администратор. Отвечай точно на основе предоставленных данных. Будь полезным и конкретным."
-                        },
-                        {"role": "user", "content": prompt}
-                    ],
-                    max_tokens=800,
-                    temperature=0.7,
-                )
-                return response.choices[0].message.content.strip()
+                return self.client.complete(self._chat_messages(prompt), max_tokens=800, temperature=0.7)
             else:
                 response = openai.ChatCompletion.create(
-                    model="gpt-4",
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "Ты - экспертный системный администратор. Отвечай точно на основе предоставленных данных. Будь полезным и конкретным."
-                        },
-                        {"role": "user", "content": prompt}
-                    ],
+                    model=settings.OPENAI_MODEL,
+                    messages=self._chat_messages(prompt),
                     max_tokens=800,
                     temperature=0.7,
                 )
@@ -325,7 +858,7 @@ class AIAgent:
     def _get_smart_fallback_with_real_data(self, message):
         """Умный fallback с реальными данными"""
         try:
-            # Собираем данные заново для fallback
+            # Данные из общего снимка: повторного сбора нет, если разделы свежие
             system_data = self._collect_all_real_system_data()
 
             # Анализируем запрос и формируем ответ на основе реальных данных
@@ -520,17 +1053,27 @@ class AIAgent:
         commands = re.findall(r'`([^`]+)`', response)
         return commands[:3]
 
-    def get_conversation_history(self):
-        return self.conversation_history.copy()
+    def get_conversation_history(self, session_key=DEFAULT_SESSION):
+        return self.memory.get_messages(session_key)
 
-    def clear_conversation_history(self):
-        self.conversation_history = []
+    def clear_conversation_history(self, session_key=DEFAULT_SESSION):
+        self.memory.clear(session_key)
         return True
 
-    def get_status(self):
+    def get_status(self, session_key=DEFAULT_SESSION):
         return {
             "ai_agent_connected": True,
             "openai_available": self.openai_available,
-            "conversation_history_count": len(self.conversation_history),
-            "model": "gpt-4" if self.openai_available else "smart-fallback"
+            "conversation_history_count": len(self.memory.get_messages(session_key)),
+            "conversations": self.memory.stats(),
+            "snapshot": self.snapshots.describe(),
+            "response_cache": self.response_cache.stats(),
+            "prompt": self.last_prompt_report,
+            "streaming": {
+                "ttft_ms": self._latency_summary(self.ttft_samples),
+                "total_ms": self._latency_summary(self.total_samples)
+            },
+            "model": settings.OPENAI_MODEL if self.openai_available else "smart-fallback",
+            "client": self.client.stats() if self.client else None,
+            "tools": {"enabled": self._tools_enabled(), "calls": self.toolbox.stats()}
         }
\ No newline at end of file
@@ -0,0 +1,246 @@
+import hashlib
+import itertools
+import json
+import queue
+import threading
+from datetime import timedelta
+from typing import Dict, List, Tuple, Union
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+from ..models import AnalysisJob
+from .response_cache import normalize_query
+
+# 0 - самый высокий приоритет, как в очереди Celery с redis
+PRIORITIES = {"high": 0, "normal": 5, "low": 9}
+# Сборщики конвейера анализа по виду задачи (None - по намерению запроса)
+JOB_SOURCES = {
+    "system": None,
+    "logs": ("resources", "services", "logs"),
+    "container": ("docker", "containers"),
+}
+
+
+def job_query(kind: str, query: str = "", params: Dict = None) -> str:
+    """Запрос к конвейеру анализа для задачи указанного вида"""
+    params = params or {}
+    if kind == "system":
+        if not query:
+            raise ValueError("Для анализа системы нужен запрос (query)")
+        return query
+    if kind == "logs":
+        return query or "Проанализируй системные логи (warning и выше) и выяви проблемы"
+    if kind == "container":
+        container = params.get("container")
+        if not container:
+            raise ValueError("Для анализа контейнера нужен параметр container")
+        # Имя контейнера в запросе - по нему конвейер находит его inspect и логи
+        return query or (f"Проанализируй состояние Docker контейнера {container}: "
+                         f"ошибки в логах, перезапуски, ресурсы")
+    raise ValueError(f"Неизвестный вид задачи: {kind} (допустимо: {', '.join(JOB_SOURCES)})")
+
+
+def resolve_priority(priority: Union[str, int, None]) -> int:
+    if priority is None or priority == "":
+        return PRIORITIES["normal"]
+    if isinstance(priority, str) and priority in PRIORITIES:
+        return PRIORITIES[priority]
+    try:
+        return max(0, min(9, int(priority)))
+    except (TypeError, ValueError):
+        raise ValueError(f"Неизвестный приоритет: {priority} (high, normal, low или 0-9)")
+
+
+def serialize_job(job: AnalysisJob, include_result: bool = True) -> Dict:
+    data = {
+        "id": job.pk,
+        "kind": job.kind,
+        "query": job.query,
+        "params": job.params,
+        "priority": job.priority,
+        "status": job.status,
+        "progress": job.progress,
+        "stage": job.stage,
+        "batch": job.batch,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+    if include_result:
+        data["result"] = job.result
+    return data
+
+
+class AnalysisJobService:
+    """Очередь фоновых анализов ИИ с приоритетами и дедупликацией
+
+    Задачи хранятся в БД (AnalysisJob), поэтому прогресс и результат можно
+    опрашивать из любого процесса. Одинаковая задача (вид, нормализованный
+    запрос, параметры), которая уже в очереди или выполняется, не создается
+    повторно - возвращается существующая. Выполняет задачи Celery
+    (AI_JOBS['BACKEND'] = 'celery') или пул потоков текущего процесса.
+    """
+
+    def __init__(self, ai_agent, docker_service):
+        self.ai_agent = ai_agent
+        self.docker_service = docker_service
+        self.config = settings.AI_JOBS
+        # (приоритет, порядковый номер, id задачи) для локального пула
+        self._queue = queue.PriorityQueue()
+        self._sequence = itertools.count()
+        self._workers: List[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, query: str = "", params: Dict = None, priority: Union[str, int] = None,
+               batch: str = "") -> Tuple[AnalysisJob, bool]:
+        """Задача и признак, создана ли она (False - уже есть такая же в работе); ValueError при ошибке"""
+        params = params or {}
+        query = job_query(kind, query, params)
+        priority = resolve_priority(priority)
+        dedupe_key = hashlib.sha1(json.dumps([kind, normalize_query(query), params], sort_keys=True,
+                                             ensure_ascii=False).encode('utf-8')).hexdigest()
+        self._expire_stale()
+
+        existing = self._active(dedupe_key)
+        if existing is not None:
+            return existing, False
+        try:
+            with transaction.atomic():
+                job = AnalysisJob.objects.create(kind=kind, query=query, params=params, dedupe_key=dedupe_key,
+                                                 priority=priority, batch=batch)
+        except IntegrityError:
+            # Такую же задачу только что создал параллельный запрос
+            existing = self._active(dedupe_key)
+            if existing is None:
+                raise
+            return existing, False
+
+        self._dispatch(job)
+        return job, True
+
+    def _active(self, dedupe_key: str):
+        return AnalysisJob.objects.filter(dedupe_key=dedupe_key, status__in=AnalysisJob.ACTIVE_STATUSES).first()
+
+    def _expire_stale(self):
+        """Задачи упавшего воркера не должны навсегда блокировать дедупликацию
+
+        Срок выполнения считается от начала работы: задача, которая долго
+        ждет в очереди (ночной пакет с низким приоритетом), не истекает по
+        TIMEOUT. Задача, которую так и не взял ни один воркер (очередь
+        потеряна при перезапуске процесса), истекает через QUEUE_TIMEOUT.
+        """
+        now = timezone.now()
+        AnalysisJob.objects.filter(status='running',
+                                   started_at__lt=now - timedelta(seconds=self.config['TIMEOUT'])).update(
+            status='failed', error="Превышено время выполнения", finished_at=now)
+        AnalysisJob.objects.filter(status='queued',
+                                   created_at__lt=now - timedelta(seconds=self.config['QUEUE_TIMEOUT'])).update(
+            status='failed', error="Задача не дождалась выполнения", finished_at=now)
+
+    def _dispatch(self, job: AnalysisJob):
+        if self.config['BACKEND'] == 'celery':
+            try:
+                from ..tasks import run_analysis_job
+
+                result = run_analysis_job.apply_async(args=[job.pk], priority=job.priority)
+                AnalysisJob.objects.filter(pk=job.pk).update(task_id=result.id or '')
+                return
+            except Exception as e:
+                print(f"⚠️ Celery недоступен, задача {job.pk} выполняется в процессе: {e}")
+
+        self._ensure_workers()
+        self._queue.put((job.priority, next(self._sequence), job.pk))
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._workers = [worker for worker in self._workers if worker.is_alive()]
+            while len(self._workers) < self.config['WORKERS']:
+                worker = threading.Thread(target=self._work, name=f"ai-jobs-{len(self._workers)}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            _, _, job_id = self._queue.get()
+            close_old_connections()
+            try:
+                self.run(job_id)
+            except Exception as e:
+                print(f"❌ Ошибка фоновой задачи {job_id}: {e}")
+            finally:
+                close_old_connections()
+                self._queue.task_done()
+
+    def run(self, job_id: int):
+        """Выполнение задачи (воркер Celery или поток); повторная доставка не запускает ее дважды"""
+        claimed = AnalysisJob.objects.filter(pk=job_id, status='queued').update(
+            status='running', started_at=timezone.now(), stage='plan', progress=5)
+        if not claimed:
+            return
+        job = AnalysisJob.objects.get(pk=job_id)
+        print(f"🧵 Фоновый анализ {job_id} ({job.kind}, приоритет {job.priority})")
+
+        def progress(stage, percent):
+            AnalysisJob.objects.filter(pk=job_id).update(stage=stage, progress=percent)
+
+        try:
+            result = self.ai_agent.analyze_system_state(job.query, sources=JOB_SOURCES[job.kind], progress=progress)
+            AnalysisJob.objects.filter(pk=job_id).update(
+                status='done' if result.get("success") else 'failed',
+                result=result,
+                error=result.get("error", ""),
+                stage='done',
+                progress=100,
+                finished_at=timezone.now()
+            )
+        except Exception as e:
+            AnalysisJob.objects.filter(pk=job_id).update(
+                status='failed', error=str(e), stage='done', finished_at=timezone.now())
+            raise
+
+    def cancel(self, job_id: int) -> bool:
+        """Отмена задачи, которая еще не начала выполняться"""
+        return bool(AnalysisJob.objects.filter(pk=job_id, status='queued').update(
+            status='failed', error="Отменена", finished_at=timezone.now()))
+
+    def review_containers(self, priority: Union[str, int] = None) -> Dict:
+        """Пакетный анализ всех контейнеров (ночной обзор) с низким приоритетом"""
+        batch = f"review-{timezone.now():%Y%m%d-%H%M%S}"
+        created, deduplicated = [], 0
+        for container in self.docker_service.get_inventory(max_age=0):
+            job, is_new = self.submit("container", params={"container": container["name"]},
+                                      priority=priority if priority is not None else self.config['REVIEW_PRIORITY'],
+                                      batch=batch)
+            if is_new:
+                created.append(job.pk)
+            else:
+                deduplicated += 1
+        self.cleanup()
+        print(f"🌙 Обзор контейнеров {batch}: задач {len(created)}, уже в работе {deduplicated}")
+        return {"batch": batch, "jobs": created, "deduplicated": deduplicated}
+
+    def batch_summary(self, batch: str) -> Dict:
+        jobs = list(AnalysisJob.objects.filter(batch=batch).order_by('id'))
+        by_status = {}
+        critical = []
+        for job in jobs:
+            by_status[job.status] = by_status.get(job.status, 0) + 1
+            for finding in (job.result or {}).get("findings", []):
+                if finding.get("severity") == "critical":
+                    critical.append({"job": job.pk, "container": job.params.get("container"),
+                                     "title": finding.get("title")})
+        return {"batch": batch, "total": len(jobs), "by_status": by_status, "critical": critical}
+
+    def cleanup(self) -> int:
+        """Удаление завершенных задач старше KEEP_DAYS"""
+        deadline = timezone.now() - timedelta(days=self.config['KEEP_DAYS'])
+        return AnalysisJob.objects.filter(status__in=('done', 'failed'), finished_at__lt=deadline).delete()[0]
+
+    def stats(self) -> Dict:
+        counts = {status: 0 for status, _ in AnalysisJob.STATUSES}
+        for row in AnalysisJob.objects.values('status').annotate(count=Count('id')):
+            counts[row['status']] = row['count']
+        return {"backend": self.config['BACKEND'], "local_queue": self._queue.qsize(), "jobs": counts}
+
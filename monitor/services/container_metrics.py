@@ -0,0 +1,281 @@
+import re
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from django.conf import settings
+from .ssh_service import SSHService
+
+SIZE_UNITS = {
+    'B': 1, 'KB': 1000, 'MB': 1000 ** 2, 'GB': 1000 ** 3, 'TB': 1000 ** 4,
+    'KIB': 1024, 'MIB': 1024 ** 2, 'GIB': 1024 ** 3, 'TIB': 1024 ** 4,
+}
+SIZE_RE = re.compile(r'([\d.]+)\s*([a-zA-Z]+)')
+
+
+def parse_size(value: str) -> float:
+    """Размер из вывода docker stats (12.5MiB, 1.9GB) в байтах"""
+    match = SIZE_RE.match(value.strip())
+    if not match:
+        return 0.0
+    return float(match.group(1)) * SIZE_UNITS.get(match.group(2).upper(), 1)
+
+
+def parse_percent(value: str) -> float:
+    try:
+        return float(value.strip().rstrip('%'))
+    except ValueError:
+        return 0.0
+
+
+class RingBuffer:
+    """Кольцевой буфер чисел фиксированного размера на основе array"""
+    __slots__ = ('_data', '_start', '_size')
+
+    def __init__(self, capacity: int):
+        self._data = array('d', bytes(8 * capacity))
+        self._start = 0
+        self._size = 0
+
+    def append(self, value: float):
+        capacity = len(self._data)
+        if self._size < capacity:
+            self._data[(self._start + self._size) % capacity] = value
+            self._size += 1
+        else:
+            self._data[self._start] = value
+            self._start = (self._start + 1) % capacity
+
+    def values(self, last: int = None) -> List[float]:
+        capacity = len(self._data)
+        count = self._size if last is None else min(last, self._size)
+        offset = self._size - count
+        return [self._data[(self._start + offset + i) % capacity] for i in range(count)]
+
+    def latest(self) -> Optional[float]:
+        if not self._size:
+            return None
+        return self._data[(self._start + self._size - 1) % len(self._data)]
+
+    def __len__(self):
+        return self._size
+
+
+class ContainerSeries:
+    """История одного контейнера: числовые ряды и события перезапусков"""
+    __slots__ = ('name', 'times', 'cpu', 'memory', 'memory_limit', 'memory_percent',
+                 'restart_count', 'started_at', 'status', 'exit_code', 'oom_killed', 'restarts')
+
+    def __init__(self, name: str, capacity: int):
+        self.name = name
+        self.times = RingBuffer(capacity)
+        self.cpu = RingBuffer(capacity)
+        self.memory = RingBuffer(capacity)
+        self.memory_limit = 0.0
+        self.memory_percent = RingBuffer(capacity)
+        self.restart_count = None
+        self.started_at = None
+        self.status = ""
+        self.exit_code = 0
+        self.oom_killed = False
+        # (время, код выхода) каждого обнаруженного перезапуска
+        self.restarts = deque(maxlen=capacity)
+
+
+class ContainerMetricsSampler:
+    """Периодический сбор статистики контейнеров с хранением истории в памяти"""
+
+    STATS_COMMAND = ("docker stats --no-stream --format "
+                     "'{{.Name}}|{{.CPUPerc}}|{{.MemUsage}}|{{.MemPerc}}'")
+    # Ошибка docker ps - неуспех (история не трогается); без контейнеров inspect не вызывается
+    # и пустой успешный вывод удаляет всю историю; контейнер, удаленный между ps и inspect,
+    # просто выпадает из вывода
+    INSPECT_COMMAND = ("ids=$(docker ps -aq) || exit 1; [ -z \"$ids\" ] || docker inspect --format "
+                       "'{{.Name}}|{{.RestartCount}}|{{.State.Status}}|{{.State.ExitCode}}|"
+                       "{{.State.OOMKilled}}|{{.State.StartedAt}}' $ids 2>/dev/null || true")
+
+    def __init__(self, ssh_service: SSHService):
+        self.ssh = ssh_service
+        self.config = settings.CONTAINER_METRICS
+        self.series: Dict[str, ContainerSeries] = {}
+        self.last_sample_at = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Запуск фонового сбора (если включен интервалом в настройках)"""
+        interval = self.config['INTERVAL']
+        if interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+
+        def loop():
+            while True:
+                if self.ssh.connected:
+                    try:
+                        self.sample()
+                    except Exception as e:
+                        print(f"⚠️ Ошибка сбора метрик контейнеров: {e}")
+                time.sleep(interval)
+
+        self._thread = threading.Thread(target=loop, daemon=True, name="container-metrics")
+        self._thread.start()
+
+    def sample_if_stale(self):
+        """Сбор по запросу, если последний замер старше интервала"""
+        interval = self.config['INTERVAL'] or 30
+        if time.time() - self.last_sample_at >= interval:
+            self.sample()
+
+    def sample(self):
+        """Один замер: docker stats и docker inspect выполняются параллельно"""
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            stats_future = executor.submit(self.ssh.execute_command, self.STATS_COMMAND)
+            inspect_future = executor.submit(self.ssh.execute_command, self.INSPECT_COMMAND)
+            stats_result = stats_future.result()
+            inspect_result = inspect_future.result()
+
+        now = time.time()
+        with self._lock:
+            if inspect_result["success"]:
+                present = set()
+                for line in inspect_result["output"].split('\n'):
+                    parts = line.strip().split('|')
+                    if len(parts) >= 6:
+                        self._record_state(now, parts)
+                        present.add(parts[0].lstrip('/'))
+                # inspect охватывает все контейнеры (docker ps -a): историю удаленных не храним
+                for name in [name for name in self.series if name not in present]:
+                    del self.series[name]
+
+            if stats_result["success"]:
+                for line in stats_result["output"].split('\n'):
+                    parts = line.strip().split('|')
+                    if len(parts) >= 4 and (not inspect_result["success"] or parts[0] in self.series):
+                        self._record_stats(now, parts)
+
+            self.last_sample_at = now
+
+    def _get_series(self, name: str) -> ContainerSeries:
+        series = self.series.get(name)
+        if series is None:
+            series = ContainerSeries(name, self.config['HISTORY'])
+            self.series[name] = series
+        return series
+
+    def _record_state(self, now: float, parts: List[str]):
+        name = parts[0].lstrip('/')
+        series = self._get_series(name)
+        try:
+            restart_count = int(parts[1])
+            exit_code = int(parts[3])
+        except ValueError:
+            return
+
+        # Перезапуск виден по росту RestartCount или по смене StartedAt (ручной restart)
+        restarted = series.started_at is not None and (
+            parts[5] != series.started_at or restart_count > (series.restart_count or 0))
+        if restarted:
+            series.restarts.append((now, series.exit_code if exit_code == 0 else exit_code))
+
+        series.restart_count = restart_count
+        series.started_at = parts[5]
+        series.status = parts[2]
+        series.exit_code = exit_code
+        series.oom_killed = parts[4] == "true"
+
+    def _record_stats(self, now: float, parts: List[str]):
+        series = self._get_series(parts[0])
+        used, _, limit = parts[2].partition('/')
+        series.times.append(now)
+        series.cpu.append(parse_percent(parts[1]))
+        series.memory.append(parse_size(used))
+        series.memory_percent.append(parse_percent(parts[3]))
+        series.memory_limit = parse_size(limit) if limit else 0.0
+
+    def get_summary(self) -> List[Dict]:
+        """Последние значения и признаки проблем по всем контейнерам"""
+        with self._lock:
+            return [self._summarize(series) for series in self.series.values()]
+
+    def get_history(self, name: str, last: int = None) -> Optional[Dict]:
+        """История одного контейнера по имени без обращения к docker"""
+        with self._lock:
+            series = self.series.get(name)
+            if series is None:
+                return None
+            summary = self._summarize(series)
+            summary["history"] = {
+                "timestamps": series.times.values(last),
+                "cpu_percent": series.cpu.values(last),
+                "memory_bytes": series.memory.values(last),
+                "memory_percent": series.memory_percent.values(last),
+            }
+            summary["restart_events"] = [
+                {"timestamp": ts, "exit_code": code} for ts, code in series.restarts
+            ]
+            return summary
+
+    def _summarize(self, series: ContainerSeries) -> Dict:
+        now = time.time()
+        window = self.config['CRASH_LOOP_WINDOW']
+        recent_restarts = sum(1 for ts, _ in series.restarts if now - ts <= window)
+        memory_percent = series.memory_percent.latest()
+        leak = self._memory_trend(series)
+
+        flags = []
+        if series.status == "restarting" or recent_restarts >= self.config['CRASH_LOOP_RESTARTS']:
+            flags.append("crash_loop")
+        if series.oom_killed or (memory_percent is not None and memory_percent >= self.config['OOM_PERCENT']):
+            flags.append("near_oom")
+        if leak:
+            flags.append("memory_leak")
+
+        return {
+            "name": series.name,
+            "status": series.status,
+            "cpu_percent": series.cpu.latest(),
+            "memory_bytes": series.memory.latest(),
+            "memory_limit_bytes": series.memory_limit,
+            "memory_percent": memory_percent,
+            "restart_count": series.restart_count,
+            "restarts_in_window": recent_restarts,
+            "exit_code": series.exit_code,
+            "oom_killed": series.oom_killed,
+            "samples": len(series.times),
+            "memory_trend": leak,
+            "flags": flags
+        }
+
+    def _memory_trend(self, series: ContainerSeries) -> Optional[Dict]:
+        """Линейный тренд памяти; признак утечки - устойчивый рост за окно"""
+        window = self.config['LEAK_SAMPLES']
+        times = series.times.values(window)
+        memory = series.memory.values(window)
+        if len(memory) < window or memory[0] <= 0:
+            return None
+
+        n = len(memory)
+        mean_t = sum(times) / n
+        mean_m = sum(memory) / n
+        cov = sum((t - mean_t) * (m - mean_m) for t, m in zip(times, memory))
+        var_t = sum((t - mean_t) ** 2 for t in times)
+        var_m = sum((m - mean_m) ** 2 for m in memory)
+        if var_t == 0 or var_m == 0:
+            return None
+
+        slope = cov / var_t
+        r_squared = cov * cov / (var_t * var_m)
+        growth = (memory[-1] - memory[0]) / memory[0]
+        if slope <= 0 or r_squared < 0.8 or growth < self.config['LEAK_MIN_GROWTH']:
+            return None
+
+        trend = {
+            "bytes_per_hour": round(slope * 3600),
+            "r_squared": round(r_squared, 3),
+            "growth_percent": round(growth * 100, 1)
+        }
+        if series.memory_limit > memory[-1]:
+            trend["hours_to_limit"] = round((series.memory_limit - memory[-1]) / slope / 3600, 1)
+        return trend
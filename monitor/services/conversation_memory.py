@@ -0,0 +1,200 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from ..models import Conversation, ConversationMessage
+from .prompt_budget import estimate_tokens
+
+SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s')
+ROLE_NAMES = {"user": "Пользователь", "assistant": "Ассистент"}
+
+
+class SessionState:
+    """Разговор одной сессии в памяти: сводка старых реплик и последние реплики"""
+    __slots__ = ('session_key', 'summary', 'messages', 'tokens', 'conversation_id', 'lock')
+
+    def __init__(self, session_key: str):
+        self.session_key = session_key
+        self.summary = ""
+        # {"id", "role", "content", "tokens"}
+        self.messages: List[Dict] = []
+        self.tokens = 0
+        self.conversation_id: Optional[int] = None
+        self.lock = threading.Lock()
+
+
+class ConversationMemory:
+    """История разговоров с ИИ по сессиям с ограниченным объемом
+
+    Каждая сессия хранится в БД (Conversation + ConversationMessage) и
+    загружается при первом обращении; в памяти держится LRU горячих сессий.
+    Когда реплики сессии превышают COMPACT_TOKENS, старые реплики сворачиваются
+    в краткую сводку (первые предложения), а в БД остаются сводка и
+    последние KEEP_RECENT реплик. Без БД память работает только в процессе.
+    """
+
+    def __init__(self):
+        self.config = settings.AI_CONVERSATION
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db_available = self.config['PERSIST']
+        self.compactions = 0
+
+    def _state(self, session_key: str) -> SessionState:
+        with self._lock:
+            state = self._sessions.get(session_key)
+            if state is not None:
+                self._sessions.move_to_end(session_key)
+                return state
+            state = SessionState(session_key)
+            self._sessions[session_key] = state
+            while len(self._sessions) > self.config['MAX_SESSIONS']:
+                # Вытесненная сессия при следующем обращении загрузится из БД
+                self._sessions.popitem(last=False)
+            # Загрузка под блокировкой сессии: параллельный запрос той же сессии ее дождется
+            state.lock.acquire()
+
+        try:
+            self._load(state)
+        finally:
+            state.lock.release()
+        return state
+
+    def _load(self, state: SessionState):
+        if not self._db_available:
+            return
+        try:
+            conversation = Conversation.objects.filter(session_key=state.session_key).first()
+            if conversation is None:
+                return
+            state.conversation_id = conversation.pk
+            state.summary = conversation.summary
+            state.messages = [
+                {"id": pk, "role": role, "content": content, "tokens": tokens}
+                for pk, role, content, tokens in conversation.messages.order_by('id')
+                .values_list('id', 'role', 'content', 'tokens')
+            ]
+            state.tokens = sum(message["tokens"] for message in state.messages)
+        except DatabaseError as e:
+            self._disable_db(e)
+
+    def append(self, session_key: str, role: str, content: str) -> Dict:
+        """Добавляет реплику; возвращенную реплику можно отменить через discard()"""
+        state = self._state(session_key)
+        with state.lock:
+            message = {"id": None, "role": role, "content": content, "tokens": estimate_tokens(content)}
+            state.messages.append(message)
+            state.tokens += message["tokens"]
+            self._save_message(state, message)
+            if state.tokens > self.config['COMPACT_TOKENS']:
+                self._compact(state)
+            return message
+
+    def discard(self, session_key: str, message: Dict) -> bool:
+        """Убирает реплику из истории (например, вопрос, на который не было ответа)
+
+        Реплика, уже свернутая в сводку, не удаляется - возвращается False.
+        """
+        state = self._state(session_key)
+        with state.lock:
+            if not any(item is message for item in state.messages):
+                return False
+            state.messages = [item for item in state.messages if item is not message]
+            state.tokens -= message["tokens"]
+            if self._db_available and message["id"] is not None:
+                try:
+                    ConversationMessage.objects.filter(pk=message["id"]).delete()
+                except DatabaseError as e:
+                    self._disable_db(e)
+            return True
+
+    def _save_message(self, state: SessionState, message: Dict):
+        if not self._db_available:
+            return
+        try:
+            if state.conversation_id is None:
+                conversation, _ = Conversation.objects.get_or_create(session_key=state.session_key)
+                state.conversation_id = conversation.pk
+            message["id"] = ConversationMessage.objects.create(
+                conversation_id=state.conversation_id,
+                role=message["role"],
+                content=message["content"],
+                tokens=message["tokens"]
+            ).pk
+            Conversation.objects.filter(pk=state.conversation_id).update(updated_at=timezone.now())
+        except DatabaseError as e:
+            self._disable_db(e)
+
+    def _compact(self, state: SessionState):
+        """Старые реплики - в сводку; остаются последние KEEP_RECENT"""
+        keep = self.config['KEEP_RECENT']
+        old, state.messages = state.messages[:-keep], state.messages[-keep:]
+        if not old:
+            return
+
+        lines = [line for line in state.summary.split('\n') if line]
+        for message in old:
+            lines.append(f"{ROLE_NAMES.get(message['role'], message['role'])}: "
+                         f"{self._first_sentence(message['content'])}")
+        # Сводка тоже ограничена: самые старые строки уходят первыми
+        while len(lines) > 1 and estimate_tokens('\n'.join(lines)) > self.config['SUMMARY_TOKENS']:
+            lines.pop(0)
+        state.summary = '\n'.join(lines)
+        state.tokens = sum(message["tokens"] for message in state.messages)
+        self.compactions += 1
+
+        if self._db_available and state.conversation_id is not None:
+            try:
+                with transaction.atomic():
+                    ConversationMessage.objects.filter(
+                        pk__in=[message["id"] for message in old if message["id"] is not None]).delete()
+                    Conversation.objects.filter(pk=state.conversation_id).update(
+                        summary=state.summary, updated_at=timezone.now())
+            except DatabaseError as e:
+                self._disable_db(e)
+
+    def _first_sentence(self, text: str) -> str:
+        text = ' '.join(text.split())
+        sentence = SENTENCE_END_RE.split(text, 1)[0]
+        limit = self.config['SUMMARY_LINE_CHARS']
+        return sentence if len(sentence) <= limit else sentence[:limit].rstrip() + "..."
+
+    def _disable_db(self, error: Exception):
+        if self._db_available:
+            print(f"⚠️ История разговоров без БД (только в памяти процесса): {error}")
+        self._db_available = False
+
+    def get_messages(self, session_key: str) -> List[Dict]:
+        state = self._state(session_key)
+        with state.lock:
+            return [{"role": message["role"], "content": message["content"]} for message in state.messages]
+
+    def get_summary(self, session_key: str) -> str:
+        state = self._state(session_key)
+        with state.lock:
+            return state.summary
+
+    def clear(self, session_key: str):
+        state = self._state(session_key)
+        with state.lock:
+            state.summary = ""
+            state.messages = []
+            state.tokens = 0
+            if self._db_available and state.conversation_id is not None:
+                try:
+                    Conversation.objects.filter(pk=state.conversation_id).delete()
+                except DatabaseError as e:
+                    self._disable_db(e)
+            state.conversation_id = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hot_sessions": len(self._sessions),
+                "max_sessions": self.config['MAX_SESSIONS'],
+                "persist": self._db_available,
+                "compactions": self.compactions
+            }
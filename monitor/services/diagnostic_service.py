@@ -2,11 +2,13 @@ import re
 import time
 from typing import Dict, List, Optional
 from .ssh_service import SSHService
+from .host_facts import HostFactsService
 
 
 class DiagnosticService:
-    def __init__(self, ssh_service: SSHService):
+    def __init__(self, ssh_service: SSHService, host_facts: HostFactsService = None):
         self.ssh = ssh_service
+        self.facts = host_facts or HostFactsService(ssh_service)
 
     def get_system_resources(self):
         """Получение информации о системных ресурсах с правильным расчетом CPU"""
@@ -250,8 +252,10 @@ class DiagnosticService:
 
     def get_network_info(self) -> Dict:
         """Получение сетевой информации"""
+        # ss или netstat - что есть на хосте (ss предпочтительнее)
+        network_tool = self.facts.get().network_tool or "netstat"
         commands = {
-            "connections": "netstat -tulpn",
+            "connections": f"{network_tool} -tulpn",
             "interfaces": "ip addr show",
             "bandwidth": "cat /proc/net/dev | head -5"
         }
@@ -1,40 +1,156 @@
 import re
 import json
-from typing import Dict, List, Optional
+import time
+import base64
+import heapq
+import shlex
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional, Tuple
+from django.conf import settings
 from .ssh_service import SSHService
+from ..utils.cache import TTLCache
+
+# Метка времени docker logs --timestamps (RFC3339Nano, всегда в UTC)
+DOCKER_TIMESTAMP_RE = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?Z$')
+
+
+def split_docker_timestamp(line: str) -> Tuple[str, str]:
+    """Отделяет метку времени --timestamps от текста строки лога"""
+    timestamp, _, text = line.partition(' ')
+    if DOCKER_TIMESTAMP_RE.match(timestamp):
+        return timestamp, text
+    return "", line
+
+
+def encode_log_cursor(timestamp: str, seen: int) -> str:
+    """Упаковывает позицию в логе в непрозрачный курсор"""
+    raw = f"{timestamp}|{seen}".encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_log_cursor(cursor: str) -> Optional[Tuple[str, int]]:
+    """Распаковывает курсор; None, если курсор поврежден"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, _, seen = base64.urlsafe_b64decode(padded).decode('ascii').partition('|')
+        if not DOCKER_TIMESTAMP_RE.match(timestamp):
+            return None
+        return timestamp, int(seen)
+    except (ValueError, UnicodeDecodeError):
+        return None
 
 
 class DockerService:
+    VALID_ACTIONS = ["start", "stop", "restart", "pause", "unpause"]
+
     def __init__(self, ssh_service: SSHService):
         self.ssh = ssh_service
+        self.cache = TTLCache()
+        self._generation = ssh_service.generation
+
+    def _cache_key(self, name: str) -> str:
+        """Ключ кэша в пределах SSH подключения
+
+        Переподключение (возможно, к другому хосту) сбрасывает кэш, а номер
+        подключения в ключе не дает загрузке, начатой до переподключения,
+        записать данные прежнего хоста под новым ключом.
+        """
+        generation = self.ssh.generation
+        if generation != self._generation:
+            self._generation = generation
+            self.cache.invalidate()
+        return f"{generation}:{name}"
 
     def list_containers(self, all_containers: bool = False) -> List[Dict]:
         """Получение списка Docker контейнеров"""
+        try:
+            return self._ps(all_containers)
+        except RuntimeError:
+            return []
+
+    def _ps(self, all_containers: bool) -> List[Dict]:
+        """docker ps; RuntimeError, если команда не выполнилась"""
+        # Ключ до выполнения команды: после переподключения во время запроса список прежнего хоста не кэшируется
+        inventory_key = self._cache_key("inventory")
         if all_containers:
             command = "docker ps -a --format '{{.ID}}|{{.Names}}|{{.Image}}|{{.Status}}|{{.Ports}}'"
         else:
             command = "docker ps --format '{{.ID}}|{{.Names}}|{{.Image}}|{{.Status}}|{{.Ports}}'"
 
         result = self.ssh.execute_command(command)
+        if not result["success"]:
+            raise RuntimeError(result["error"] or result["output"] or "docker ps не выполнился")
+
         containers = []
+        for line in result["output"].split('\n'):
+            if line.strip():
+                parts = line.split('|')
+                if len(parts) >= 5:
+                    container = {
+                        "id": parts[0][:12],  # Берем короткий ID
+                        "name": parts[1],
+                        "image": parts[2],
+                        "status": parts[3],
+                        "ports": parts[4],
+                        "is_running": "Up" in parts[3]
+                    }
+                    containers.append(container)
 
-        if result["success"] and result["output"]:
-            for line in result["output"].split('\n'):
-                if line.strip():
-                    parts = line.split('|')
-                    if len(parts) >= 5:
-                        container = {
-                            "id": parts[0][:12],  # Берем короткий ID
-                            "name": parts[1],
-                            "image": parts[2],
-                            "status": parts[3],
-                            "ports": parts[4],
-                            "is_running": "Up" in parts[3]
-                        }
-                        containers.append(container)
+        if all_containers:
+            # Любой свежий полный список обновляет общий инвентарь
+            self.cache.set(inventory_key, containers)
 
         return containers
 
+    def get_inventory(self, max_age: float = None) -> List[Dict]:
+        """Общий инвентарь всех контейнеров (docker ps -a) с ограничением по возрасту
+
+        Ошибка docker ps не кэшируется: отдается прежний (устаревший) инвентарь,
+        а если его нет - пустой список, и следующий вызов повторит команду.
+        """
+        if max_age is None:
+            max_age = settings.DOCKER_CACHE_TTL['INVENTORY']
+        key = self._cache_key("inventory")
+        try:
+            return self.cache.get(key, lambda: self._ps(all_containers=True), ttl=max_age)
+        except RuntimeError as e:
+            print(f"⚠️ Инвентарь контейнеров не обновлен: {e}")
+            previous = self.cache.peek(key)
+            return previous if previous is not None else []
+
+    @staticmethod
+    def find_container(reference: str, inventory: List[Dict]) -> Optional[Dict]:
+        """Контейнер инвентаря по имени, ID или префиксу ID (не короче 4 символов)"""
+        if not reference:
+            return None
+        for container in inventory:
+            if reference in (container.get("name"), container.get("id")):
+                return container
+        if len(reference) >= 4:
+            return next((c for c in inventory if c.get("id", "").startswith(reference)), None)
+        return None
+
+    def match_inventory(self, references: List[str]) -> Tuple[List[Dict], List[str]]:
+        """Контейнеры инвентаря по ссылкам (имя, ID, префикс ID) и ссылки, которых нет в инвентаре
+
+        Если что-то не найдено, инвентарь перечитывается один раз: контейнер
+        мог быть создан после последнего обновления кэша.
+        """
+        inventory = self.get_inventory()
+        matched = [self.find_container(reference, inventory) for reference in references]
+        if None in matched:
+            inventory = self.get_inventory(max_age=0)
+            matched = [self.find_container(reference, inventory) for reference in references]
+
+        found, unknown = [], []
+        for reference, container in zip(references, matched):
+            if container is None:
+                unknown.append(reference)
+            elif container not in found:
+                found.append(container)
+        return found, unknown
+
     def get_container_info(self, container_id: str) -> Dict:
         """Получение детальной информации о контейнере"""
         # Базовая информация
@@ -83,9 +199,9 @@ class DockerService:
         """Получение логов контейнера"""
         if follow:
             # Для реального времени - здесь будет WebSocket логика
-            command = f"docker logs {container_id} --tail {lines} -f 2>&1"
+            command = f"docker logs {shlex.quote(container_id)} --tail {int(lines)} -f 2>&1"
         else:
-            command = f"docker logs {container_id} --tail {lines} 2>&1"
+            command = f"docker logs {shlex.quote(container_id)} --tail {int(lines)} 2>&1"
 
         result = self.ssh.execute_command(command)
 
@@ -97,6 +213,134 @@ class DockerService:
             "lines": lines
         }
 
+    def get_container_logs_incremental(self, container_id: str, cursor: str = None, lines: int = 50) -> Dict:
+        """Инкрементальное получение логов контейнера по курсору
+
+        Без курсора возвращает последние lines строк. С курсором запрашивает
+        только строки начиная с сохраненной метки времени (--since) и
+        отбрасывает уже отданные строки с той же меткой, т.к. --since
+        включает границу.
+        """
+        position = decode_log_cursor(cursor) if cursor else None
+        if cursor and position is None:
+            return {
+                "success": False,
+                "logs": "",
+                "error": "Некорректный курсор",
+                "invalid_cursor": True,
+                "container_id": container_id
+            }
+
+        # Имя приходит из URL - в команду только в кавычках
+        quoted = shlex.quote(container_id)
+        if position:
+            since, skip = position
+            command = f"docker logs {quoted} --timestamps --since {since} 2>&1"
+        else:
+            since, skip = "", 0
+            command = f"docker logs {quoted} --timestamps --tail {int(lines)} 2>&1"
+
+        result = self.ssh.execute_command(command)
+        if not result["success"]:
+            return {
+                "success": False,
+                "logs": "",
+                "error": result["error"] or result["output"],
+                "container_id": container_id
+            }
+
+        new_lines = []
+        last_timestamp, seen = since, 0
+        skipping = False
+        for line in result["output"].split('\n'):
+            if not line:
+                continue
+            timestamp, text = split_docker_timestamp(line)
+            if not timestamp:
+                # Продолжение многострочной записи без своей метки
+                if not skipping:
+                    new_lines.append(text)
+                continue
+            if timestamp == last_timestamp:
+                seen += 1
+            else:
+                last_timestamp, seen = timestamp, 1
+            skipping = timestamp == since and seen <= skip
+            if not skipping:
+                new_lines.append(text)
+
+        if last_timestamp == since:
+            seen = max(seen, skip)
+
+        return {
+            "success": True,
+            "logs": '\n'.join(new_lines),
+            "error": result["error"],
+            "container_id": container_id,
+            "lines": len(new_lines),
+            "cursor": encode_log_cursor(last_timestamp, seen) if last_timestamp else cursor
+        }
+
+    def get_merged_logs(self, containers: List[str] = None, lines: int = 50, parallelism: int = 8) -> Dict:
+        """Объединенные логи нескольких контейнеров в порядке времени
+
+        Каждый контейнер читается параллельно (не больше lines строк с каждого),
+        затем потоки сливаются кучей от новых к старым и обрезаются до lines
+        строк, без сортировки всего объема. Явно указанные контейнеры
+        сверяются с инвентарем; неизвестные попадают в errors без запроса.
+        """
+        errors = {}
+        if containers is None:
+            containers = [c["name"] for c in self.get_inventory() if c["is_running"]]
+        else:
+            found, unknown = self.match_inventory(containers)
+            errors.update({container: "Контейнер не найден" for container in unknown})
+            containers = [container["name"] for container in found]
+        if not containers:
+            return {"success": not errors, "logs": "", "entries": [], "containers": [], "errors": errors}
+
+        def fetch(container):
+            result = self.ssh.execute_command(
+                f"docker logs {shlex.quote(container)} --timestamps --tail {int(lines)} 2>&1")
+            return container, result
+
+        streams = []
+        with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(containers)))) as executor:
+            for container, result in executor.map(fetch, containers):
+                if result["success"]:
+                    streams.append(self._iter_timestamped_reversed(container, result["output"]))
+                else:
+                    errors[container] = result["error"] or result["output"]
+
+        newest_first = heapq.merge(*streams, key=lambda entry: entry[0], reverse=True)
+        entries = list(islice(newest_first, lines))
+        entries.reverse()
+
+        label_width = max((len(name) for name in containers), default=0)
+        return {
+            "success": bool(streams) or not errors,
+            "logs": '\n'.join(f"{ts} [{name.ljust(label_width)}] {text}" for ts, name, text in entries),
+            "entries": [{"timestamp": ts, "container": name, "message": text} for ts, name, text in entries],
+            "containers": containers,
+            "errors": errors
+        }
+
+    @staticmethod
+    def _iter_timestamped_reversed(container: str, output: str) -> Iterator[Tuple[str, str, str]]:
+        """Строки docker logs --timestamps от новых к старым: (метка, контейнер, текст)"""
+        records = []
+        for line in output.split('\n'):
+            if not line:
+                continue
+            timestamp, text = split_docker_timestamp(line)
+            if timestamp or not records:
+                records.append((timestamp, container, text))
+            else:
+                # Строка без метки - продолжение предыдущей записи
+                prev_ts, _, prev_text = records[-1]
+                records[-1] = (prev_ts, container, f"{prev_text}\n{text}")
+        return reversed(records)
+
     def get_container_stats(self, container_id: str) -> Dict:
         """Получение статистики контейнера"""
         command = f"docker stats {container_id} --no-stream --format json"
@@ -124,7 +368,7 @@ class DockerService:
 
     def container_action(self, container_id: str, action: str) -> Dict:
         """Выполнение действия с контейнером"""
-        valid_actions = ["start", "stop", "restart", "pause", "unpause"]
+        valid_actions = self.VALID_ACTIONS
 
         if action not in valid_actions:
             return {
@@ -132,8 +376,10 @@ class DockerService:
                 "error": f"Недопустимое действие: {action}. Допустимые: {', '.join(valid_actions)}"
             }
 
-        command = f"docker {action} {container_id}"
+        command = f"docker {action} {shlex.quote(container_id)}"
         result = self.ssh.execute_command(command)
+        if result["success"]:
+            self.cache.invalidate(self._cache_key("inventory"))
 
         return {
             "success": result["success"],
@@ -142,27 +388,94 @@ class DockerService:
             "error": result["error"]
         }
 
+    def resolve_containers(self, containers: List[str] = None, label: str = None,
+                           project: str = None) -> List[str]:
+        """Получение списка контейнеров по явному списку, метке или compose-проекту"""
+        selected = [c for c in (containers or []) if c]
+
+        filters = []
+        if label:
+            filters.append(f"label={label}")
+        if project:
+            filters.append(f"label=com.docker.compose.project={project}")
+
+        for docker_filter in filters:
+            command = f"docker ps -a --filter {shlex.quote(docker_filter)} --format '{{{{.Names}}}}'"
+            result = self.ssh.execute_command(command)
+            if result["success"] and result["output"]:
+                selected.extend(name for name in result["output"].split('\n') if name.strip())
+
+        # Убираем дубликаты, сохраняя порядок
+        return list(dict.fromkeys(selected))
+
+    def bulk_container_action(self, containers: List[str], action: str, parallelism: int = 4) -> Iterator[Dict]:
+        """Параллельное выполнение действия над несколькими контейнерами
+
+        Результаты отдаются по мере завершения, а не в исходном порядке.
+        Действие выполняется только для контейнеров из инвентаря.
+        """
+        found, unknown = self.match_inventory(containers)
+        for container_id in unknown:
+            yield {
+                "success": False,
+                "container": container_id,
+                "action": action,
+                "error": f"Контейнер {container_id} не найден",
+                "duration": 0
+            }
+        containers = [container["name"] for container in found]
+
+        def run(container_id):
+            started = time.time()
+            result = self.container_action(container_id, action)
+            result["container"] = container_id
+            result["action"] = action
+            result["duration"] = round(time.time() - started, 3)
+            return result
+
+        with ThreadPoolExecutor(max_workers=max(1, parallelism)) as executor:
+            futures = {executor.submit(run, container_id): container_id for container_id in containers}
+            for future in as_completed(futures):
+                try:
+                    yield future.result()
+                except Exception as e:
+                    yield {
+                        "success": False,
+                        "container": futures[future],
+                        "action": action,
+                        "error": str(e),
+                        "duration": 0
+                    }
+
     def get_system_info(self) -> Dict:
-        """Получение информации о Docker системе"""
-        commands = {
-            "version": "docker version --format json",
-            "info": "docker system info --format json",
-            "df": "docker system df --format json"
+        """Получение информации о Docker системе
+
+        Команды выполняются параллельно и кэшируются с разным временем жизни:
+        версия меняется редко, info - чаще, а медленный df обновляется в фоне.
+        """
+        ttl = settings.DOCKER_CACHE_TTL
+        sections = {
+            "version": ("docker version --format json", ttl['VERSION'], False),
+            "info": ("docker system info --format json", ttl['INFO'], False),
+            "df": ("docker system df --format json", ttl['DF'], True),
         }
 
+        def collect(key):
+            command, section_ttl, background = sections[key]
+            return self.cache.get(self._cache_key(f"system:{key}"), lambda: self._run_json_command(command),
+                                  ttl=section_ttl, background=background)
+
         results = {}
-        for key, command in commands.items():
-            result = self.ssh.execute_command(command)
-            if result["success"] and result["output"]:
+        with ThreadPoolExecutor(max_workers=len(sections) + 1) as executor:
+            inventory_future = executor.submit(self.get_inventory)
+            futures = {key: executor.submit(collect, key) for key in sections}
+            for key, future in futures.items():
                 try:
-                    results[key] = json.loads(result["output"])
-                except json.JSONDecodeError:
-                    results[key] = result["output"]
-            else:
-                results[key] = {"error": result["error"]}
+                    results[key] = future.result()
+                except Exception as e:
+                    results[key] = {"error": str(e)}
+            containers_all = inventory_future.result()
 
-        # Получаем общее количество контейнеров
-        containers_all = self.list_containers(all_containers=True)
         containers_running = [c for c in containers_all if c["is_running"]]
 
         return {
@@ -174,6 +487,20 @@ class DockerService:
             "disk_usage": results.get("df", {})
         }
 
+    def _run_json_command(self, command: str):
+        """Выполняет команду и разбирает JSON; ошибки не кэшируются"""
+        result = self.ssh.execute_command(command)
+        if not result["success"] or not result["output"]:
+            raise RuntimeError(result["error"] or f"Пустой ответ: {command}")
+        try:
+            return json.loads(result["output"])
+        except json.JSONDecodeError:
+            # docker system df --format json выдает по объекту на строку
+            try:
+                return [json.loads(line) for line in result["output"].split('\n') if line.strip()]
+            except json.JSONDecodeError:
+                return result["output"]
+
     def get_container_processes(self, container_id: str) -> Dict:
         """Получение процессов внутри контейнера"""
         command = f"docker top {container_id}"
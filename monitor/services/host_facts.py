@@ -0,0 +1,134 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+from .ssh_service import SSHService
+
+PROBE_TOOLS = ("journalctl", "sudo", "ss", "netstat", "docker", "gzip", "dmesg")
+PROBE_FILES = ("/var/log/auth.log", "/var/log/secure", "/var/log/system.log",
+               "/var/log/syslog", "/var/log/messages", "/var/log/docker.log")
+AUTH_LOG_FILES = ("/var/log/auth.log", "/var/log/secure", "/var/log/system.log")
+SYSLOG_FILES = ("/var/log/syslog", "/var/log/messages")
+
+# Неудачная или пустая проверка повторяется не раньше чем через столько секунд
+FAILED_PROBE_RETRY = 30
+
+# Одна команда на все проверки: строки вида ключ=значение
+PROBE_COMMAND = '; '.join(
+    [f'command -v {tool} >/dev/null 2>&1 && echo "tool:{tool}=1" || echo "tool:{tool}=0"' for tool in PROBE_TOOLS]
+    + [f'if [ -r {path} ]; then echo "file:{path}=1"; else echo "file:{path}=0"; fi' for path in PROBE_FILES]
+    + [
+        'journalctl -n 1 -q --no-pager >/dev/null 2>&1 && echo "journal=1" || echo "journal=0"',
+        'sudo -n true >/dev/null 2>&1 && echo "sudo_nopasswd=1" || echo "sudo_nopasswd=0"',
+        'docker ps -q >/dev/null 2>&1 && echo "docker_access=1" || echo "docker_access=0"',
+        'dmesg >/dev/null 2>&1 && echo "dmesg=1" || echo "dmesg=0"',
+        'journalctl -u docker -n 1 -q --no-pager 2>/dev/null | grep -q . && echo "docker_journal=1" '
+        '|| echo "docker_journal=0"',
+        '[ "$(id -u)" = "0" ] && echo "root=1" || echo "root=0"',
+    ]
+)
+
+
+class HostFacts:
+    """Что есть на хосте: утилиты, доступные файлы логов и права"""
+    __slots__ = ('tools', 'files', 'journal', 'sudo_nopasswd', 'docker_access', 'dmesg',
+                 'docker_journal', 'root', 'probed_at', 'probe_ms')
+
+    def __init__(self, values: Dict[str, str], probe_ms: float):
+        self.tools = {tool: values.get(f"tool:{tool}") == "1" for tool in PROBE_TOOLS}
+        self.files = {path: values.get(f"file:{path}") == "1" for path in PROBE_FILES}
+        self.journal = values.get("journal") == "1"
+        self.sudo_nopasswd = values.get("sudo_nopasswd") == "1"
+        self.docker_access = values.get("docker_access") == "1"
+        self.dmesg = values.get("dmesg") == "1"
+        self.docker_journal = values.get("docker_journal") == "1"
+        self.root = values.get("root") == "1"
+        self.probed_at = time.time()
+        self.probe_ms = probe_ms
+
+    @property
+    def auth_log_path(self) -> Optional[str]:
+        return next((path for path in AUTH_LOG_FILES if self.files[path]), None)
+
+    @property
+    def syslog_path(self) -> Optional[str]:
+        return next((path for path in SYSLOG_FILES if self.files[path]), None)
+
+    @property
+    def network_tool(self) -> Optional[str]:
+        """ss быстрее netstat (читает netlink, а не /proc построчно)"""
+        if self.tools["ss"]:
+            return "ss"
+        if self.tools["netstat"]:
+            return "netstat"
+        return None
+
+    @property
+    def docker_log_source(self) -> Optional[str]:
+        """Откуда читать логи демона Docker: journal, sudo_journal или file"""
+        if self.docker_journal:
+            return "journal"
+        if self.tools["journalctl"] and self.sudo_nopasswd and not self.root:
+            return "sudo_journal"
+        if self.files["/var/log/docker.log"]:
+            return "file"
+        return None
+
+    def as_dict(self) -> Dict:
+        return {
+            "tools": self.tools,
+            "files": self.files,
+            "journal": self.journal,
+            "sudo_nopasswd": self.sudo_nopasswd,
+            "docker_access": self.docker_access,
+            "dmesg": self.dmesg,
+            "docker_journal": self.docker_journal,
+            "root": self.root,
+            "auth_log_path": self.auth_log_path,
+            "syslog_path": self.syslog_path,
+            "network_tool": self.network_tool,
+            "docker_log_source": self.docker_log_source,
+            "probed_at": self.probed_at,
+            "probe_ms": self.probe_ms
+        }
+
+
+class HostFactsService:
+    """Проверка возможностей хоста один раз на подключение
+
+    Результат кэшируется до переподключения (смены SSHService.generation),
+    чтобы сборщики логов сразу шли к рабочему варианту, а не перебирали
+    команды и файлы при каждом запросе. Неудачная проверка (ошибка команды
+    или пустой вывод) кэшируется только на FAILED_PROBE_RETRY секунд:
+    иначе все источники считались бы недоступными до переподключения.
+    """
+
+    def __init__(self, ssh_service: SSHService):
+        self.ssh = ssh_service
+        self._facts: Optional[HostFacts] = None
+        self._generation = None
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, refresh: bool = False) -> HostFacts:
+        with self._lock:
+            stale = self._generation != self.ssh.generation or (self._retry_at and time.time() >= self._retry_at)
+            if refresh or self._facts is None or stale:
+                generation = self.ssh.generation
+                self._facts, probed = self._probe()
+                self._generation = generation
+                self._retry_at = 0.0 if probed else time.time() + FAILED_PROBE_RETRY
+                if not probed:
+                    print(f"⚠️ Проверка возможностей хоста не удалась, повтор через {FAILED_PROBE_RETRY} с")
+            return self._facts
+
+    def _probe(self) -> Tuple[HostFacts, bool]:
+        """Факты и признак успешной проверки"""
+        started = time.time()
+        result = self.ssh.execute_command(PROBE_COMMAND)
+        values = {}
+        for line in result["output"].split('\n'):
+            key, sep, value = line.strip().partition('=')
+            if sep:
+                values[key] = value
+        facts = HostFacts(values, round((time.time() - started) * 1000, 2))
+        return facts, bool(result["success"] and values)
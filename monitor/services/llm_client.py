@@ -0,0 +1,408 @@
+import asyncio
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Dict, Iterator, List
+from django.conf import settings
+
+try:
+    from openai import AsyncOpenAI, APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+    ASYNC_OPENAI_AVAILABLE = True
+except ImportError:
+    ASYNC_OPENAI_AVAILABLE = False
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class LLMUnavailableError(Exception):
+    """Модель недоступна: цепь разомкнута, исчерпаны повторы или дедлайн"""
+
+
+class CircuitBreaker:
+    """Размыкатель цепи для вызовов модели
+
+    После failure_threshold ошибок подряд цепь размыкается и вызовы сразу
+    отклоняются (агент отвечает fallback без ожидания таймаутов). Через
+    reset_timeout пропускается одна пробная попытка: успех замыкает цепь,
+    ошибка снова размыкает, а прерванная попытка (отмена) освобождает
+    место пробы без изменения состояния.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True - цепь замкнута, "probe" - разрешена пробная попытка, False - отказ"""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return "probe"
+            return False
+
+    def release_probe(self):
+        """Проба завершилась без результата (отмена) - следующий вызов сможет ее повторить"""
+        with self._lock:
+            if self.state == "half_open":
+                self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    print(f"🔌 Цепь вызовов модели разомкнута на {self.reset_timeout} с")
+                self.state = "open"
+                self.opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def describe(self) -> Dict:
+        with self._lock:
+            return {"state": self.state, "failures": self.failures}
+
+
+class LLMClient:
+    """Асинхронный клиент модели с общим пулом соединений
+
+    Один AsyncOpenAI (и один пул HTTP соединений) на процесс работает в
+    собственном цикле событий в фоновом потоке; синхронные представления
+    Django вызывают complete()/stream(). Число одновременных запросов к
+    модели ограничено семафором, повторы с экспоненциальной задержкой
+    укладываются в общий дедлайн запроса, а серия ошибок размыкает цепь.
+    """
+
+    def __init__(self, api_key: str = None, base_url: str = None, model: str = None):
+        if not ASYNC_OPENAI_AVAILABLE:
+            raise LLMUnavailableError("Установленная версия openai не поддерживает AsyncOpenAI")
+
+        self.config = settings.AI_CLIENT
+        self.model = model or settings.OPENAI_MODEL
+        self.breaker = CircuitBreaker(self.config['BREAKER_FAILURES'], self.config['BREAKER_RESET'])
+        self._semaphore = asyncio.Semaphore(self.config['MAX_CONCURRENCY'])
+
+        http_client = None
+        if httpx is not None:
+            http_client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.config['MAX_CONNECTIONS'],
+                                    max_keepalive_connections=self.config['MAX_CONNECTIONS']),
+                timeout=self.config['REQUEST_TIMEOUT']
+            )
+        # Повторы делает сам клиент с учетом дедлайна, встроенные отключены
+        self._client = AsyncOpenAI(
+            api_key=api_key or settings.OPENAI_API_KEY,
+            base_url=base_url or settings.OPENAI_BASE_URL,
+            timeout=self.config['REQUEST_TIMEOUT'],
+            max_retries=0,
+            http_client=http_client
+        )
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True)
+        self._thread.start()
+
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.rejected = 0
+
+    # --- синхронный интерфейс для представлений ---
+
+    def complete(self, messages: List[Dict], max_tokens: int = 800, temperature: float = 0.7,
+                 deadline: float = None, tools: List[Dict] = None, tool_calls_out: List[Dict] = None,
+                 tool_choice: str = "auto") -> str:
+        future = asyncio.run_coroutine_threadsafe(
+            self.acomplete(messages, max_tokens=max_tokens, temperature=temperature, deadline=deadline,
+                           tools=tools, tool_calls_out=tool_calls_out, tool_choice=tool_choice),
+            self._loop)
+        return future.result()
+
+    def stream(self, messages: List[Dict], max_tokens: int = 800, temperature: float = 0.7,
+               deadline: float = None, tools: List[Dict] = None, tool_calls_out: List[Dict] = None,
+               tool_choice: str = "auto") -> Iterator[str]:
+        """Дельты ответа по мере генерации; закрытие генератора отменяет запрос
+
+        Запрошенные моделью вызовы инструментов после окончания генерации
+        оказываются в tool_calls_out: [{"id", "name", "arguments"}].
+        """
+        events = queue.Queue()
+
+        async def pump():
+            try:
+                async for delta in self.astream(messages, max_tokens=max_tokens, temperature=temperature,
+                                                deadline=deadline, tools=tools, tool_calls_out=tool_calls_out,
+                                                tool_choice=tool_choice):
+                    events.put(("delta", delta))
+                events.put(("done", None))
+            except BaseException as e:
+                events.put(("error", e))
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+
+        future = asyncio.run_coroutine_threadsafe(pump(), self._loop)
+        try:
+            while True:
+                kind, value = events.get()
+                if kind == "delta":
+                    yield value
+                elif kind == "done":
+                    return
+                else:
+                    raise value
+        finally:
+            if not future.done():
+                # Клиент отключился - не держим слот семафора до конца генерации
+                future.cancel()
+
+    def run(self, coroutine):
+        """Выполнить корутину в цикле клиента (для бенчмарков и пакетных вызовов)"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    # --- асинхронный интерфейс ---
+
+    async def acomplete(self, messages: List[Dict], max_tokens: int = 800, temperature: float = 0.7,
+                        deadline: float = None, tools: List[Dict] = None, tool_calls_out: List[Dict] = None,
+                        tool_choice: str = "auto") -> str:
+        deadline_at = time.monotonic() + (deadline or self.config['DEADLINE'])
+        attempt = 0
+        while True:
+            await self._acquire_slot(deadline_at)
+            error = None
+            try:
+                remaining, probe = self._admit(deadline_at)
+                timeout = min(self.config['REQUEST_TIMEOUT'], remaining)
+                try:
+                    # Таймаут и учет в цепи - только для самого HTTP запроса, без ожидания слота
+                    with self._tracked():
+                        response = await asyncio.wait_for(self._client.chat.completions.create(
+                            model=self.model,
+                            messages=messages,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                            timeout=timeout,
+                            **self._tool_options(tools, tool_choice)
+                        ), timeout=timeout)
+                    self._finish(success=True)
+                except Exception as e:
+                    error = e
+                    self._record_error(e, timeout)
+                finally:
+                    if probe == "probe":
+                        self.breaker.release_probe()
+            finally:
+                self._semaphore.release()
+
+            if error is None:
+                message = response.choices[0].message
+                if tool_calls_out is not None and message.tool_calls:
+                    tool_calls_out.extend({"id": call.id, "name": call.function.name,
+                                           "arguments": call.function.arguments or ""}
+                                          for call in message.tool_calls)
+                return (message.content or "").strip()
+            attempt = await self._handle_error(error, attempt, deadline_at)
+
+    async def astream(self, messages: List[Dict], max_tokens: int = 800, temperature: float = 0.7,
+                      deadline: float = None, tools: List[Dict] = None,
+                      tool_calls_out: List[Dict] = None, tool_choice: str = "auto") -> AsyncIterator[str]:
+        """Повтор возможен только до первого токена: начатый ответ уже у пользователя"""
+        deadline_at = time.monotonic() + (deadline or self.config['DEADLINE'])
+        attempt = 0
+        while True:
+            if tool_calls_out is not None:
+                # Вызовы инструментов неудачной попытки не должны смешаться с повтором
+                del tool_calls_out[:]
+            await self._acquire_slot(deadline_at)
+            received = False
+            error = None
+            try:
+                remaining, probe = self._admit(deadline_at)
+                timeout = min(self.config['REQUEST_TIMEOUT'], remaining)
+                try:
+                    with self._tracked():
+                        stream = await self._client.chat.completions.create(
+                            model=self.model,
+                            messages=messages,
+                            max_tokens=max_tokens,
+                            temperature=temperature,
+                            stream=True,
+                            timeout=timeout,
+                            **self._tool_options(tools, tool_choice)
+                        )
+                        async for chunk in stream:
+                            if not chunk.choices:
+                                continue
+                            delta = chunk.choices[0].delta
+                            if delta.tool_calls and tool_calls_out is not None:
+                                self._merge_tool_call_deltas(tool_calls_out, delta.tool_calls)
+                            if delta.content:
+                                received = True
+                                yield delta.content
+                    self._finish(success=True)
+                except Exception as e:
+                    error = e
+                    if received:
+                        self.breaker.record_failure()
+                    else:
+                        self._record_error(e, timeout)
+                finally:
+                    # Отключение клиента (CancelledError) - ни успех, ни ошибка модели
+                    if probe == "probe":
+                        self.breaker.release_probe()
+            finally:
+                self._semaphore.release()
+
+            if error is None:
+                return
+            if received:
+                with self._stats_lock:
+                    self.failed += 1
+                raise error
+            attempt = await self._handle_error(error, attempt, deadline_at)
+
+    @staticmethod
+    def _tool_options(tools: List[Dict] = None, tool_choice: str = "auto") -> Dict:
+        """tool_choice="none" - ответ текстом, хотя в истории уже есть вызовы инструментов"""
+        return {"tools": tools, "tool_choice": tool_choice} if tools else {}
+
+    @staticmethod
+    def _merge_tool_call_deltas(tool_calls: List[Dict], deltas):
+        """Вызовы инструментов приходят в stream частями: id и имя, затем куски аргументов"""
+        for delta in deltas:
+            while len(tool_calls) <= delta.index:
+                tool_calls.append({"id": "", "name": "", "arguments": ""})
+            call = tool_calls[delta.index]
+            if delta.id:
+                call["id"] = delta.id
+            if delta.function:
+                call["name"] += delta.function.name or ""
+                call["arguments"] += delta.function.arguments or ""
+
+    async def _acquire_slot(self, deadline_at: float):
+        """Слот семафора до дедлайна; ожидание в очереди не ошибка модели и не учитывается в цепи"""
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise LLMUnavailableError("Дедлайн запроса к модели исчерпан")
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=remaining)
+        except asyncio.TimeoutError:
+            with self._stats_lock:
+                self.rejected += 1
+            raise LLMUnavailableError("Дедлайн запроса к модели исчерпан в очереди") from None
+
+    @contextmanager
+    def _tracked(self):
+        with self._stats_lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self._stats_lock:
+                self.in_flight -= 1
+
+    def _admit(self, deadline_at: float):
+        """Оставшееся время до дедлайна и разрешение цепи (True или "probe"); отказ, если цепь разомкнута"""
+        remaining = deadline_at - time.monotonic()
+        if remaining <= 0:
+            raise LLMUnavailableError("Дедлайн запроса к модели исчерпан")
+        allowed = self.breaker.allow()
+        if not allowed:
+            with self._stats_lock:
+                self.rejected += 1
+            raise LLMUnavailableError("Модель временно недоступна (цепь разомкнута)")
+        return remaining, allowed
+
+    def _record_error(self, error: Exception, timeout: float):
+        """Учет ошибки HTTP запроса в цепи (пока проба еще числится за запросом)
+
+        Таймаут, укороченный остатком дедлайна (запрос долго ждал слота или
+        повтора), не говорит о недоступности модели и в цепи не учитывается.
+        """
+        if isinstance(error, (asyncio.TimeoutError, APITimeoutError)) and timeout < self.config['REQUEST_TIMEOUT']:
+            return
+        if self._is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            # Ошибки запроса (400, 401) не говорят о недоступности модели: она ответила
+            self.breaker.record_success()
+
+    async def _handle_error(self, error: Exception, attempt: int, deadline_at: float) -> int:
+        """Пауза перед повтором или исключение; возвращает номер следующей попытки"""
+        if not self._is_retryable(error):
+            with self._stats_lock:
+                self.failed += 1
+            raise error
+
+        attempt += 1
+        delay = self._backoff(attempt, error)
+        if attempt > self.config['MAX_RETRIES'] or time.monotonic() + delay >= deadline_at:
+            with self._stats_lock:
+                self.failed += 1
+            raise LLMUnavailableError(f"Модель не ответила после {attempt} попыток: {error}") from error
+
+        with self._stats_lock:
+            self.retries += 1
+        print(f"🔁 Повтор запроса к модели через {delay:.2f} с (попытка {attempt}): {error}")
+        await asyncio.sleep(delay)
+        return attempt
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, (asyncio.TimeoutError, APITimeoutError, APIConnectionError, RateLimitError)):
+            return True
+        return isinstance(error, APIStatusError) and error.status_code >= 500
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        delay = min(self.config['BACKOFF_MAX'], self.config['BACKOFF_BASE'] * 2 ** (attempt - 1))
+        # Джиттер разводит повторы одновременных запросов
+        delay *= random.uniform(0.5, 1.0)
+        if isinstance(error, RateLimitError):
+            try:
+                delay = max(delay, float(error.response.headers.get("retry-after", 0)))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        return delay
+
+    def _finish(self, success: bool):
+        if success:
+            self.breaker.record_success()
+        with self._stats_lock:
+            if success:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {
+                "model": self.model,
+                "max_concurrency": self.config['MAX_CONCURRENCY'],
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "failed": self.failed,
+                "retries": self.retries,
+                "rejected": self.rejected,
+                "breaker": self.breaker.describe()
+            }
@@ -0,0 +1,107 @@
+import math
+import re
+from typing import Dict, Iterable, List
+from django.conf import settings
+from .log_templates import LEVEL_PRIORITY, TemplateMiner
+from .prompt_budget import estimate_tokens
+
+WORD_RE = re.compile(r'\w{3,}')
+# Слова запроса, которые есть почти в любом вопросе и ничего не говорят о строках лога
+STOP_WORDS = {
+    "почему", "что", "как", "где", "когда", "это", "для", "или", "при", "после", "есть", "нет",
+    "логи", "логах", "лог", "проанализируй", "проблемы", "проблема", "покажи", "найди",
+    "the", "and", "why", "what", "how", "logs", "log", "with", "for",
+}
+
+
+def query_keywords(query: str) -> List[str]:
+    """Ключевые слова запроса; длинные слова обрезаются до основы, чтобы совпадали формы слова"""
+    keywords = []
+    for word in WORD_RE.findall((query or "").lower()):
+        if word in STOP_WORDS or word.isdigit():
+            continue
+        stem = word[:6] if len(word) > 7 else word
+        if stem not in keywords:
+            keywords.append(stem)
+    return keywords
+
+
+def select_excerpt(records: Iterable[tuple], query: str = "", max_tokens: int = None,
+                   miner: TemplateMiner = None) -> Dict:
+    """Самые полезные строки лога в пределах бюджета токенов
+
+    Каждая строка получает оценку из важности уровня, редкости ее шаблона
+    (обратная частота, как IDF), свежести (позиция в буфере) и совпадения
+    с ключевыми словами запроса. Строки раскладываются по корзинам оценки и
+    берутся от лучших к худшим, пока хватает бюджета, - без сортировки, за
+    линейное время. Из одного шаблона берется не больше MAX_PER_TEMPLATE
+    строк. В отрывок строки попадают в исходном порядке.
+
+    Записи - в формате LogService.parse_log_buffer; попутно они добавляются
+    в miner, поэтому сводку по шаблонам можно строить по тому же проходу.
+    """
+    config = settings.LOG_EXCERPT
+    max_tokens = max_tokens or config['TOKENS']
+    weights = config['WEIGHTS']
+    buckets_count = config['BUCKETS']
+    max_chars = config['MAX_LINE_CHARS']
+    miner = miner if miner is not None else TemplateMiner()
+    keywords = query_keywords(query)
+
+    # Проход 1: шаблон каждой строки (частоты шаблонов известны только в конце)
+    lines, levels, clusters = [], [], []
+    for raw, timestamp, level, service, message in records:
+        cluster = miner.add(message or raw, timestamp, level)
+        if cluster is None:
+            continue
+        lines.append(raw if len(raw) <= max_chars else raw[:max_chars] + "…")
+        levels.append(level)
+        clusters.append(cluster)
+
+    total = len(lines)
+    if not total:
+        return {"text": "", "selected": 0, "total": 0, "tokens": 0, "keywords": keywords}
+
+    # Проход 2: оценка и раскладка по корзинам
+    log_total = math.log(total) if total > 1 else 1.0
+    last = max(total - 1, 1)
+    buckets: List[List[int]] = [[] for _ in range(buckets_count + 1)]
+    for i, line in enumerate(lines):
+        severity = (5 - LEVEL_PRIORITY.get(levels[i] or "info", 4)) / 5
+        rarity = math.log(total / clusters[i].count) / log_total
+        recency = i / last
+        score = (weights['SEVERITY'] * severity + weights['RARITY'] * rarity
+                 + weights['RECENCY'] * recency)
+        if keywords:
+            lowered = line.lower()
+            score += weights['KEYWORDS'] * sum(1 for keyword in keywords if keyword in lowered) / len(keywords)
+        buckets[min(buckets_count, int(score * buckets_count))].append(i)
+
+    # Проход 3: от лучших корзин к худшим; внутри корзины - сначала свежие строки
+    selected = [False] * total
+    per_template: Dict[int, int] = {}
+    budget = max_tokens
+    used = 0
+    for bucket in reversed(buckets):
+        for i in reversed(bucket):
+            cluster_id = clusters[i].id
+            if per_template.get(cluster_id, 0) >= config['MAX_PER_TEMPLATE']:
+                continue
+            cost = estimate_tokens(lines[i]) + 1
+            if cost > budget:
+                continue
+            selected[i] = True
+            per_template[cluster_id] = per_template.get(cluster_id, 0) + 1
+            budget -= cost
+            used += cost
+        if budget < config['MIN_LINE_TOKENS']:
+            break
+
+    excerpt = [line for line, keep in zip(lines, selected) if keep]
+    return {
+        "text": '\n'.join(excerpt),
+        "selected": len(excerpt),
+        "total": total,
+        "tokens": used,
+        "keywords": keywords
+    }
@@ -0,0 +1,256 @@
+import hashlib
+import queue
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Dict, Iterable, List, Optional
+from django.conf import settings
+from django.utils import timezone
+
+SYSLOG_MONTHS = {name: number for number, name in enumerate(
+    ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'), start=1)}
+RELATIVE_SINCE_RE = re.compile(r'^(\d+)\s*([smhd])$')
+RELATIVE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Уровни от самого важного; фильтр level=X оставляет X и все, что важнее
+LOG_LEVEL_ORDER = ("fatal", "critical", "error", "warning", "info", "debug")
+LOG_LEVEL_RANKS = {**{level: rank for rank, level in enumerate(LOG_LEVEL_ORDER)}, "warn": 3}
+# Разные написания одного уровня у разных парсеров (текстовый - WARN, journald - warning)
+LEVEL_ALIASES = {"warn": "warning", "err": "error", "crit": "critical", "emerg": "fatal"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS log_lines (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    host TEXT NOT NULL,
+    source TEXT NOT NULL,
+    level TEXT NOT NULL,
+    service TEXT NOT NULL,
+    message TEXT NOT NULL,
+    digest INTEGER NOT NULL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS log_lines_digest ON log_lines (host, source, digest);
+CREATE INDEX IF NOT EXISTS log_lines_ts ON log_lines (ts);
+CREATE INDEX IF NOT EXISTS log_lines_host_ts ON log_lines (host, ts);
+CREATE VIRTUAL TABLE IF NOT EXISTS log_fts USING fts5(
+    message, content='log_lines', content_rowid='id', tokenize='unicode61'
+);
+CREATE TRIGGER IF NOT EXISTS log_lines_ad AFTER DELETE ON log_lines BEGIN
+    INSERT INTO log_fts (log_fts, rowid, message) VALUES ('delete', old.id, old.message);
+END;
+"""
+
+
+def parse_log_timestamp(value: str, now: datetime = None, tz=None) -> Optional[float]:
+    """Метка времени из записи лога (ISO или syslog без года) в epoch-секунды
+
+    Метки без часового пояса считаются временем в TIME_ZONE проекта.
+    """
+    if not value or value == "Unknown":
+        return None
+    now = now or timezone.now()
+    tz = tz or timezone.get_current_timezone()
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        # В syslog нет года: берем текущий, а "будущие" даты относим к прошлому году
+        parts = value.split()
+        try:
+            hour, minute, second = (int(part) for part in parts[2].split(':'))
+            parsed = datetime(now.year, SYSLOG_MONTHS[parts[0]], int(parts[1]), hour, minute, second, tzinfo=tz)
+        except (IndexError, KeyError, ValueError):
+            return None
+        if parsed > now + timedelta(days=1):
+            parsed = parsed.replace(year=now.year - 1)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=tz)
+    return parsed.timestamp()
+
+
+def parse_since(value: str) -> Optional[float]:
+    """Начало интервала поиска: относительное (30m, 2h, 7d) или ISO-дата"""
+    if not value:
+        return None
+    match = RELATIVE_SINCE_RE.match(value.strip())
+    if match:
+        return time.time() - int(match.group(1)) * RELATIVE_UNITS[match.group(2)]
+    return parse_log_timestamp(value.strip())
+
+
+def normalize_level(level: str) -> str:
+    """Единое написание уровня: warn -> warning и т.п."""
+    level = (level or "info").strip().lower()
+    return LEVEL_ALIASES.get(level, level)
+
+
+def levels_at_least(level: str) -> List[str]:
+    """Уровень и все более важные; ValueError для неизвестного уровня"""
+    level = normalize_level(level)
+    if level not in LOG_LEVEL_RANKS:
+        raise ValueError(f"Неизвестный уровень: {level} (допустимо: {', '.join(LOG_LEVEL_ORDER)})")
+    return list(LOG_LEVEL_ORDER[:LOG_LEVEL_RANKS[level] + 1])
+
+
+def build_match_query(text: str) -> str:
+    """Пользовательский запрос в синтаксис FTS5: каждое слово - фраза в кавычках (AND)"""
+    terms = [term.replace('"', '""') for term in text.split()]
+    return ' '.join(f'"{term}"' for term in terms if term)
+
+
+class LogIndex:
+    """Локальный полнотекстовый индекс логов на SQLite FTS5
+
+    Строки попадают в индекс через очередь: фоновый поток пишет их
+    пачками в одной транзакции и периодически удаляет записи старше
+    срока хранения. Повторно полученные строки отбрасываются по хэшу.
+    """
+
+    def __init__(self, path: str = None):
+        self.config = settings.LOG_INDEX
+        self.path = str(path or self.config['PATH'])
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._connection = None
+        self._worker = None
+        self._last_purge = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def submit(self, host: str, source: str, records: Iterable[tuple]):
+        """Постановка записей (raw, timestamp, level, service, message) в очередь на индексацию"""
+        records = list(records)
+        if not records:
+            return
+        self._queue.put((host or "unknown", source, records))
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, daemon=True, name="log-index")
+            self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            # Забираем все, что накопилось, чтобы писать одной транзакцией
+            while not self._queue.empty() and len(batch) < 100:
+                batch.append(self._queue.get_nowait())
+            try:
+                for host, source, records in batch:
+                    self.ingest(host, source, records)
+                self.purge_expired()
+            except Exception as e:
+                print(f"⚠️ Ошибка индексации логов: {e}")
+
+    def ingest(self, host: str, source: str, records: List[tuple]) -> int:
+        """Синхронная запись пачками по BATCH_SIZE строк в транзакции"""
+        now = timezone.now()
+        tz = timezone.get_current_timezone()
+        fallback_ts = now.timestamp()
+        rows = []
+        for raw, timestamp, level, service, message in records:
+            digest = int.from_bytes(hashlib.blake2b(f"{timestamp}|{raw}".encode('utf-8', 'ignore'),
+                                                    digest_size=8).digest(), 'big', signed=True)
+            ts = parse_log_timestamp(timestamp, now, tz) or fallback_ts
+            rows.append((ts, host, source, normalize_level(level), service, message or raw, digest))
+
+        inserted = 0
+        batch_size = self.config['BATCH_SIZE']
+        with self._lock:
+            connection = self._connect()
+            for i in range(0, len(rows), batch_size):
+                connection.execute("BEGIN")
+                try:
+                    last_id = connection.execute("SELECT COALESCE(MAX(id), 0) FROM log_lines").fetchone()[0]
+                    cursor = connection.executemany(
+                        "INSERT OR IGNORE INTO log_lines (ts, host, source, level, service, message, digest) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", rows[i:i + batch_size])
+                    inserted += cursor.rowcount
+                    # Полнотекстовый индекс пополняется одним запросом на пачку, а не триггером на строку
+                    connection.execute("INSERT INTO log_fts (rowid, message) "
+                                       "SELECT id, message FROM log_lines WHERE id > ?", (last_id,))
+                    connection.execute("COMMIT")
+                except Exception:
+                    connection.execute("ROLLBACK")
+                    raise
+        return inserted
+
+    def purge_expired(self, force: bool = False) -> int:
+        """Удаление записей старше RETENTION_DAYS (не чаще раза в PURGE_INTERVAL секунд)"""
+        if not force and time.time() - self._last_purge < self.config['PURGE_INTERVAL']:
+            return 0
+        cutoff = time.time() - self.config['RETENTION_DAYS'] * 86400
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN")
+            deleted = connection.execute("DELETE FROM log_lines WHERE ts < ?", (cutoff,)).rowcount
+            connection.execute("COMMIT")
+        self._last_purge = time.time()
+        return deleted
+
+    def search(self, query: str = "", level: str = None, since: float = None, until: float = None,
+               host: str = None, source: str = None, limit: int = 100) -> Dict:
+        """Поиск по индексу; без текстового запроса - фильтр по полям и времени
+
+        level оставляет записи этого уровня и важнее; ValueError для неизвестного уровня.
+        """
+        started = time.time()
+        conditions, params = [], []
+        match = build_match_query(query) if query else ""
+
+        if match:
+            sql = ("SELECT l.ts, l.host, l.source, l.level, l.service, l.message "
+                   "FROM log_fts JOIN log_lines l ON l.id = log_fts.rowid")
+            conditions.append("log_fts MATCH ?")
+            params.append(match)
+        else:
+            sql = "SELECT l.ts, l.host, l.source, l.level, l.service, l.message FROM log_lines l"
+
+        if level:
+            # Уровень и все, что важнее; warn - для строк, проиндексированных до нормализации
+            levels = levels_at_least(level)
+            if "warning" in levels:
+                levels.append("warn")
+            conditions.append(f"l.level IN ({', '.join('?' * len(levels))})")
+            params.extend(levels)
+        if since is not None:
+            conditions.append("l.ts >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("l.ts <= ?")
+            params.append(until)
+        if host:
+            conditions.append("l.host = ?")
+            params.append(host)
+        if source:
+            conditions.append("l.source = ?")
+            params.append(source)
+
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY l.ts DESC LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._connect().execute(sql, params).fetchall()
+
+        return {
+            "results": [
+                {
+                    "timestamp": datetime.fromtimestamp(ts, tz=dt_timezone.utc).isoformat(timespec='seconds'),
+                    "host": row_host,
+                    "source": row_source,
+                    "level": row_level,
+                    "service": service,
+                    "message": message
+                }
+                for ts, row_host, row_source, row_level, service, message in rows
+            ],
+            "took_ms": round((time.time() - started) * 1000, 2)
+        }
@@ -0,0 +1,209 @@
+import hashlib
+import threading
+import zlib
+from collections import deque
+from typing import Dict, Iterator, List, Optional
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum, Value
+from django.db.models.functions import Concat, Length
+from django.utils import timezone
+from ..models import LogChunk, ServiceLog
+
+
+class LogStorage:
+    """Хранение снимков логов сжатыми блоками с дедупликацией
+
+    При каждом добавлении отбрасывается часть, которая уже была сохранена
+    для этого источника (перекрытие хвостов при повторном tail). Свежие
+    строки дописываются в открытый снимок источника (несжатый текст,
+    дописывается на стороне БД без чтения прежнего содержимого), а когда
+    в нем набирается CHUNK_LINES строк, снимок закрывается: текст один раз
+    сжимается zlib в блок. Блоки с одинаковым содержимым (по sha256)
+    хранятся один раз.
+    """
+
+    def __init__(self):
+        self.config = settings.LOG_STORAGE
+        # (host, source) -> последние сохраненные строки для поиска перекрытия
+        self._tails: Dict[tuple, deque] = {}
+        self._lock = threading.Lock()
+
+    def append(self, source: str, text: str, host: str = '', service_type: str = 'system',
+               log_file_path: str = '') -> Dict:
+        """Инкрементальное добавление свежего снимка логов источника"""
+        lines = [line for line in text.split('\n') if line.strip()]
+        key = (host, source)
+
+        with self._lock:
+            tail = self._tails.get(key)
+            if tail is None:
+                tail = self._load_tail(host, source)
+                self._tails[key] = tail
+
+            new_lines = lines[self._overlap(tail, lines):]
+            if not new_lines:
+                return {"stored_lines": 0, "chunks": 0}
+
+            chunk_lines = self.config['CHUNK_LINES']
+            sealed = 0
+            with transaction.atomic():
+                opened = (ServiceLog.objects.select_for_update()
+                          .filter(host=host, service_name=source, is_open=True).first())
+                position = 0
+                if opened is not None:
+                    position = min(chunk_lines - opened.lines_count, len(new_lines))
+                    self._extend_open(opened, new_lines[:position])
+                    if opened.lines_count + position >= chunk_lines:
+                        self._seal(opened.pk)
+                        sealed += 1
+
+                for i in range(position, len(new_lines), chunk_lines):
+                    part = new_lines[i:i + chunk_lines]
+                    snapshot = ServiceLog.objects.create(
+                        service_name=source,
+                        service_type=service_type,
+                        host=host,
+                        log_content='\n'.join(part),
+                        is_open=True,
+                        log_file_path=log_file_path,
+                        lines_count=len(part)
+                    )
+                    if len(part) == chunk_lines:
+                        self._seal(snapshot.pk)
+                        sealed += 1
+            tail.extend(new_lines)
+
+        return {"stored_lines": len(new_lines), "chunks": sealed}
+
+    @staticmethod
+    def _extend_open(snapshot: ServiceLog, lines: List[str]):
+        """Дописывание строк в открытый снимок одним UPDATE без чтения его текста
+
+        fetched_at сдвигается, чтобы iter_lines(since=...) не пропускал
+        только что дописанные строки.
+        """
+        if not lines:
+            return
+        ServiceLog.objects.filter(pk=snapshot.pk).update(
+            log_content=Concat(F('log_content'), Value('\n' + '\n'.join(lines))),
+            lines_count=F('lines_count') + len(lines),
+            fetched_at=timezone.now()
+        )
+
+    def _seal(self, snapshot_id: int):
+        """Закрытие снимка: текст сжимается в блок (или ссылается на такой же блок)"""
+        snapshot = ServiceLog.objects.get(pk=snapshot_id)
+        snapshot.chunk = self._store_chunk(snapshot.log_content.split('\n'))
+        snapshot.log_content = ''
+        snapshot.is_open = False
+        snapshot.save(update_fields=['chunk', 'log_content', 'is_open'])
+
+    @staticmethod
+    def _overlap(tail: deque, lines: List[str]) -> int:
+        """Сколько первых строк нового снимка уже есть в конце сохраненного хвоста"""
+        if not tail or not lines:
+            return 0
+        previous = list(tail)
+        first = lines[0]
+        # Самое раннее совпадение дает самое длинное перекрытие
+        for start, line in enumerate(previous):
+            if line != first:
+                continue
+            overlap = len(previous) - start
+            if overlap <= len(lines) and previous[start:] == lines[:overlap]:
+                return overlap
+            if overlap > len(lines) and previous[start:start + len(lines)] == lines:
+                # Новый снимок целиком внутри уже сохраненного
+                return len(lines)
+        return 0
+
+    def _load_tail(self, host: str, source: str) -> deque:
+        """Хвост источника из последних снимков (после перезапуска процесса)"""
+        tail = deque(maxlen=self.config['OVERLAP_WINDOW'])
+        snapshots = (ServiceLog.objects.filter(host=host, service_name=source)
+                     .filter(Q(chunk__isnull=False) | Q(is_open=True))
+                     .select_related('chunk').order_by('-fetched_at', '-id'))
+        texts, count = [], 0
+        # Открытый снимок сразу после закрытия предыдущего короткий - добираем строки из более ранних
+        for snapshot in snapshots[:8]:
+            texts.append(self._snapshot_text(snapshot))
+            count += snapshot.lines_count
+            if count >= tail.maxlen:
+                break
+        for text in reversed(texts):
+            tail.extend(text.split('\n'))
+        return tail
+
+    def _snapshot_text(self, snapshot: ServiceLog) -> str:
+        return snapshot.log_content if snapshot.is_open else self._decompress(snapshot.chunk.data)
+
+    def _store_chunk(self, lines: List[str]) -> LogChunk:
+        raw = '\n'.join(lines).encode('utf-8')
+        content_hash = hashlib.sha256(raw).hexdigest()
+        chunk = LogChunk.objects.filter(content_hash=content_hash).first()
+        if chunk:
+            return chunk
+
+        data = zlib.compress(raw, self.config['COMPRESSION_LEVEL'])
+        try:
+            with transaction.atomic():
+                return LogChunk.objects.create(
+                    content_hash=content_hash,
+                    data=data,
+                    raw_size=len(raw),
+                    compressed_size=len(data),
+                    lines_count=len(lines)
+                )
+        except IntegrityError:
+            # Такой же блок параллельно сохранил другой процесс
+            return LogChunk.objects.get(content_hash=content_hash)
+
+    @staticmethod
+    def _decompress(data) -> str:
+        return zlib.decompress(bytes(data)).decode('utf-8', errors='ignore')
+
+    def iter_lines(self, source: str, host: Optional[str] = None, since=None) -> Iterator[str]:
+        """Потоковое чтение сохраненных строк: блоки распаковываются по одному"""
+        snapshots = ServiceLog.objects.filter(service_name=source).filter(Q(chunk__isnull=False) | Q(is_open=True))
+        if host is not None:
+            snapshots = snapshots.filter(host=host)
+        if since is not None:
+            snapshots = snapshots.filter(fetched_at__gte=since)
+
+        rows = snapshots.order_by('fetched_at', 'id').values_list('pk', 'chunk_id', 'is_open')
+        for pk, chunk_id, is_open in rows.iterator(chunk_size=100):
+            if is_open:
+                text = ServiceLog.objects.filter(pk=pk).values_list('log_content', flat=True).first()
+                if text:
+                    yield from text.split('\n')
+                continue
+            data = LogChunk.objects.filter(pk=chunk_id).values_list('data', flat=True).first()
+            if data is not None:
+                yield from self._decompress(data).split('\n')
+
+    def get_stats(self, host: Optional[str] = None) -> Dict:
+        """Объем хранилища: сырые байты против сжатых уникальных блоков"""
+        snapshots = ServiceLog.objects.filter(chunk__isnull=False)
+        if host is not None:
+            snapshots = snapshots.filter(host=host)
+
+        logical = snapshots.aggregate(raw=Sum('chunk__raw_size'), snapshots=Count('id'))
+        chunks = LogChunk.objects.filter(snapshots__in=snapshots).distinct()
+        stored = LogChunk.objects.filter(pk__in=chunks.values('pk')).aggregate(
+            raw=Sum('raw_size'), compressed=Sum('compressed_size'), chunks=Count('id'))
+        # Открытые снимки еще не сжаты и учитываются как есть
+        opened = ServiceLog.objects.filter(is_open=True)
+        if host is not None:
+            opened = opened.filter(host=host)
+        opened = opened.aggregate(size=Sum(Length('log_content')), snapshots=Count('id'))
+
+        raw_size = (logical['raw'] or 0) + (opened['size'] or 0)
+        compressed_size = (stored['compressed'] or 0) + (opened['size'] or 0)
+        return {
+            "snapshots": logical['snapshots'] + opened['snapshots'],
+            "chunks": stored['chunks'],
+            "raw_bytes": raw_size,
+            "stored_bytes": compressed_size,
+            "ratio": round(compressed_size / raw_size, 3) if raw_size else 0
+        }
@@ -0,0 +1,191 @@
+import re
+from typing import Dict, Iterable, List, Optional
+from django.conf import settings
+
+WILDCARD = "<*>"
+# Токены с цифрами (pid, порты, адреса, время, id) считаются переменными
+HAS_DIGIT = re.compile(r'\d').search
+# Уровни в порядке важности для сводки: редкие ошибки важнее частых info
+LEVEL_PRIORITY = {"fatal": 0, "critical": 1, "error": 2, "warning": 3, "warn": 3, "info": 4, "debug": 5}
+
+
+class LogCluster:
+    """Шаблон сообщений и статистика по строкам, которые в него попали"""
+    __slots__ = ('id', 'tokens', 'count', 'first_seen', 'last_seen', 'levels', 'examples')
+
+    def __init__(self, cluster_id: int, tokens: List[str]):
+        self.id = cluster_id
+        self.tokens = tokens
+        self.count = 0
+        self.first_seen = None
+        self.last_seen = None
+        self.levels: Dict[str, int] = {}
+        self.examples: List[List[str]] = []
+
+    @property
+    def template(self) -> str:
+        return ' '.join(self.tokens)
+
+    @property
+    def level(self) -> str:
+        """Самый важный уровень среди строк шаблона"""
+        return min(self.levels, key=lambda level: LEVEL_PRIORITY.get(level, 4)) if self.levels else "info"
+
+
+class TemplateMiner:
+    """Онлайн-кластеризация строк логов в шаблоны (алгоритм в духе Drain)
+
+    Строки разбиваются на токены и спускаются по дереву фиксированной
+    глубины: сначала по числу токенов, затем по первым токенам сообщения.
+    В листе выбирается самый похожий шаблон (доля совпавших постоянных
+    токенов не ниже порога); различающиеся позиции шаблона заменяются на <*>.
+    Каждая строка обрабатывается за один проход, без повторного сравнения
+    со всеми шаблонами.
+    """
+
+    def __init__(self, depth: int = None, similarity: float = None, max_children: int = None,
+                 max_clusters: int = None, max_examples: int = 3):
+        config = settings.LOG_TEMPLATES
+        # Глубина дерева включает корень и уровень длины сообщения
+        self.prefix_depth = max((depth or config['DEPTH']) - 2, 1)
+        self.similarity = similarity if similarity is not None else config['SIMILARITY']
+        self.max_children = max_children or config['MAX_CHILDREN']
+        self.max_clusters = max_clusters or config['MAX_CLUSTERS']
+        self.max_examples = max_examples
+        self.root: Dict[int, Dict] = {}
+        self.clusters: List[LogCluster] = []
+        self._overflow: Optional[LogCluster] = None
+        self.total_lines = 0
+
+    def add(self, message: str, timestamp: str = None, level: str = None) -> Optional[LogCluster]:
+        """Добавление одной строки; возвращает шаблон, в который она попала"""
+        tokens = message.split()
+        if not tokens:
+            return None
+        self.total_lines += 1
+
+        masked = [WILDCARD if HAS_DIGIT(token) else token for token in tokens]
+        leaf = self._leaf(masked)
+        cluster = self._best_match(leaf, masked)
+
+        if cluster is None:
+            if len(self.clusters) >= self.max_clusters:
+                # Лимит шаблонов исчерпан - ближайший шаблон в листе, а если лист пуст, общий шаблон <*>
+                cluster = self._best_match(leaf, masked, threshold=0.0) or self._overflow_cluster()
+            else:
+                cluster = LogCluster(len(self.clusters) + 1, masked)
+                self.clusters.append(cluster)
+                leaf.append(cluster)
+        else:
+            template = cluster.tokens
+            for i, token in enumerate(masked):
+                if template[i] != token and template[i] != WILDCARD:
+                    template[i] = WILDCARD
+
+        cluster.count += 1
+        if timestamp and timestamp != "Unknown":
+            if cluster.first_seen is None:
+                cluster.first_seen = timestamp
+            cluster.last_seen = timestamp
+        level = level or "info"
+        cluster.levels[level] = cluster.levels.get(level, 0) + 1
+
+        if len(cluster.examples) < self.max_examples:
+            variables = [token for token, slot in zip(tokens, cluster.tokens) if slot == WILDCARD]
+            if variables and variables not in cluster.examples:
+                cluster.examples.append(variables)
+        return cluster
+
+    def _overflow_cluster(self) -> LogCluster:
+        """Один шаблон на все строки сверх max_clusters, чтобы память оставалась ограниченной"""
+        if self._overflow is None:
+            self._overflow = LogCluster(len(self.clusters) + 1, [WILDCARD])
+            self.clusters.append(self._overflow)
+        return self._overflow
+
+    def add_records(self, records: Iterable[tuple]) -> 'TemplateMiner':
+        """Добавление записей в формате LogService.parse_log_buffer"""
+        add = self.add
+        for raw, timestamp, level, service, message in records:
+            add(message or raw, timestamp, level)
+        return self
+
+    def _leaf(self, tokens: List[str]) -> List[LogCluster]:
+        node = self.root.setdefault(len(tokens), {})
+        prefix = tokens[:self.prefix_depth]
+        for depth, token in enumerate(prefix):
+            is_last = depth == len(prefix) - 1
+            child = node.get(token)
+            if child is None:
+                if token != WILDCARD and len(node) >= self.max_children:
+                    # Слишком много разных значений на уровне - дальше идем через <*>
+                    token = WILDCARD
+                    child = node.get(token)
+                if child is None:
+                    child = [] if is_last else {}
+                    node[token] = child
+            node = child
+        if isinstance(node, dict):
+            # Сообщение короче глубины префикса
+            node = node.setdefault(None, [])
+        return node
+
+    def _best_match(self, leaf: List[LogCluster], tokens: List[str],
+                    threshold: float = None) -> Optional[LogCluster]:
+        threshold = self.similarity if threshold is None else threshold
+        best, best_score, best_params = None, -1.0, -1
+        length = len(tokens)
+        for cluster in leaf:
+            same = params = 0
+            for slot, token in zip(cluster.tokens, tokens):
+                if slot == WILDCARD:
+                    params += 1
+                elif slot == token:
+                    same += 1
+            score = same / length
+            # При равной похожести предпочитаем более конкретный шаблон
+            if score > best_score or (score == best_score and params < best_params):
+                best, best_score, best_params = cluster, score, params
+        if best is not None and best_score >= threshold:
+            return best
+        return None
+
+    def templates(self, limit: int = None) -> List[Dict]:
+        """Шаблоны по убыванию числа строк"""
+        clusters = sorted(self.clusters, key=lambda cluster: -cluster.count)
+        if limit:
+            clusters = clusters[:limit]
+        return [
+            {
+                "id": cluster.id,
+                "template": cluster.template,
+                "count": cluster.count,
+                "level": cluster.level,
+                "levels": cluster.levels,
+                "first_seen": cluster.first_seen,
+                "last_seen": cluster.last_seen,
+                "examples": cluster.examples
+            }
+            for cluster in clusters
+        ]
+
+    def summary_text(self, max_chars: int = None) -> str:
+        """Компактная сводка для промпта: сначала ошибки, затем самые частые шаблоны"""
+        max_chars = max_chars or settings.LOG_TEMPLATES['PROMPT_CHARS']
+        clusters = sorted(self.clusters,
+                          key=lambda cluster: (LEVEL_PRIORITY.get(cluster.level, 4), -cluster.count))
+        header = f"Строк: {self.total_lines}, шаблонов: {len(self.clusters)}"
+        lines = [header]
+        size = len(header)
+        for cluster in clusters:
+            line = f"{cluster.count}x [{cluster.level}] {cluster.template}"
+            if cluster.first_seen:
+                line += f" | {cluster.first_seen} - {cluster.last_seen}"
+            if cluster.examples:
+                line += " | пример: " + ', '.join(cluster.examples[0])
+            if size + len(line) + 1 > max_chars:
+                lines.append(f"... еще шаблонов: {len(clusters) - len(lines) + 1}")
+                break
+            lines.append(line)
+            size += len(line) + 1
+        return '\n'.join(lines)
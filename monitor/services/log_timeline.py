@@ -0,0 +1,321 @@
+import heapq
+import re
+import shlex
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
+from django.conf import settings
+from .log_service import LogService, AUTH_FACILITIES, LOG_LEVEL_WORDS
+from .docker_service import DockerService, split_docker_timestamp, encode_log_cursor, decode_log_cursor
+from .log_index import parse_log_timestamp
+
+# Строка dmesg без -T: "[  123.456789] сообщение" (секунды с загрузки)
+DMESG_MONOTONIC_RE = re.compile(r'^\[\s*(\d+\.\d+)\]\s?(.*)$')
+# Более конкретные источники идут первыми: при совпадении записи journald
+# из system и auth/kernel в ленте остается запись конкретного источника
+TIMELINE_SOURCES = ("auth", "kernel", "docker", "system")
+
+DOCKER_FAILED_MARK = "__docker_logs_failed__"
+# Лишние строки окна docker на случай записей ровно на границе окна
+DOCKER_BOUNDARY_SLACK = 16
+
+# (epoch, источник, уровень, сервис, сообщение)
+TimelineEntry = Tuple[float, str, str, str, str]
+
+
+def parse_iso_epoch(value: str) -> Optional[float]:
+    """ISO/RFC3339 метка (в т.ч. с наносекундами и Z) в epoch-секунды"""
+    value = value.replace('Z', '+00:00')
+    # fromisoformat понимает не больше 6 знаков дробной части
+    match = re.match(r'^([^.]+\.\d{1,6})\d*(.*)$', value)
+    if match:
+        value = match.group(1) + match.group(2)
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def format_epoch(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat(timespec='microseconds').replace('+00:00', 'Z')
+
+
+def detect_level(line: str) -> str:
+    upper = line.upper()
+    for word, level in LOG_LEVEL_WORDS:
+        if word in upper:
+            return level
+    return "info"
+
+
+class LogTimeline:
+    """Единая лента логов из journald, файлов syslog, dmesg и docker
+
+    Метки времени всех источников приводятся к epoch (UTC). Каждый
+    источник читает не больше limit записей старше курсора и отдает их
+    от новых к старым; потоки сливаются кучей (в куче по одной записи на
+    источник) и обрезаются до страницы без сортировки всего объема.
+    """
+
+    def __init__(self, log_service: LogService, docker_service: DockerService):
+        self.logs = log_service
+        self.docker = docker_service
+        self.ssh = log_service.ssh
+        self.config = settings.LOG_TIMELINE
+
+    def get_page(self, sources: List[str] = None, containers: List[str] = None,
+                 limit: int = None, cursor: str = None) -> Dict:
+        """Страница ленты от новых к старым; next_cursor - продолжение в прошлое"""
+        started = time.time()
+        limit = min(limit or self.config['PAGE_SIZE'], self.config['MAX_PAGE_SIZE'])
+        sources = [source for source in TIMELINE_SOURCES if source in (sources or TIMELINE_SOURCES)]
+
+        before, skip = None, 0
+        if cursor:
+            decoded = decode_log_cursor(cursor)
+            if decoded is None:
+                return {"success": False, "error": "Некорректный курсор", "invalid_cursor": True}
+            before, skip = parse_iso_epoch(decoded[0]), decoded[1]
+
+        # Записи с меткой, равной курсору, читаются повторно и пропускаются
+        fetch_limit = limit + skip
+        jobs = []
+        for source in sources:
+            if source == "docker":
+                names = containers
+                if names is None:
+                    names = [c["name"] for c in self.docker.get_inventory() if c["is_running"]]
+                jobs.extend((f"docker:{name}", name) for name in names[:self.config['MAX_CONTAINERS']])
+            else:
+                jobs.append((source, None))
+
+        streams, errors = [], {}
+        if jobs:
+            with ThreadPoolExecutor(max_workers=min(len(jobs), 8)) as executor:
+                futures = [(label, executor.submit(self._fetch, label, container, fetch_limit, before))
+                           for label, container in jobs]
+                for label, future in futures:
+                    try:
+                        streams.append(future.result())
+                    except Exception as e:
+                        errors[label] = str(e)
+
+        merged = self._dedupe(heapq.merge(*streams, key=lambda entry: entry[0], reverse=True))
+        if before is not None:
+            merged = self._skip_seen(merged, before, skip)
+        page = list(islice(merged, limit))
+
+        # Страница может оказаться короче из-за дублей, хотя источники отдали не все
+        has_more = len(page) == limit or any(len(stream) >= fetch_limit for stream in streams)
+        next_cursor = None
+        if page and has_more:
+            last_ts = page[-1][0]
+            seen = sum(1 for entry in page if entry[0] == last_ts)
+            if before is not None and last_ts == before:
+                seen += skip
+            next_cursor = encode_log_cursor(format_epoch(last_ts), seen)
+
+        return {
+            "success": bool(streams) or not errors,
+            "entries": [
+                {
+                    "timestamp": format_epoch(ts),
+                    "ts": ts,
+                    "source": source,
+                    "level": level,
+                    "service": service,
+                    "message": message
+                }
+                for ts, source, level, service, message in page
+            ],
+            "next_cursor": next_cursor,
+            "sources": [label for label, _ in jobs],
+            "errors": errors,
+            "took_ms": round((time.time() - started) * 1000, 2)
+        }
+
+    @staticmethod
+    def _dedupe(entries: Iterator[TimelineEntry]) -> Iterator[TimelineEntry]:
+        """Одна и та же запись журнала может прийти из system и auth/kernel - оставляем первую"""
+        current_ts, seen = None, set()
+        for entry in entries:
+            if entry[0] != current_ts:
+                current_ts, seen = entry[0], set()
+            key = (entry[3], entry[4])
+            if key in seen:
+                continue
+            seen.add(key)
+            yield entry
+
+    @staticmethod
+    def _skip_seen(entries: Iterator[TimelineEntry], before: float, skip: int) -> Iterator[TimelineEntry]:
+        for entry in entries:
+            if entry[0] > before:
+                continue
+            if entry[0] == before and skip > 0:
+                skip -= 1
+                continue
+            yield entry
+
+    def _fetch(self, label: str, container: Optional[str], limit: int,
+               before: Optional[float]) -> List[TimelineEntry]:
+        """Записи одного источника от новых к старым"""
+        if container is not None:
+            return self._fetch_docker(label, container, limit, before)
+
+        facts = self.logs.facts.get()
+        if facts.journal:
+            journal = self._fetch_journal(label, limit, before)
+            if journal is not None:
+                return journal
+        if label == "kernel":
+            return self._fetch_dmesg(limit, before)
+        path = facts.auth_log_path if label == "auth" else facts.syslog_path
+        if not path:
+            raise RuntimeError("Файл логов не найден или недоступен для чтения")
+        return self._fetch_syslog_file(label, path, limit, before)
+
+    def _fetch_journal(self, label: str, limit: int, before: Optional[float]) -> Optional[List[TimelineEntry]]:
+        args = self.logs.journal_json_args(
+            kernel=label == "kernel",
+            facilities=AUTH_FACILITIES if label == "auth" else None
+        )
+        if before is not None:
+            args.append(f"--until=@{before:.6f}")
+        args.append(f"-n {int(limit)}")
+
+        result = self.ssh.execute_command(' '.join(args))
+        if not result["success"]:
+            return None
+
+        entries = []
+        for line in result["output"].split('\n'):
+            entry = self.logs.parse_journal_json(line)
+            if entry is None:
+                continue
+            try:
+                ts = int(entry["__REALTIME_TIMESTAMP"]) / 1_000_000
+            except (KeyError, TypeError, ValueError):
+                continue
+            _, _, level, service, message = self.logs.journal_entry_to_record(entry)
+            entries.append((ts, label, level, service, message))
+        return self._newest_first(entries, before)
+
+    def _fetch_syslog_file(self, label: str, path: str, limit: int,
+                           before: Optional[float]) -> List[TimelineEntry]:
+        scan = self.config['SCAN_LINES'] if before is not None else limit
+        result = self.ssh.execute_command(f"tail -n {int(scan)} {shlex.quote(path)}")
+        if not result["success"]:
+            raise RuntimeError(result["error"] or "Файл логов недоступен")
+
+        entries = []
+        for _, timestamp, level, service, message in self.logs.parse_log_buffer(result["output"], label):
+            ts = parse_log_timestamp(timestamp)
+            if ts is not None:
+                entries.append((ts, label, level, service, message))
+        return self._newest_first(entries, before)[:limit]
+
+    def _fetch_dmesg(self, limit: int, before: Optional[float]) -> List[TimelineEntry]:
+        """dmesg без -T: время загрузки = сейчас - uptime, затем монотонные секунды в epoch
+
+        В отличие от dmesg -T, такая привязка берет текущие часы хоста и
+        uptime одной командой, поэтому не зависит от локали и формата даты.
+        """
+        scan = self.config['SCAN_LINES'] if before is not None else limit
+        result = self.ssh.execute_command(
+            f"echo \"$(date +%s.%N) $(cut -d' ' -f1 /proc/uptime)\"; dmesg 2>/dev/null | tail -n {int(scan)}")
+        if not result["success"]:
+            raise RuntimeError(result["error"] or "dmesg недоступен")
+
+        header, _, body = result["output"].partition('\n')
+        try:
+            now, uptime = (float(value) for value in header.split())
+        except ValueError:
+            raise RuntimeError("Не удалось определить время загрузки хоста")
+        boot = now - uptime
+
+        entries = []
+        for line in body.split('\n'):
+            match = DMESG_MONOTONIC_RE.match(line)
+            if match:
+                message = match.group(2)
+                entries.append((boot + float(match.group(1)), "kernel", detect_level(message), "kernel", message))
+        return self._newest_first(entries, before)[:limit]
+
+    def _fetch_docker(self, label: str, container: str, limit: int,
+                      before: Optional[float]) -> List[TimelineEntry]:
+        """Записи контейнера старше курсора
+
+        docker logs применяет --tail до фильтра --until, поэтому страницы в
+        прошлое читаются окнами времени [since, until): tail обрезает уже
+        отфильтрованный вывод. Окно расширяется в прошлое, пока не набрано
+        limit записей или окно не дошло до создания контейнера.
+        """
+        if before is None:
+            return self._docker_window(label, container, f"--tail {int(limit)}", limit)
+
+        entries: List[TimelineEntry] = []
+        created = None
+        # Записи с меткой курсора нужны для пропуска по курсору
+        until = before + 0.000001
+        window = self.config['DOCKER_WINDOW']
+        while len(entries) < limit:
+            since = until - window
+            # Окно [since, until) с небольшим запасом на обеих границах: включает ли docker
+            # границы, не важно - записи на границе попадают ровно в одно окно
+            chunk = [entry for entry in self._docker_window(
+                label, container, f"--since {since - 0.000001:.6f} --until {until + 0.000001:.6f}",
+                limit - len(entries) + DOCKER_BOUNDARY_SLACK)
+                if since <= entry[0] < until]
+            entries.extend(chunk)
+            if len(entries) >= limit:
+                break
+            if created is None:
+                created = self._container_created(container)
+            if since <= created or before - since >= self.config['DOCKER_MAX_WINDOW']:
+                break
+            until = since
+            window *= 4
+        return self._newest_first(entries, before)[:limit]
+
+    def _docker_window(self, label: str, container: str, window_args: str, limit: int) -> List[TimelineEntry]:
+        # Код выхода docker теряется в конвейере с tail - передаем его последней строкой
+        result = self.ssh.execute_command(
+            f"{{ docker logs --timestamps {window_args} {shlex.quote(container)} 2>&1 "
+            f"|| echo \"{DOCKER_FAILED_MARK} $?\"; }} | tail -n {int(limit) + 1}")
+        output = result["output"]
+        if not result["success"] or DOCKER_FAILED_MARK in output.rpartition('\n')[2]:
+            raise RuntimeError(result["error"] or output.rpartition(DOCKER_FAILED_MARK)[0].strip()
+                               or "docker logs завершился с ошибкой")
+
+        entries = []
+        for line in output.split('\n')[-int(limit):]:
+            timestamp, text = split_docker_timestamp(line)
+            ts = parse_iso_epoch(timestamp) if timestamp else None
+            if ts is not None:
+                entries.append((ts, label, detect_level(text), container, text))
+        return self._newest_first(entries, None)
+
+    def _container_created(self, container: str) -> float:
+        """Время создания контейнера (epoch); 0 - если определить не удалось"""
+        result = self.ssh.execute_command(
+            f"docker inspect --format '{{{{.Created}}}}' {shlex.quote(container)} 2>/dev/null")
+        created = parse_iso_epoch(result["output"].strip()) if result["success"] else None
+        return created if created is not None else 0.0
+
+    @staticmethod
+    def _newest_first(entries: List[TimelineEntry], before: Optional[float]) -> List[TimelineEntry]:
+        if before is not None:
+            entries = [entry for entry in entries if entry[0] <= before]
+        # Источники отдают записи по возрастанию (но syslog при смене часов может нарушать порядок).
+        # Разворот до устойчивой сортировки оставляет записи с одной меткой от новых к старым:
+        # при обрезке окна источника (-n, --tail) теряются самые старые из них, и пропуск
+        # по курсору остается согласованным между страницами
+        entries.reverse()
+        entries.sort(key=lambda entry: entry[0], reverse=True)
+        return entries
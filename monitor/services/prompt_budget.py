@@ -0,0 +1,167 @@
+import math
+from typing import Callable, Dict, List, Optional, Tuple
+from django.conf import settings
+
+try:
+    import tiktoken
+
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+TRUNCATED_MARK = "... (сокращено)"
+
+
+def estimate_tokens(text: str) -> int:
+    """Число токенов: точно через tiktoken, если он установлен, иначе по числу символов
+
+    Кириллица кодируется примерно вдвое плотнее латиницы, поэтому
+    ASCII и остальные символы считаются с разными коэффициентами.
+    """
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    config = settings.AI_PROMPT_BUDGET
+    ascii_chars = sum(1 for char in text if char < '\x80')
+    return math.ceil(ascii_chars / config['ASCII_CHARS_PER_TOKEN']
+                     + (len(text) - ascii_chars) / config['OTHER_CHARS_PER_TOKEN'])
+
+
+def truncate_lines(text: str, max_tokens: int, keep: str = "head") -> str:
+    """Обрезка по границам строк: keep=head оставляет начало, keep=tail - конец (свежие строки логов)"""
+    lines = text.split('\n')
+    if keep == "tail":
+        lines.reverse()
+    budget = max_tokens - estimate_tokens(TRUNCATED_MARK) - 1
+    kept = []
+    for line in lines:
+        cost = estimate_tokens(line) + 1
+        if cost > budget:
+            break
+        kept.append(line)
+        budget -= cost
+    if len(kept) == len(lines):
+        return text
+    if keep == "tail":
+        kept.reverse()
+        return '\n'.join([TRUNCATED_MARK] + kept)
+    return '\n'.join(kept + [TRUNCATED_MARK])
+
+
+class PromptSection:
+    __slots__ = ('name', 'text', 'priority', 'required', 'compressor', 'keep')
+
+    def __init__(self, name: str, text: str, priority: int, required: bool = False,
+                 compressor: Callable[[str], str] = None, keep: str = "head"):
+        self.name = name
+        self.text = text
+        self.priority = priority
+        self.required = required
+        self.compressor = compressor
+        self.keep = keep
+
+
+class PromptBudget:
+    """Сборка промпта из разделов в пределах бюджета токенов
+
+    Разделы заполняют бюджет по приоритету (меньше - важнее). Обязательные
+    разделы (вопрос, инструкции) входят всегда. Сначала каждый раздел
+    берется в сжатой форме (compressor), затем по приоритету заменяется
+    полной, пока хватает бюджета. Не поместившийся раздел обрезается по
+    строкам, а если места совсем мало - выбрасывается. В готовом промпте
+    разделы идут в порядке добавления, в отчете - стоимость каждого в токенах.
+    """
+
+    def __init__(self, budget_tokens: int = None, min_section_tokens: int = None):
+        config = settings.AI_PROMPT_BUDGET
+        self.budget = budget_tokens or config['TOTAL_TOKENS']
+        self.min_section_tokens = min_section_tokens or config['MIN_SECTION_TOKENS']
+        self.sections: List[PromptSection] = []
+
+    def add(self, name: str, text: str, priority: int = 50, required: bool = False,
+            compressor: Callable[[str], str] = None, keep: str = "head") -> 'PromptBudget':
+        if text:
+            self.sections.append(PromptSection(name, text, priority, required, compressor, keep))
+        return self
+
+    def compile(self, separator: str = "\n\n") -> Tuple[str, Dict]:
+        """Готовый промпт и отчет о стоимости разделов"""
+        separator_cost = estimate_tokens(separator)
+        original = {section.name: estimate_tokens(section.text) for section in self.sections}
+        chosen: Dict[str, Tuple[str, str]] = {}
+
+        # Обязательные разделы резервируют место заранее
+        remaining = self.budget
+        for section in self.sections:
+            if section.required:
+                chosen[section.name] = (section.text, "full")
+                remaining -= original[section.name] + separator_cost
+
+        # Первый проход: каждый раздел в компактной форме, чтобы один длинный
+        # список не вытеснил остальные; второй - полные версии по приоритету
+        optional = sorted((section for section in self.sections if not section.required),
+                          key=lambda section: section.priority)
+        for section in optional:
+            available = remaining - separator_cost
+            text, state = self._fit(section, original[section.name], available)
+            if state == "full" and section.compressor:
+                compressed = section.compressor(section.text)
+                if estimate_tokens(compressed) < original[section.name]:
+                    text, state = compressed, "compressed"
+            if text is None:
+                chosen[section.name] = ("", "dropped")
+                continue
+            chosen[section.name] = (text, state)
+            remaining -= estimate_tokens(text) + separator_cost
+
+        for section in optional:
+            text, state = chosen[section.name]
+            if state != "compressed":
+                continue
+            extra = original[section.name] - estimate_tokens(text)
+            if extra <= remaining:
+                chosen[section.name] = (section.text, "full")
+                remaining -= extra
+
+        parts = [chosen[section.name][0] for section in self.sections if chosen[section.name][0]]
+        prompt = separator.join(parts)
+
+        report = {
+            "budget": self.budget,
+            "total_tokens": estimate_tokens(prompt),
+            "tokenizer": "tiktoken" if _ENCODING is not None else "estimate",
+            "sections": [
+                {
+                    "name": section.name,
+                    "priority": section.priority,
+                    "state": chosen[section.name][1],
+                    "tokens": estimate_tokens(chosen[section.name][0]),
+                    "original_tokens": original[section.name]
+                }
+                for section in self.sections
+            ]
+        }
+        return prompt, report
+
+    def _fit(self, section: PromptSection, cost: int, available: int) -> Tuple[Optional[str], str]:
+        if cost <= available:
+            return section.text, "full"
+        if available < self.min_section_tokens:
+            return None, "dropped"
+
+        text, state = section.text, "truncated"
+        if section.compressor:
+            text = section.compressor(section.text)
+            if estimate_tokens(text) <= available:
+                return text, "compressed"
+            state = "compressed+truncated"
+        return truncate_lines(text, available, section.keep), state
+
+
+def format_budget_report(report: Dict) -> str:
+    """Короткая строка для лога: итог и состояние разделов, которые не вошли целиком"""
+    changed = [f"{section['name']}:{section['state']}" for section in report["sections"]
+               if section["state"] != "full"]
+    line = f"{report['total_tokens']}/{report['budget']} токенов"
+    return f"{line} ({', '.join(changed)})" if changed else line
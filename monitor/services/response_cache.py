@@ -0,0 +1,219 @@
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+from django.conf import settings
+from django.db import DatabaseError
+from django.db.models import F
+from ..models import AIResponseCacheEntry
+
+# Намерения в том же порядке, что и в умном fallback агента
+QUERY_INTENTS = (
+    ("greeting", ("привет", "здравствуй", "hello")),
+    ("processes", ("процесс", "нагружают", "топ", "process")),
+    ("docker", ("докер", "docker", "контейнер", "container")),
+    ("services", ("сервис", "service")),
+    ("network", ("сеть", "сети", "network", "порт")),
+    ("status", ("статус", "состояние", "как дела", "status", "health")),
+)
+# Разделы снимка, от которых зависит ответ на вопрос с таким намерением
+INTENT_SECTIONS = {
+    "greeting": ("resources", "docker", "services"),
+    "status": ("resources", "docker", "services"),
+    "processes": ("processes", "resources"),
+    "docker": ("docker",),
+    "services": ("services",),
+    "network": ("network",),
+}
+# Слова, которые не меняют смысл типового вопроса
+FILLER_WORDS = frozenset((
+    "а", "и", "в", "на", "по", "с", "у", "ли", "же", "ну", "мне", "нас", "как", "какой", "какие", "каков",
+    "что", "есть", "сейчас", "общий", "общее", "все", "всех", "покажи", "проверь", "расскажи", "дай",
+    "пожалуйста", "система", "системы", "сервер", "сервера", "the", "a", "is", "are", "what", "how",
+    "show", "check", "please", "me", "system", "server", "of", "current",
+))
+PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+DIGITS_RE = re.compile(r'\d')
+# Значения, которые меняются каждую секунду и не влияют на смысл ответа
+VOLATILE_KEYS = frozenset(("used", "free", "available", "bandwidth", "pid", "created",
+                           "uptime", "network_io", "block_io", "memory_usage"))
+
+
+def normalize_query(query: str) -> str:
+    """Нижний регистр, без пунктуации и лишних пробелов"""
+    query = PUNCTUATION_RE.sub(' ', query.lower().replace('ё', 'е'))
+    return ' '.join(query.split())
+
+
+def classify_query(normalized: str) -> Optional[str]:
+    for intent, keywords in QUERY_INTENTS:
+        if any(keyword in normalized for keyword in keywords):
+            return intent
+    return None
+
+
+def semantic_query_key(query: str) -> str:
+    """Ключ вопроса: намерение для типовых вопросов, иначе нормализованный текст
+
+    "Как дела?", "status" и "Какой общий статус системы" дают один ключ
+    intent:status. Вопрос с любыми другими значимыми словами ("почему
+    контейнер nginx падает") кэшируется только по своему тексту.
+    """
+    normalized = normalize_query(query)
+    intent = classify_query(normalized)
+    if intent:
+        # Слова о состоянии уточняют любое намерение: "состояние docker" = docker
+        keywords = dict(QUERY_INTENTS)[intent] + dict(QUERY_INTENTS)["status"]
+        phrase_words = {word for keyword in keywords for word in keyword.split()}
+        if all(token in FILLER_WORDS or token in phrase_words
+               or any(keyword in token for keyword in keywords)
+               for token in normalized.split()):
+            return f"intent:{intent}"
+    return f"q:{normalized}"
+
+
+def coarsen(value: Any, key: str = '', bucket: float = 5) -> Any:
+    """Огрубление данных снимка: проценты по корзинам, без счетчиков и времени работы"""
+    if isinstance(value, dict):
+        return {k: coarsen(v, k, bucket) for k, v in sorted(value.items()) if k not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [coarsen(item, key, bucket) for item in value]
+    if key.endswith(("percent", "usage")):
+        try:
+            return int(round(float(str(value).rstrip('%')) / bucket))
+        except ValueError:
+            return value
+    if key == "status" and isinstance(value, str) and DIGITS_RE.search(value):
+        # "Up 5 minutes" и "Up 2 hours" - одно и то же состояние
+        return value.split()[0]
+    return value
+
+
+class ResponseCache:
+    """Кэш ответов ИИ по смыслу вопроса и состоянию системы
+
+    Ключ - вид запроса, смысловой ключ вопроса и хэш огрубленных данных
+    тех разделов снимка, от которых зависит ответ. Одинаковый вопрос при
+    неизменном состоянии отдается из памяти (LRU с TTL) без запроса к
+    модели; при PERSIST записи переживают перезапуск процесса (БД).
+    """
+
+    def __init__(self, ttl: float = None, max_entries: int = None, persist: bool = None):
+        config = settings.AI_RESPONSE_CACHE
+        self.enabled = config['ENABLED']
+        self.ttl = ttl if ttl is not None else config['TTL']
+        self.max_entries = max_entries or config['MAX_ENTRIES']
+        self.persist = config['PERSIST'] if persist is None else persist
+        self.bucket = config['PERCENT_BUCKET']
+        # key -> (expires_at, value)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def make_key(self, kind: str, query: str, system_data: Dict = None,
+                 sections: Iterable[str] = None, context: str = "") -> str:
+        """sections - разделы состояния для ключа; по умолчанию выбираются по намерению вопроса
+
+        context - то, от чего ответ зависит помимо вопроса и состояния
+        (например, отпечаток истории разговора); пустой - ключ общий.
+        """
+        query_key = semantic_query_key(query)
+        intent = query_key[len("intent:"):] if query_key.startswith("intent:") else \
+            classify_query(normalize_query(query))
+        system_data = system_data or {}
+        sections = sorted(sections) if sections is not None else \
+            INTENT_SECTIONS.get(intent) or sorted(system_data)
+        state = {name: coarsen(system_data.get(name), bucket=self.bucket) for name in sections}
+        fingerprint = json.dumps(state, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(f"{kind}|{query_key}|{fingerprint}|{context}".encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[Dict]:
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+
+        value = self._load(key, now) if self.persist else None
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._remember(key, value[0], value[1])
+            return value[1]
+
+    def put(self, key: str, kind: str, query: str, value: Dict):
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, expires_at, value)
+        if self.persist:
+            self._save(key, kind, query, value, expires_at)
+
+    def _remember(self, key: str, expires_at: float, value: Dict):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load(self, key: str, now: float) -> Optional[tuple]:
+        try:
+            entry = AIResponseCacheEntry.objects.filter(
+                key=key, expires_at__gt=datetime.fromtimestamp(now, tz=timezone.utc)).first()
+            if entry is None:
+                return None
+            AIResponseCacheEntry.objects.filter(pk=entry.pk).update(hits=F('hits') + 1)
+            return entry.expires_at.timestamp(), entry.response
+        except DatabaseError as e:
+            print(f"⚠️ Ошибка чтения кэша ответов ИИ: {e}")
+            return None
+
+    def _save(self, key: str, kind: str, query: str, value: Dict, expires_at: float):
+        try:
+            AIResponseCacheEntry.objects.update_or_create(key=key, defaults={
+                "kind": kind,
+                "query": query[:1000],
+                "response": value,
+                "expires_at": datetime.fromtimestamp(expires_at, tz=timezone.utc),
+                "hits": 0
+            })
+        except DatabaseError as e:
+            print(f"⚠️ Ошибка записи кэша ответов ИИ: {e}")
+
+    def clear(self) -> int:
+        with self._lock:
+            cleared = len(self._entries)
+            self._entries.clear()
+        if self.persist:
+            try:
+                cleared = max(cleared, AIResponseCacheEntry.objects.all().delete()[0])
+            except DatabaseError as e:
+                print(f"⚠️ Ошибка очистки кэша ответов ИИ: {e}")
+        return cleared
+
+    def stats(self) -> Dict:
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl": self.ttl,
+                "persist": self.persist,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / requests, 3) if requests else 0
+            }
@@ -0,0 +1,112 @@
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from .ssh_service import SSHService
+
+
+class SnapshotSection:
+    """Один раздел снимка: данные, версия и время обновления"""
+    __slots__ = ('name', 'loader', 'ttl', 'data', 'version', 'digest', 'updated_at', 'error', 'lock')
+
+    def __init__(self, name: str, loader: Callable[[], Any], ttl: float):
+        self.name = name
+        self.loader = loader
+        self.ttl = ttl
+        self.data = None
+        self.version = 0
+        self.digest = None
+        self.updated_at = 0.0
+        self.error = None
+        self.lock = threading.Lock()
+
+    def age(self) -> Optional[float]:
+        return time.time() - self.updated_at if self.updated_at else None
+
+    def is_stale(self, max_age: float = None) -> bool:
+        age = self.age()
+        return age is None or age >= (self.ttl if max_age is None else max_age)
+
+
+class SnapshotStore:
+    """Общий снимок состояния хоста по разделам с бюджетом свежести
+
+    У каждого раздела свой TTL: при чтении обновляются только устаревшие
+    разделы, параллельно и не больше одного обновления раздела за раз.
+    Версия раздела растет только при изменении содержимого, поэтому по
+    версиям и хэшам можно понять, изменилось ли состояние хоста.
+    Переподключение SSH сбрасывает все разделы.
+    """
+
+    def __init__(self, ssh_service: SSHService, loaders: Dict[str, Callable[[], Any]], ttls: Dict[str, float]):
+        self.ssh = ssh_service
+        self.sections = {name: SnapshotSection(name, loader, ttls.get(name, 30))
+                         for name, loader in loaders.items()}
+        self._generation = ssh_service.generation
+
+    def get(self, sections: Iterable[str] = None, max_age: float = None) -> Dict[str, Any]:
+        """Данные разделов; устаревшие (старше TTL или max_age) обновляются"""
+        self._check_generation()
+        chosen = [self.sections[name] for name in (sections or self.sections) if name in self.sections]
+        stale = [section for section in chosen if section.is_stale(max_age)]
+
+        if len(stale) == 1:
+            self._refresh(stale[0], max_age)
+        elif stale:
+            with ThreadPoolExecutor(max_workers=len(stale)) as executor:
+                list(executor.map(lambda section: self._refresh(section, max_age), stale))
+
+        return {section.name: section.data for section in chosen if section.data is not None}
+
+    def _refresh(self, section: SnapshotSection, max_age: float = None):
+        with section.lock:
+            # Пока ждали блокировку, раздел мог обновить другой поток
+            if not section.is_stale(max_age):
+                return
+            try:
+                data = section.loader()
+            except Exception as e:
+                # Старые данные остаются доступны, ошибка видна в describe()
+                section.error = str(e)
+                print(f"⚠️ Ошибка обновления раздела снимка {section.name}: {e}")
+                return
+
+            digest = hashlib.sha1(json.dumps(data, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+            if digest != section.digest:
+                section.version += 1
+                section.digest = digest
+            section.data = data
+            section.updated_at = time.time()
+            section.error = None
+
+    def _check_generation(self):
+        if self.ssh.generation != self._generation:
+            self._generation = self.ssh.generation
+            # Данные прежнего подключения (возможно, другого хоста) не показываем
+            self.invalidate(clear=True)
+
+    def invalidate(self, sections: List[str] = None, clear: bool = False):
+        """Пометить разделы устаревшими; без clear данные остаются до следующего обновления"""
+        for name in sections or list(self.sections):
+            section = self.sections.get(name)
+            if section is None:
+                continue
+            with section.lock:
+                section.updated_at = 0.0
+                if clear:
+                    section.data = None
+
+    def describe(self) -> Dict[str, Dict]:
+        """Версии, хэши и возраст разделов"""
+        return {
+            name: {
+                "version": section.version,
+                "digest": section.digest,
+                "age": round(section.age(), 2) if section.age() is not None else None,
+                "ttl": section.ttl,
+                "error": section.error
+            }
+            for name, section in self.sections.items()
+        }
@@ -1,6 +1,6 @@
 import paramiko
 import logging
-from typing import Dict, Optional
+from typing import Dict, Iterator, Optional
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
@@ -10,6 +10,9 @@ class SSHService:
     def __init__(self):
         self.ssh_client = None
         self.connected = False
+        self.host = None
+        # Номер подключения: меняется при каждом успешном connect, по нему сбрасываются кэши хоста
+        self.generation = 0
 
     def connect(self, host: str = None, username: str = None,
                 password: str = None, key_file: str = None, port: int = 22) -> bool:
@@ -30,6 +33,8 @@ class SSHService:
                 self.ssh_client.connect(host, port=port, username=username, password=password)
 
             self.connected = True
+            self.host = f"{username}@{host}:{port}"
+            self.generation += 1
             logger.info(f"Успешное подключение к {host}")
             return True
 
@@ -71,6 +76,49 @@ class SSHService:
                 "command": command
             }
 
+    def stream_command(self, command: str, timeout: int = 30, chunk_size: int = 65536,
+                       check: bool = True, fail_marker: str = None) -> Iterator[bytes]:
+        """Потоковое выполнение команды: stdout отдается кусками по мере поступления
+
+        При check=True ненулевой код выхода после окончания вывода поднимает
+        RuntimeError с текстом stderr. fail_marker - строка, которую команда
+        пишет в stderr при ошибке внутри конвейера (код выхода конвейера -
+        код последней команды); ее появление тоже поднимает RuntimeError.
+        """
+        if not self.connected or not self.ssh_client:
+            raise ConnectionError("SSH подключение не установлено")
+
+        stdin, stdout, stderr = self.ssh_client.exec_command(command, timeout=timeout)
+        channel = stdout.channel
+        try:
+            while True:
+                data = channel.recv(chunk_size)
+                if not data:
+                    break
+                yield data
+
+            exit_code = channel.recv_exit_status()
+            if check and exit_code != 0:
+                error = stderr.read().decode('utf-8', errors='ignore').strip()
+                raise RuntimeError(error or f"Команда завершилась с кодом {exit_code}")
+            if fail_marker:
+                error = stderr.read().decode('utf-8', errors='ignore').strip()
+                if fail_marker in error:
+                    raise RuntimeError(error.replace(fail_marker, "код выхода").strip())
+        finally:
+            channel.close()
+
+    def iter_command_lines(self, command: str, timeout: int = 30, check: bool = True) -> Iterator[str]:
+        """Построчное чтение вывода команды без буферизации всего ответа"""
+        pending = b""
+        for chunk in self.stream_command(command, timeout=timeout, check=check):
+            pending += chunk
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                yield line.decode('utf-8', errors='ignore')
+        if pending:
+            yield pending.decode('utf-8', errors='ignore')
+
     def disconnect(self):
         """Отключение от сервера"""
         if self.ssh_client:
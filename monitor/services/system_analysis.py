@@ -0,0 +1,154 @@
+import re
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from .response_cache import classify_query, normalize_query
+
+# Сборщики данных по намерению запроса; без намерения - общая диагностика
+ANALYSIS_PLANS = {
+    "greeting": ("resources", "docker", "services"),
+    "status": ("resources", "docker", "services", "logs"),
+    "processes": ("resources", "processes"),
+    "docker": ("docker", "containers"),
+    "services": ("services", "logs"),
+    "network": ("network",),
+    "logs": ("resources", "services", "logs"),
+}
+DEFAULT_PLAN = ("resources", "processes", "docker", "services", "logs")
+SNAPSHOT_COLLECTORS = ("resources", "processes", "docker", "services", "network")
+LOG_KEYWORDS = ("лог", "log", "ошибк", "error", "журнал")
+
+SEVERITY_ORDER = ("critical", "warning", "info")
+SEVERITY_LABELS = {"critical": "критично", "warning": "внимание", "info": "инфо"}
+FINDING_RE = re.compile(r'^\s*(?:[-*•]|\d+[.)])\s*\[(критично|внимание|инфо)\]\s*(.+)$', re.IGNORECASE)
+RECOMMENDATION_SPLIT_RE = re.compile(r'\s+[—–-]\s+')
+
+
+def plan_collectors(query: str) -> Tuple[Optional[str], Tuple[str, ...]]:
+    """Намерение запроса и сборщики, нужные для ответа"""
+    normalized = normalize_query(query)
+    intent = classify_query(normalized)
+    if intent is None and any(keyword in normalized for keyword in LOG_KEYWORDS):
+        intent = "logs"
+    collectors = ANALYSIS_PLANS.get(intent, DEFAULT_PLAN)
+    if intent not in (None, "logs") and any(keyword in normalized for keyword in LOG_KEYWORDS):
+        collectors += ("logs",)
+    return intent, collectors
+
+
+def mentioned_containers(query: str, containers: List[Dict], limit: int) -> List[Dict]:
+    """Контейнеры, упомянутые в запросе по имени или короткому ID"""
+    text = query.lower()
+    words = set(re.findall(r'[\w.-]+', text))
+    found = []
+    for container in containers:
+        name = (container.get("name") or "").lower()
+        container_id = (container.get("id") or "").lower()
+        if (name and name in text) or (container_id and container_id in words):
+            found.append(container)
+            if len(found) >= limit:
+                break
+    return found
+
+
+def summarize_container(info: Dict) -> str:
+    """Сжатый docker inspect: состояние, порты, тома; переменные окружения - только числом"""
+    ports = []
+    for container_port, bindings in (info.get("ports") or {}).items():
+        if bindings:
+            ports.extend(f"{binding.get('HostIp', '')}:{binding.get('HostPort', '')}->{container_port}"
+                         for binding in bindings)
+        else:
+            ports.append(container_port)
+    mounts = [f"{mount.get('Source', '')}:{mount.get('Destination', '')}" for mount in info.get("mounts") or []]
+    stats = info.get("stats") or {}
+
+    lines = [f"Контейнер {info.get('name', 'N/A')} ({info.get('image', 'N/A')}): {info.get('status', 'N/A')}"]
+    if ports:
+        lines.append("Порты: " + ", ".join(ports))
+    if mounts:
+        lines.append("Тома: " + ", ".join(mounts))
+    # Значения переменных окружения могут содержать секреты и в промпт не попадают
+    lines.append(f"Переменных окружения: {len(info.get('env_variables') or [])}")
+    if stats:
+        lines.append(f"CPU {stats.get('cpu_percent', 'N/A')}, память {stats.get('memory_usage', 'N/A')}, "
+                     f"процессов {stats.get('pids', 'N/A')}")
+    return "\n".join(lines)
+
+
+def rule_findings(system_data: Dict, log_templates: List[Dict] = None) -> List[Dict]:
+    """Находки по порогам и состояниям без участия модели"""
+    config = settings.AI_ANALYSIS
+    findings = []
+
+    def add(severity, source, title):
+        findings.append({"severity": severity, "source": source, "title": title,
+                         "recommendation": "", "origin": "rules"})
+
+    resources = system_data.get("resources") or {}
+    for label, value, thresholds in (
+            ("CPU", resources.get("cpu_usage"), config['CPU_THRESHOLDS']),
+            ("Память", (resources.get("memory") or {}).get("usage_percent"), config['MEMORY_THRESHOLDS']),
+            ("Диск", (resources.get("disk") or {}).get("usage_percent"), config['DISK_THRESHOLDS'])):
+        try:
+            percent = float(str(value).rstrip('%'))
+        except (TypeError, ValueError):
+            continue
+        if percent >= thresholds[1]:
+            add("critical", "resources", f"{label}: {percent:g}% (порог {thresholds[1]}%)")
+        elif percent >= thresholds[0]:
+            add("warning", "resources", f"{label}: {percent:g}% (порог {thresholds[0]}%)")
+
+    services = system_data.get("services") or {}
+    failed = [s.get("name", "N/A") for s in services.get("services_list", []) if s.get("status") == "failed"]
+    if failed:
+        add("critical", "services", "Сервисы с ошибкой: " + ", ".join(failed))
+
+    docker = system_data.get("docker") or {}
+    # Остановка с ненулевым кодом - падение, Exited (0) - штатная остановка
+    crashed = [c.get("name", "N/A") for c in docker.get("stopped_list", [])
+               if "Exited (0)" not in c.get("status", "")]
+    if crashed:
+        add("warning", "docker", "Контейнеры остановлены с ошибкой: " + ", ".join(crashed))
+
+    errors = [template for template in log_templates or [] if template.get("level") in ("critical", "error")]
+    if errors:
+        top = max(errors, key=lambda template: template.get("count", 0))
+        add("warning", "logs", f"В логах {sum(t.get('count', 0) for t in errors)} ошибок по {len(errors)} "
+                               f"шаблонам, чаще всего: {top.get('template', '')[:120]}")
+    return findings
+
+
+def parse_findings(text: str) -> List[Dict]:
+    """Находки модели из строк вида "- [критично] проблема — рекомендация" """
+    labels = {label: severity for severity, label in SEVERITY_LABELS.items()}
+    findings = []
+    for line in text.split('\n'):
+        match = FINDING_RE.match(line)
+        if not match:
+            continue
+        parts = RECOMMENDATION_SPLIT_RE.split(match.group(2).strip(), 1)
+        findings.append({
+            "severity": labels[match.group(1).lower()],
+            "source": "model",
+            "title": parts[0].strip(),
+            "recommendation": parts[1].strip() if len(parts) > 1 else "",
+            "origin": "model"
+        })
+    return findings
+
+
+def sort_findings(findings: List[Dict]) -> List[Dict]:
+    return sorted(findings, key=lambda finding: SEVERITY_ORDER.index(finding["severity"]))
+
+
+def format_findings(findings: List[Dict]) -> str:
+    """Текст находок для ответа без модели"""
+    if not findings:
+        return "Проблем по пороговым проверкам не обнаружено."
+    lines = []
+    for finding in findings:
+        line = f"- [{SEVERITY_LABELS[finding['severity']]}] {finding['title']}"
+        if finding["recommendation"]:
+            line += f" — {finding['recommendation']}"
+        lines.append(line)
+    return "\n".join(lines)
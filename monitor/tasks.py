@@ -0,0 +1,17 @@
+from celery import shared_task
+
+
+# Сервисы создаются в views (там же автоподключение SSH), как и в веб-процессе
+
+@shared_task(name='monitor.tasks.run_analysis_job', ignore_result=True, acks_late=True)
+def run_analysis_job(job_id):
+    from .views import analysis_jobs
+
+    analysis_jobs.run(job_id)
+
+
+@shared_task(name='monitor.tasks.nightly_container_review', ignore_result=True)
+def nightly_container_review():
+    from .views import analysis_jobs
+
+    return analysis_jobs.review_containers()
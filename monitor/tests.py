@@ -1,3 +1,908 @@
-from django.test import TestCase
+import gzip
+import json
+import re
+import shutil
+import subprocess
+import tempfile
+from datetime import datetime, timezone
+from unittest import mock, skipUnless
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone as django_timezone
+from .models import AnalysisJob, ConversationMessage, LogChunk, ServiceLog
+from .services.ai_agent import AIAgent
+from .services.analysis_jobs import AnalysisJobService
+from .services.container_metrics import ContainerMetricsSampler, RingBuffer
+from .services.conversation_memory import ConversationMemory
+from .services.host_facts import HostFactsService
+from .services.docker_service import DockerService, decode_log_cursor, encode_log_cursor
+from .services.llm_client import CircuitBreaker
+from .services.log_excerpt import select_excerpt
+from .services.log_index import LogIndex, levels_at_least, normalize_level
+from .services.log_service import LogFilter, LogService
+from .services.log_storage import LogStorage
+from .services.log_templates import TemplateMiner
+from .services.log_timeline import LogTimeline
+from .services.prompt_budget import PromptBudget, estimate_tokens
+from .services.response_cache import semantic_query_key
+from .services.snapshot_store import SnapshotStore
 
-# Create your tests here.
+BASE_TS = 1_700_000_000
+
+
+class FakeDockerSSH:
+    """SSH, который отвечает на docker logs/inspect из списка (epoch, сообщение)"""
+
+    generation = 1
+    connected = True
+
+    def __init__(self, logs):
+        self.logs = logs
+        self.commands = []
+
+    def execute_command(self, cmd):
+        self.commands.append(cmd)
+        if cmd.startswith("docker inspect"):
+            created = datetime.fromtimestamp(self.logs[0][0] - 5, tz=timezone.utc).isoformat()
+            return {"success": True, "output": created, "error": ""}
+        since = re.search(r'--since (\S+)', cmd)
+        until = re.search(r'--until (\S+)', cmd)
+        tail = re.search(r'--tail (\d+)', cmd)
+        selected = [entry for entry in self.logs
+                    if (not since or entry[0] >= float(since.group(1)))
+                    and (not until or entry[0] < float(until.group(1)))]
+        if tail:
+            selected = selected[-int(tail.group(1)):]
+        selected = selected[-int(re.search(r'\| tail -n (\d+)', cmd).group(1)):]
+        output = '\n'.join(datetime.fromtimestamp(ts, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f000Z')
+                           + ' ' + message for ts, message in selected)
+        return {"success": True, "output": output, "error": ""}
+
+
+class ScriptedSSH:
+    """SSH с заготовленными ответами: первый обработчик, префикс которого совпал с командой"""
+
+    generation = 1
+    connected = True
+    host = "test-host"
+
+    def __init__(self, handlers=None):
+        self.handlers = handlers or {}
+        self.commands = []
+
+    def execute_command(self, cmd):
+        self.commands.append(cmd)
+        for prefix, handler in self.handlers.items():
+            if cmd.startswith(prefix):
+                output = handler(cmd) if callable(handler) else handler
+                if isinstance(output, dict):
+                    return output
+                return {"success": True, "output": output, "error": ""}
+        return {"success": False, "output": "", "error": f"unexpected command: {cmd}"}
+
+
+class LogCursorTests(SimpleTestCase):
+    def test_round_trip(self):
+        cursor = encode_log_cursor("2024-01-01T12:00:00.123456789Z", 3)
+        self.assertEqual(decode_log_cursor(cursor), ("2024-01-01T12:00:00.123456789Z", 3))
+
+    def test_broken_cursor(self):
+        self.assertIsNone(decode_log_cursor("not a cursor"))
+        self.assertIsNone(decode_log_cursor(encode_log_cursor("yesterday", 1)))
+
+
+class LogTimelineTests(SimpleTestCase):
+    def test_docker_pages_cover_log_without_gaps(self):
+        logs = [(BASE_TS + i * 30, f"line {i}") for i in range(300)]
+        # Две записи с одной меткой на границе страницы не должны потеряться
+        logs.insert(150, (logs[150][0], "same timestamp"))
+        ssh = FakeDockerSSH(logs)
+        log_service = mock.Mock(ssh=ssh)
+        timeline = LogTimeline(log_service, mock.Mock())
+
+        seen, cursor = [], None
+        for _ in range(50):
+            page = timeline.get_page(sources=["docker"], containers=["app"], limit=37, cursor=cursor)
+            self.assertTrue(page["success"], page["errors"])
+            seen.extend(entry["message"] for entry in page["entries"])
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+
+        self.assertEqual(sorted(seen), sorted(message for _, message in logs))
+        self.assertEqual(seen[0], "line 299")
+
+    def test_sources_are_merged_newest_first_without_duplicates(self):
+        def journal_line(offset, unit, message):
+            return json.dumps({"__REALTIME_TIMESTAMP": str((BASE_TS + offset) * 1_000_000), "PRIORITY": "6",
+                               "_SYSTEMD_UNIT": unit, "MESSAGE": message})
+
+        class SSH(FakeDockerSSH):
+            def execute_command(self, cmd):
+                if cmd.startswith("journalctl"):
+                    lines = [journal_line(20, "sshd.service", "Accepted key")]
+                    if "SYSLOG_FACILITY" not in cmd:
+                        lines.insert(0, journal_line(5, "cron.service", "job started"))
+                    return {"success": True, "output": '\n'.join(lines), "error": ""}
+                return super().execute_command(cmd)
+
+        ssh = SSH([(BASE_TS + 10, "app ready"), (BASE_TS + 30, "app request")])
+        log_service = LogService(ssh, host_facts=mock.Mock(**{"get.return_value": mock.Mock(journal=True)}))
+        page = LogTimeline(log_service, mock.Mock()).get_page(
+            sources=["system", "auth", "docker"], containers=["app"], limit=10)
+
+        # Запись sshd пришла из system и auth, в ленте она одна
+        self.assertEqual([(entry["source"], entry["message"]) for entry in page["entries"]],
+                         [("docker:app", "app request"), ("auth", "Accepted key"),
+                          ("docker:app", "app ready"), ("system", "job started")])
+        self.assertIsNone(page["next_cursor"])
+
+    def test_invalid_cursor(self):
+        timeline = LogTimeline(mock.Mock(ssh=FakeDockerSSH([(BASE_TS, "x")])), mock.Mock())
+        page = timeline.get_page(sources=["docker"], containers=["app"], cursor="garbage")
+        self.assertFalse(page["success"])
+        self.assertTrue(page["invalid_cursor"])
+
+
+class LogLevelTests(SimpleTestCase):
+    def test_normalize_level(self):
+        self.assertEqual(normalize_level("WARN"), "warning")
+        self.assertEqual(normalize_level(" Warning "), "warning")
+        self.assertEqual(normalize_level("err"), "error")
+        self.assertEqual(normalize_level(None), "info")
+
+    def test_levels_at_least(self):
+        self.assertEqual(levels_at_least("warn"), ["fatal", "critical", "error", "warning"])
+        with self.assertRaises(ValueError):
+            levels_at_least("loud")
+
+    def test_parsed_levels_are_normalized(self):
+        records = LogService(None).parse_log_buffer("Jan  1 12:00:00 host app: WARN disk almost full")
+        self.assertEqual(records[0][2], "warning")
+
+    def test_index_search_by_rank(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(LOG_INDEX={'PATH': f"{directory}/index.sqlite3", 'RETENTION_DAYS': 7,
+                                             'BATCH_SIZE': 2000, 'PURGE_INTERVAL': 600}):
+            index = LogIndex()
+            records = [
+                (f"line {level}", f"2024-01-01T12:00:0{i}", level, "app", f"message {level}")
+                for i, level in enumerate(("debug", "info", "warn", "error", "critical"))
+            ]
+            index.ingest("host", "system", records)
+            found = index.search(level="warning")["results"]
+            self.assertEqual(sorted(row["level"] for row in found), ["critical", "error", "warning"])
+
+
+class PromptBudgetTests(SimpleTestCase):
+    def test_required_sections_always_fit(self):
+        budget = PromptBudget(budget_tokens=60, min_section_tokens=5)
+        budget.add("question", "Почему упал nginx?", priority=0, required=True)
+        budget.add("logs", "\n".join(f"log line number {i}" for i in range(200)), priority=10, keep="tail")
+        prompt, report = budget.compile()
+
+        states = {section["name"]: section["state"] for section in report["sections"]}
+        self.assertIn("Почему упал nginx?", prompt)
+        self.assertEqual(states["question"], "full")
+        self.assertEqual(states["logs"], "truncated")
+        self.assertIn("log line number 199", prompt)
+        self.assertLessEqual(report["total_tokens"], 60 + 5)
+
+    def test_compressed_form_and_drop_by_priority(self):
+        long_text = "\n".join(f"container {i} running" for i in range(100))
+        summary = "summary " * 30
+        # Сжатая форма помещается, а на раздел с низким приоритетом места почти не остается
+        budget = PromptBudget(budget_tokens=estimate_tokens(summary) + 10, min_section_tokens=20)
+        budget.add("containers", long_text, priority=10, compressor=lambda text: summary)
+        budget.add("extra", "x " * 400, priority=90)
+        prompt, report = budget.compile()
+
+        states = {section["name"]: section["state"] for section in report["sections"]}
+        self.assertEqual(states["containers"], "compressed")
+        self.assertEqual(states["extra"], "dropped")
+        self.assertEqual(prompt, summary)
+
+
+class LogExcerptTests(SimpleTestCase):
+    def test_rare_and_severe_lines_win(self):
+        lines = [f"Oct 19 10:{i % 60:02d}:00 host app[{i}]: INFO request {i} served in {i % 90}ms"
+                 for i in range(2000)]
+        lines.insert(100, "Oct 19 09:00:00 host nginx[1]: ERROR upstream timed out while connecting")
+        lines.insert(1500, "Oct 19 10:00:00 host kernel: Out of memory: killed process 1234 (postgres)")
+        records = LogService(None).parse_log_buffer('\n'.join(lines))
+
+        excerpt = select_excerpt(records, query="почему упал postgres", max_tokens=200)
+        self.assertEqual(excerpt["total"], len(lines))
+        self.assertLessEqual(excerpt["tokens"], 200)
+        self.assertIn("ERROR upstream timed out", excerpt["text"])
+        self.assertIn("Out of memory", excerpt["text"])
+        self.assertIn("postgr", excerpt["keywords"])
+        # Строки отрывка идут в исходном порядке
+        text = excerpt["text"]
+        self.assertLess(text.index("ERROR upstream"), text.index("Out of memory"))
+
+    def test_empty_records(self):
+        self.assertEqual(select_excerpt([], max_tokens=100)["selected"], 0)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_open_probe_and_close(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+        self.assertIs(breaker.allow(), True)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "closed")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+
+        self.assertEqual(breaker.allow(), "probe")
+        self.assertEqual(breaker.state, "half_open")
+        # Пока проба в полете, остальные вызовы отклоняются
+        self.assertIs(breaker.allow(), False)
+        breaker.record_success()
+        self.assertEqual(breaker.describe(), {"state": "closed", "failures": 0})
+
+    def test_failed_probe_reopens(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+        breaker.record_failure()
+        self.assertIs(breaker.allow(), False)
+        breaker.opened_at -= 60
+        self.assertEqual(breaker.allow(), "probe")
+        breaker.record_failure()
+        self.assertEqual(breaker.state, "open")
+        self.assertIs(breaker.allow(), False)
+
+    def test_released_probe_can_be_retried(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.allow(), "probe")
+        breaker.release_probe()
+        self.assertEqual(breaker.state, "half_open")
+        self.assertEqual(breaker.allow(), "probe")
+
+
+class SemanticQueryKeyTests(SimpleTestCase):
+    def test_status_questions_share_key(self):
+        self.assertEqual(semantic_query_key("Как дела?"), "intent:status")
+        self.assertEqual(semantic_query_key("status"), "intent:status")
+        self.assertEqual(semantic_query_key("Какой общий статус системы"), "intent:status")
+
+    def test_specific_question_keeps_text(self):
+        key = semantic_query_key("Почему контейнер nginx падает?")
+        self.assertFalse(key.startswith("intent:"))
+        self.assertEqual(key, semantic_query_key("почему   контейнер NGINX падает"))
+
+
+@override_settings(AI_JOBS={'BACKEND': 'thread', 'WORKERS': 1, 'TIMEOUT': 3600, 'QUEUE_TIMEOUT': 86400,
+                            'KEEP_DAYS': 7, 'REVIEW_HOUR': 3, 'REVIEW_MINUTE': 0, 'REVIEW_PRIORITY': 9,
+                            'EVENTS_POLL_INTERVAL': 0.5, 'EVENTS_MAX_SECONDS': 30, 'EVENTS_RETRY_MS': 1000})
+class AnalysisJobServiceTests(TestCase):
+    def setUp(self):
+        self.service = AnalysisJobService(mock.Mock(), mock.Mock())
+        # Задачи не выполняются: проверяется только очередь
+        self.dispatched = []
+        self.service._dispatch = self.dispatched.append
+
+    def test_same_job_is_deduplicated(self):
+        first, created = self.service.submit("system", "Почему высокая нагрузка?")
+        second, created_again = self.service.submit("system", "  почему высокая НАГРУЗКА ")
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(self.dispatched, [first])
+
+    def test_finished_job_is_submitted_again(self):
+        first, _ = self.service.submit("logs")
+        AnalysisJob.objects.filter(pk=first.pk).update(status='done')
+        second, created = self.service.submit("logs")
+        self.assertTrue(created)
+        self.assertNotEqual(first.pk, second.pk)
+
+    def test_different_params_are_separate_jobs(self):
+        web, _ = self.service.submit("container", params={"container": "web"})
+        db, created = self.service.submit("container", params={"container": "db"}, priority="high")
+        self.assertTrue(created)
+        self.assertNotEqual(web.pk, db.pk)
+        self.assertEqual(db.priority, 0)
+
+    def test_stale_running_job_stops_blocking(self):
+        first, _ = self.service.submit("logs")
+        AnalysisJob.objects.filter(pk=first.pk).update(
+            status='running', started_at=datetime(2020, 1, 1, tzinfo=timezone.utc))
+        second, created = self.service.submit("logs")
+        self.assertTrue(created)
+        self.assertEqual(AnalysisJob.objects.get(pk=first.pk).status, 'failed')
+
+
+class IncrementalContainerLogsTests(SimpleTestCase):
+    def test_cursor_skips_lines_already_returned(self):
+        ssh = ScriptedSSH({"docker logs": "2024-01-01T12:00:00.000000001Z first\n"
+                                          "2024-01-01T12:00:01.000000001Z second"})
+        docker = DockerService(ssh)
+        first = docker.get_container_logs_incremental("web", lines=2)
+        self.assertEqual(first["logs"], "first\nsecond")
+
+        ssh.handlers["docker logs"] = ("2024-01-01T12:00:01.000000001Z second\n"
+                                       "2024-01-01T12:00:02.000000001Z third")
+        second = docker.get_container_logs_incremental("web", cursor=first["cursor"])
+        self.assertEqual(second["logs"], "third")
+        self.assertIn("--since 2024-01-01T12:00:01.000000001Z", ssh.commands[-1])
+
+    def test_container_name_is_quoted(self):
+        ssh = ScriptedSSH({"docker logs": ""})
+        DockerService(ssh).get_container_logs_incremental("web; reboot", lines=5)
+        self.assertEqual(ssh.commands[-1], "docker logs 'web; reboot' --timestamps --tail 5 2>&1")
+
+    def test_invalid_cursor(self):
+        result = DockerService(ScriptedSSH()).get_container_logs_incremental("web", cursor="@@@")
+        self.assertFalse(result["success"])
+        self.assertTrue(result["invalid_cursor"])
+
+
+INVENTORY_OUTPUT = ("abc123def456|web|nginx|Up 2 hours|80/tcp\n"
+                    "0123456789ab|db|postgres|Exited (0) 1 hour ago|")
+
+
+class DockerBulkActionTests(SimpleTestCase):
+    def test_only_inventory_containers_are_touched(self):
+        ssh = ScriptedSSH({"docker ps -a": INVENTORY_OUTPUT, "docker restart": ""})
+        results = list(DockerService(ssh).bulk_container_action(["web", "abc1", "$(reboot)"], "restart"))
+
+        by_container = {result["container"]: result for result in results}
+        self.assertEqual(set(by_container), {"web", "$(reboot)"})
+        self.assertTrue(by_container["web"]["success"])
+        self.assertFalse(by_container["$(reboot)"]["success"])
+        self.assertEqual([cmd for cmd in ssh.commands if cmd.startswith("docker restart")],
+                         ["docker restart web"])
+
+    def test_view_streams_unknown_containers_as_errors(self):
+        ssh = ScriptedSSH({"docker ps -a": INVENTORY_OUTPUT, "docker stop": ""})
+        with mock.patch("monitor.views.ssh_service", ssh), \
+                mock.patch("monitor.views.docker_service", DockerService(ssh)):
+            response = self.client.post("/api/docker/containers/bulk/", {"action": "stop", "containers": ["db", "ghost"]},
+                                        content_type="application/json")
+            lines = [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+        self.assertEqual(lines[-1], {"done": True, "total": 2, "succeeded": 1, "failed": 1})
+        errors = [line for line in lines[:-1] if not line["success"]]
+        self.assertEqual([line["container"] for line in errors], ["ghost"])
+
+
+class DockerInventoryCacheTests(SimpleTestCase):
+    FAILED = {"success": False, "output": "", "error": "Cannot connect to the Docker daemon"}
+
+    def test_failed_ps_is_not_cached(self):
+        ssh = ScriptedSSH({"docker ps -a": self.FAILED})
+        docker = DockerService(ssh)
+        self.assertEqual(docker.get_inventory(), [])
+
+        ssh.handlers["docker ps -a"] = INVENTORY_OUTPUT
+        self.assertEqual([c["name"] for c in docker.get_inventory()], ["web", "db"])
+
+    def test_failed_refresh_keeps_previous_inventory(self):
+        ssh = ScriptedSSH({"docker ps -a": INVENTORY_OUTPUT})
+        docker = DockerService(ssh)
+        docker.get_inventory()
+
+        ssh.handlers["docker ps -a"] = self.FAILED
+        self.assertEqual([c["name"] for c in docker.get_inventory(max_age=0)], ["web", "db"])
+        found, unknown = docker.match_inventory(["db"])
+        self.assertEqual((found[0]["name"], unknown), ("db", []))
+
+    def test_reconnect_drops_cached_inventory(self):
+        ssh = ScriptedSSH({"docker ps -a": INVENTORY_OUTPUT})
+        docker = DockerService(ssh)
+        docker.get_inventory()
+
+        ssh.generation += 1
+        ssh.handlers["docker ps -a"] = "fedcba987654|other|redis|Up 1 minute|"
+        self.assertEqual([c["name"] for c in docker.get_inventory()], ["other"])
+
+
+class DockerMergedLogsTests(SimpleTestCase):
+    def logs(self, cmd):
+        if "docker logs web" in cmd:
+            return "2024-01-01T12:00:01.000000000Z web started\n2024-01-01T12:00:04.000000000Z web ready"
+        return "2024-01-01T12:00:02.000000000Z db started\n  continued line"
+
+    def test_streams_are_merged_by_time(self):
+        ssh = ScriptedSSH({"docker ps -a": INVENTORY_OUTPUT, "docker logs": self.logs})
+        merged = DockerService(ssh).get_merged_logs(["web", "db"], lines=2)
+
+        # Две самые свежие записи обоих контейнеров в порядке времени
+        self.assertTrue(merged["success"])
+        self.assertEqual([(e["container"], e["message"]) for e in merged["entries"]],
+                         [("db", "db started\n  continued line"), ("web", "web ready")])
+
+    def test_unknown_containers_are_not_queried(self):
+        ssh = ScriptedSSH({"docker ps -a": INVENTORY_OUTPUT, "docker logs": self.logs})
+        merged = DockerService(ssh).get_merged_logs(["web", "$(reboot)"], lines=5)
+
+        self.assertEqual(merged["containers"], ["web"])
+        self.assertEqual(list(merged["errors"]), ["$(reboot)"])
+        self.assertEqual([cmd for cmd in ssh.commands if cmd.startswith("docker logs")],
+                         ["docker logs web --timestamps --tail 5 2>&1"])
+
+    def test_only_unknown_containers(self):
+        ssh = ScriptedSSH({"docker ps -a": INVENTORY_OUTPUT})
+        merged = DockerService(ssh).get_merged_logs(["ghost"])
+        self.assertFalse(merged["success"])
+        self.assertEqual(merged["entries"], [])
+
+
+class ContainerMetricsTests(SimpleTestCase):
+    @staticmethod
+    def inspect(*containers, started="2024-01-01T00:00:00Z", restarts=0):
+        return '\n'.join(f"/{name}|{restarts}|running|0|false|{started}" for name in containers)
+
+    def test_ring_buffer_keeps_last_values(self):
+        buffer = RingBuffer(3)
+        for value in range(5):
+            buffer.append(value)
+        self.assertEqual(buffer.values(), [2.0, 3.0, 4.0])
+        self.assertEqual(buffer.values(last=2), [3.0, 4.0])
+        self.assertEqual(buffer.latest(), 4.0)
+
+    def test_sample_records_stats_and_restarts(self):
+        ssh = ScriptedSSH({"docker stats": "web|12.5%|100MiB / 1GiB|9.8%", "ids=": self.inspect("web")})
+        sampler = ContainerMetricsSampler(ssh)
+        sampler.sample()
+        ssh.handlers["ids="] = self.inspect("web", started="2024-01-01T01:00:00Z", restarts=1)
+        sampler.sample()
+
+        history = sampler.get_history("web")
+        self.assertEqual(history["cpu_percent"], 12.5)
+        self.assertEqual(history["memory_bytes"], 100 * 1024 ** 2)
+        self.assertEqual(history["restarts_in_window"], 1)
+        self.assertEqual(len(history["history"]["timestamps"]), 2)
+
+    def test_removed_containers_are_evicted(self):
+        ssh = ScriptedSSH({"docker stats": "web|1%|1MiB / 1GiB|0.1%\ndb|1%|1MiB / 1GiB|0.1%",
+                           "ids=": self.inspect("web", "db")})
+        sampler = ContainerMetricsSampler(ssh)
+        sampler.sample()
+        self.assertEqual(set(sampler.series), {"web", "db"})
+
+        ssh.handlers.update({"docker stats": "web|1%|1MiB / 1GiB|0.1%", "ids=": self.inspect("web")})
+        sampler.sample()
+        self.assertEqual(set(sampler.series), {"web"})
+
+        # Все контейнеры удалены: пустой вывод inspect - это успех, история очищается
+        ssh.handlers.update({"docker stats": "", "ids=": ""})
+        sampler.sample()
+        self.assertEqual(sampler.series, {})
+
+    def test_failed_inspect_keeps_history(self):
+        ssh = ScriptedSSH({"docker stats": "web|1%|1MiB / 1GiB|0.1%", "ids=": self.inspect("web")})
+        sampler = ContainerMetricsSampler(ssh)
+        sampler.sample()
+        ssh.handlers["ids="] = {"success": False, "output": "", "error": "daemon down"}
+        sampler.sample()
+        self.assertIn("web", sampler.series)
+
+
+class JournalTailTests(SimpleTestCase):
+    def test_cursor_returns_only_new_lines(self):
+        ssh = ScriptedSSH({"journalctl": "line 1\nline 2\n-- cursor: s=a;i=2"})
+        logs = LogService(ssh, host_facts=mock.Mock())
+        first = logs.tail_journal(unit="nginx", lines=10)
+        self.assertEqual((first["logs"], first["cursor"]), ("line 1\nline 2", "s=a;i=2"))
+
+        ssh.handlers["journalctl"] = "line 3\n-- cursor: s=a;i=3"
+        second = logs.tail_journal(unit="nginx", cursor=first["cursor"])
+        self.assertEqual(second["logs"], "line 3")
+        self.assertIn("--after-cursor=s=a;i=2", ssh.commands[-1].replace("'", ""))
+
+    @override_settings(JOURNAL_TAILS_MAX=2)
+    def test_windows_are_bounded_lru(self):
+        logs = LogService(ScriptedSSH({"journalctl": "x\n-- cursor: s=a"}), host_facts=mock.Mock())
+        for unit in ("a", "b", "a", "c"):
+            logs.tail_journal(unit=unit)
+        self.assertEqual([unit for _, unit in logs._journal_tails], ["a", "c"])
+
+
+class LogParserTests(SimpleTestCase):
+    def setUp(self):
+        self.logs = LogService(None, host_facts=mock.Mock())
+
+    def test_syslog_line(self):
+        entry = self.logs.parse_log_entries("Jan  1 12:00:00 host sshd[1]: ERROR Failed password for root")[0]
+        self.assertEqual(entry["timestamp"], "Jan  1 12:00:00")
+        self.assertEqual(entry["level"], "error")
+        self.assertEqual(entry["service"], "ssh")
+        self.assertEqual(entry["message"], "host sshd[1]: ERROR Failed password for root")
+
+    def test_timestamp_priority_and_fallbacks(self):
+        records = self.logs.parse_log_buffer(
+            "2024-01-01T12:00:00 nginx: GET / 200\n"
+            "[ 1.0] usb: at 12:30:45 reset\n"
+            "no time here\n"
+            "   \n")
+        self.assertEqual([record[1] for record in records], ["2024-01-01T12:00:00", "12:30:45", "Unknown"])
+        self.assertEqual([record[3] for record in records], ["nginx", "system", "system"])
+        self.assertEqual(records[2][2], "info")
+
+    def test_docker_first_word_is_service(self):
+        record = self.logs.parse_log_buffer("api DEBUG cache warmed", "docker")[0]
+        self.assertEqual(record[2:], ("debug", "api", "DEBUG cache warmed"))
+
+
+class JournalJsonTests(SimpleTestCase):
+    def test_entries_use_journal_fields(self):
+        lines = [
+            json.dumps({"__CURSOR": "s=a;i=1", "__REALTIME_TIMESTAMP": "1700000000000000", "PRIORITY": "3",
+                        "_SYSTEMD_UNIT": "nginx.service", "MESSAGE": "upstream failed"}),
+            "not json",
+            json.dumps({"__CURSOR": "s=a;i=2", "__REALTIME_TIMESTAMP": "1700000001000000", "PRIORITY": "4",
+                        "_TRANSPORT": "kernel", "MESSAGE": list("oom".encode())}),
+        ]
+        ssh = mock.Mock(iter_command_lines=mock.Mock(return_value=iter(lines)))
+        holder = {}
+        records = list(LogService(ssh, host_facts=mock.Mock()).iter_journal_records(
+            lines=10, unit="nginx", cursor_holder=holder))
+
+        self.assertEqual([record[2:] for record in records],
+                         [("error", "nginx.service", "upstream failed"), ("warning", "kernel", "oom")])
+        self.assertEqual(records[0][1], "2023-11-14T22:13:20+00:00")
+        self.assertEqual(holder["cursor"], "s=a;i=2")
+        self.assertIn("-u nginx", ssh.iter_command_lines.call_args[0][0])
+
+    def test_bad_cursor_is_rejected(self):
+        with self.assertRaises(ValueError):
+            list(LogService(mock.Mock(), host_facts=mock.Mock()).iter_journal_records(after_cursor="x' ; reboot"))
+
+
+class LogSearchApiTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with override_settings(LOG_INDEX={'PATH': f"{directory.name}/index.sqlite3", 'RETENTION_DAYS': 7,
+                                          'BATCH_SIZE': 2, 'PURGE_INTERVAL': 600}):
+            self.index = LogIndex()
+            self.index.ingest("web-1", "system", [
+                ("raw 1", "2024-01-01T12:00:00", "error", "nginx", "upstream timed out"),
+                ("raw 2", "2024-01-01T12:00:01", "info", "nginx", "upstream recovered"),
+                ("raw 3", "2024-01-01T12:00:02", "WARN", "cron", "job timed out"),
+            ])
+        patcher = mock.patch("monitor.views.log_index", self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_full_text_and_level(self):
+        response = self.client.get("/api/logs/search/", {"q": "timed out", "level": "warn"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([(row["message"], row["level"]) for row in response.json()["results"]],
+                         [("job timed out", "warning"), ("upstream timed out", "error")])
+
+    def test_unknown_level_is_bad_request(self):
+        response = self.client.get("/api/logs/search/", {"level": "loud"})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(response.json()["success"])
+
+
+@override_settings(LOG_STORAGE={'ENABLED': True, 'CHUNK_LINES': 50, 'OVERLAP_WINDOW': 100, 'COMPRESSION_LEVEL': 6})
+class LogStorageTests(TestCase):
+    @staticmethod
+    def poll(storage, lines, end, window=20):
+        """Опрос tail: окно последних window строк, перекрывающееся с прошлым опросом"""
+        return storage.append("nginx", '\n'.join(lines[max(0, end - window):end]), host="web-1")
+
+    def test_polls_append_to_open_snapshot_and_seal(self):
+        lines = [f"line {i}" for i in range(130)]
+        storage = LogStorage()
+        for end in range(10, 131, 10):
+            self.poll(storage, lines, end)
+
+        self.assertEqual(list(storage.iter_lines("nginx", host="web-1")), lines)
+        # Два закрытых блока по 50 строк и открытый снимок с остатком
+        self.assertEqual(LogChunk.objects.count(), 2)
+        self.assertEqual(list(ServiceLog.objects.order_by('id').values_list('is_open', 'lines_count')),
+                         [(False, 50), (False, 50), (True, 30)])
+
+    def test_append_moves_fetched_at(self):
+        storage = LogStorage()
+        storage.append("nginx", "first", host="web-1")
+        checkpoint = django_timezone.now()
+        storage.append("nginx", "second", host="web-1")
+        self.assertEqual(list(storage.iter_lines("nginx", host="web-1", since=checkpoint)), ["first", "second"])
+
+    def test_overlap_survives_restart(self):
+        lines = [f"line {i}" for i in range(60)]
+        LogStorage().append("nginx", '\n'.join(lines[:55]), host="web-1")
+        result = LogStorage().append("nginx", '\n'.join(lines[40:60]), host="web-1")
+        self.assertEqual(result["stored_lines"], 5)
+        self.assertEqual(list(LogStorage().iter_lines("nginx")), lines)
+
+    def test_identical_chunks_are_stored_once(self):
+        text = '\n'.join(f"same {i}" for i in range(50))
+        storage = LogStorage()
+        storage.append("a", text, host="web-1")
+        storage.append("b", text, host="web-2")
+        self.assertEqual(LogChunk.objects.count(), 1)
+        stats = storage.get_stats()
+        self.assertEqual(stats["snapshots"], 2)
+        self.assertEqual(stats["raw_bytes"], 2 * len(text))
+
+
+class TemplateMinerTests(SimpleTestCase):
+    def test_variable_tokens_become_wildcards(self):
+        miner = TemplateMiner()
+        for user in ("alice", "bob", "carol"):
+            miner.add(f"session opened for user {user} by uid 0", "Jan  1 12:00:00", "info")
+        miner.add("Accepted publickey for root from 10.0.0.1 port 2201", "Jan  1 12:00:05", "info")
+        miner.add("Accepted publickey for root from 10.0.0.2 port 2202", "Jan  1 12:00:09", "info")
+
+        templates = {t["template"]: t for t in miner.templates()}
+        self.assertEqual(set(templates), {"session opened for user <*> by uid <*>",
+                                          "Accepted publickey for root from <*> port <*>"})
+        sessions = templates["session opened for user <*> by uid <*>"]
+        self.assertEqual(sessions["count"], 3)
+        self.assertIn(["bob", "0"], sessions["examples"])
+        accepted = templates["Accepted publickey for root from <*> port <*>"]
+        self.assertEqual((accepted["first_seen"], accepted["last_seen"]), ("Jan  1 12:00:05", "Jan  1 12:00:09"))
+
+    def test_summary_puts_errors_first_and_fits_limit(self):
+        miner = TemplateMiner()
+        for i in range(50):
+            miner.add(f"request {i} served", level="info")
+        miner.add("disk full on /var", level="error")
+        for name in ("alpha", "beta", "gamma", "delta", "epsilon", "zeta", "theta", "kappa"):
+            miner.add(f"{name} service restarted by watchdog", level="debug")
+
+        summary = miner.summary_text(max_chars=200)
+        lines = summary.split('\n')
+        self.assertEqual(lines[0], f"Строк: 59, шаблонов: {len(miner.clusters)}")
+        self.assertTrue(lines[1].startswith("1x [error] disk full on /var"))
+        self.assertLessEqual(sum(len(line) + 1 for line in lines[:-1]), 200)
+        self.assertTrue(lines[-1].startswith("... еще шаблонов"))
+
+    def test_cluster_limit(self):
+        miner = TemplateMiner(max_clusters=2)
+        for word in ("alpha", "beta", "gamma", "delta", "epsilon"):
+            miner.add(f"{word} started")
+        # Сверх лимита строки без похожего шаблона попадают в один общий шаблон
+        self.assertEqual([(t["template"], t["count"]) for t in miner.templates()],
+                         [("<*>", 3), ("alpha started", 1), ("beta started", 1)])
+        self.assertEqual(miner.total_lines, 5)
+
+
+class LogFilterTests(SimpleTestCase):
+    LINES = "app: ERROR ошибка ДИСКА sda\napp: INFO ошибка диска\napp: WARN все хорошо\n"
+
+    def test_from_params(self):
+        log_filter = LogFilter.from_params({"level": "WARN", "q": " диск ", "since": "2h"})
+        self.assertEqual((log_filter.level, log_filter.query), ("warning", "диск"))
+        self.assertIsNotNone(log_filter.since)
+        with self.assertRaises(ValueError):
+            LogFilter.from_params({"since": "вчера"})
+
+    @skipUnless(shutil.which("awk") and shutil.which("grep"), "нужны awk и grep")
+    def test_remote_filter_folds_cyrillic_case(self):
+        command = LogFilter(level="warning", query="ОШИБКА диска").awk_command(with_time=False)
+        result = subprocess.run(["sh", "-c", command], input=self.LINES.encode(), capture_output=True, check=True)
+        self.assertEqual(result.stdout.decode(), "app: ERROR ошибка ДИСКА sda\n")
+        # Объем просмотренного ввода - для отчета pushdown
+        self.assertEqual(int(result.stderr), len(self.LINES.encode()))
+
+    @skipUnless(shutil.which("awk") and shutil.which("grep"), "нужны awk и grep")
+    def test_no_matches_is_not_an_error(self):
+        command = LogFilter(query="нет такого").awk_command(with_time=False)
+        result = subprocess.run(["sh", "-c", command], input=self.LINES.encode(), capture_output=True)
+        self.assertEqual((result.returncode, result.stdout), (0, b""))
+
+    def test_journal_query_runs_single_pass(self):
+        ssh = ScriptedSSH({"journalctl": ""})
+        facts = mock.Mock(**{"get.return_value": mock.Mock(journal=True)})
+        result = LogService(ssh, host_facts=facts).query_logs("system", 20, LogFilter(level="error", query="oom"))
+
+        self.assertTrue(result["success"])
+        self.assertEqual(len(ssh.commands), 1)
+        self.assertNotIn("wc -c", ssh.commands[0])
+        self.assertIn("-p 3", ssh.commands[0])
+        self.assertIsNone(result["pushdown"]["bytes_scanned"])
+
+
+class LogExportTests(SimpleTestCase):
+    def service(self, chunks, gzip_on_host):
+        ssh = mock.Mock(stream_command=mock.Mock(return_value=chunks))
+        facts = mock.Mock(**{"get.return_value": mock.Mock(journal=True, tools={"gzip": gzip_on_host})})
+        return LogService(ssh, host_facts=facts), ssh
+
+    def test_local_compression(self):
+        logs, ssh = self.service(iter([b"line 1\n", b"line 2\n"]), gzip_on_host=False)
+        data = b"".join(logs.iter_export("system", LogFilter(level="error")))
+        self.assertEqual(gzip.decompress(data), b"line 1\nline 2\n")
+        command = ssh.stream_command.call_args[0][0]
+        self.assertIn("journalctl", command)
+        self.assertNotIn("gzip -c", command)
+
+    def test_remote_failure_drops_gzip_trailer(self):
+        def chunks():
+            yield b"first"
+            yield b"trailer"
+            raise RuntimeError("код выхода 1")
+
+        logs, ssh = self.service(chunks(), gzip_on_host=True)
+        stream = logs.iter_export("system", LogFilter())
+        self.assertIn("gzip -c", ssh.stream_command.call_args[0][0])
+        self.assertEqual(next(stream), b"first")
+        with self.assertRaises(RuntimeError):
+            next(stream)
+
+    def test_missing_log_file_fails_before_streaming(self):
+        logs, ssh = self.service(iter(()), gzip_on_host=True)
+        logs.facts.get.return_value = mock.Mock(journal=False, syslog_path=None, auth_log_path=None,
+                                                tools={"gzip": True})
+        with self.assertRaises(RuntimeError):
+            logs.iter_export("system", LogFilter())
+        ssh.stream_command.assert_not_called()
+
+
+class HostFactsTests(SimpleTestCase):
+    PROBE_OUTPUT = ("tool:journalctl=1\ntool:gzip=0\ntool:ss=0\ntool:netstat=1\n"
+                    "file:/var/log/secure=1\nfile:/var/log/messages=1\njournal=1\nroot=0")
+
+    def test_probe_is_cached_per_connection(self):
+        ssh = ScriptedSSH({"command -v": self.PROBE_OUTPUT})
+        service = HostFactsService(ssh)
+        facts = service.get()
+        self.assertTrue(facts.journal)
+        self.assertFalse(facts.tools["gzip"])
+        self.assertEqual((facts.auth_log_path, facts.syslog_path, facts.network_tool),
+                         ("/var/log/secure", "/var/log/messages", "netstat"))
+
+        service.get()
+        self.assertEqual(len(ssh.commands), 1)
+        ssh.generation += 1
+        service.get()
+        self.assertEqual(len(ssh.commands), 2)
+
+    def test_failed_probe_is_retried(self):
+        ssh = ScriptedSSH({"command -v": {"success": False, "output": "", "error": "channel closed"}})
+        service = HostFactsService(ssh)
+        self.assertFalse(service.get().journal)
+        # До истечения короткой паузы повторной проверки нет
+        service.get()
+        self.assertEqual(len(ssh.commands), 1)
+
+        ssh.handlers["command -v"] = self.PROBE_OUTPUT
+        with mock.patch("monitor.services.host_facts.time.time", return_value=service._retry_at):
+            self.assertTrue(service.get().journal)
+        self.assertEqual(len(ssh.commands), 2)
+        service.get()
+        self.assertEqual(len(ssh.commands), 2)
+
+    def test_empty_probe_output_is_not_trusted(self):
+        ssh = ScriptedSSH({"command -v": ""})
+        service = HostFactsService(ssh)
+        service.get()
+        self.assertGreater(service._retry_at, 0)
+
+
+class SnapshotStoreTests(SimpleTestCase):
+    def make_store(self, loaders, ttls=None):
+        ssh = mock.Mock(generation=1)
+        return ssh, SnapshotStore(ssh, loaders, ttls or {})
+
+    def test_only_stale_sections_are_refreshed(self):
+        calls = {"cpu": 0, "disk": 0}
+
+        def loader(name):
+            def load():
+                calls[name] += 1
+                return {"value": calls[name]}
+            return load
+
+        _, store = self.make_store({"cpu": loader("cpu"), "disk": loader("disk")}, {"cpu": 5, "disk": 300})
+        self.assertEqual(store.get(), {"cpu": {"value": 1}, "disk": {"value": 1}})
+
+        store.sections["cpu"].updated_at -= 10
+        store.get()
+        self.assertEqual(calls, {"cpu": 2, "disk": 1})
+        # max_age строже TTL заставляет обновить и долгоживущий раздел
+        store.get(["disk"], max_age=0)
+        self.assertEqual(calls, {"cpu": 2, "disk": 2})
+
+    def test_version_grows_only_when_content_changes(self):
+        values = iter([["a"], ["a"], ["b"]])
+        _, store = self.make_store({"units": lambda: next(values)})
+        store.get()
+        first = store.describe()["units"]
+        store.get(max_age=0)
+        self.assertEqual(store.describe()["units"]["version"], first["version"])
+        store.get(max_age=0)
+        described = store.describe()["units"]
+        self.assertEqual(described["version"], first["version"] + 1)
+        self.assertNotEqual(described["digest"], first["digest"])
+
+    def test_loader_error_keeps_previous_data(self):
+        loader = mock.Mock(side_effect=[{"ok": 1}, RuntimeError("ssh down")])
+        _, store = self.make_store({"mem": loader})
+        store.get()
+        self.assertEqual(store.get(max_age=0), {"mem": {"ok": 1}})
+        self.assertEqual(store.describe()["mem"]["error"], "ssh down")
+
+    def test_reconnect_clears_sections(self):
+        loader = mock.Mock(side_effect=[{"host": "a"}, RuntimeError("not ready")])
+        ssh, store = self.make_store({"info": loader})
+        store.get()
+        ssh.generation = 2
+        # Данные прежнего подключения не возвращаются даже при ошибке обновления
+        self.assertEqual(store.get(), {})
+
+
+class StreamChatHistoryTests(TestCase):
+    def make_agent(self, deltas):
+        agent = AIAgent.__new__(AIAgent)
+        agent.memory = ConversationMemory()
+        agent.response_cache = mock.Mock(get=mock.Mock(return_value=None))
+        agent.ttft_samples, agent.total_samples = [], []
+        agent._tools_enabled = lambda: False
+        agent._collect_all_real_system_data = lambda: {}
+        agent._build_smart_prompt = lambda message, system_data, session_key: "prompt"
+        agent._stream_ai_response = lambda prompt, source: deltas()
+        return agent
+
+    def test_answer_is_recorded_with_question(self):
+        agent = self.make_agent(lambda: iter(["Диск ", "в порядке"]))
+        events = list(agent.stream_chat("Как диск?", "s1"))
+        self.assertEqual(events[-1]["type"], "done")
+        self.assertEqual([m["role"] for m in agent.memory.get_messages("s1")], ["user", "assistant"])
+
+    def test_failed_stream_rolls_back_question(self):
+        def deltas():
+            yield "Диск "
+            raise RuntimeError("stream reset")
+
+        agent = self.make_agent(deltas)
+        events = list(agent.stream_chat("Как диск?", "s1"))
+        self.assertEqual(events[-1]["type"], "error")
+        self.assertEqual(agent.memory.get_messages("s1"), [])
+        self.assertFalse(ConversationMessage.objects.exists())
+
+    def test_client_disconnect_rolls_back_question(self):
+        agent = self.make_agent(lambda: iter(["Диск ", "в порядке"]))
+        stream = agent.stream_chat("Как диск?", "s1")
+        self.assertEqual(next(stream)["type"], "delta")
+        stream.close()
+        self.assertEqual(agent.memory.get_messages("s1"), [])
+        self.assertFalse(ConversationMessage.objects.exists())
+
+
+class ChatCacheKeyTests(TestCase):
+    def test_key_is_built_from_history_before_question(self):
+        agent = AIAgent.__new__(AIAgent)
+        agent.memory = ConversationMemory()
+        agent.memory.append("s1", "user", "Что с nginx?")
+        agent.memory.append("s1", "assistant", "nginx работает")
+        seen = []
+        agent.response_cache = mock.Mock(
+            get=mock.Mock(return_value={"response": "Из кэша"}),
+            make_key=mock.Mock(side_effect=lambda *args, **kwargs: seen.append(
+                agent.memory.get_messages("s1")) or "key"))
+        agent._tools_enabled = lambda: False
+        agent._collect_all_real_system_data = lambda: {}
+
+        result = agent.chat_with_ai("а почему?", "s1")
+        self.assertTrue(result["cached"])
+        self.assertEqual([m["content"] for m in seen[0]], ["Что с nginx?", "nginx работает"])
+        self.assertEqual(len(agent.memory.get_messages("s1")), 4)
+
+
+class AnalysisJobEventsTests(TestCase):
+    def events(self, job):
+        jobs = {**settings.AI_JOBS, 'EVENTS_MAX_SECONDS': 0, 'EVENTS_POLL_INTERVAL': 0, 'EVENTS_RETRY_MS': 2000}
+        with override_settings(AI_JOBS=jobs):
+            response = self.client.get(f"/api/ai/jobs/{job.pk}/events/")
+            return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_active_job_stream_ends_with_retry(self):
+        job = AnalysisJob.objects.create(kind="system", query="нагрузка", dedupe_key="a", status="running")
+        body = self.events(job)
+        self.assertIn("event: progress", body)
+        self.assertTrue(body.endswith("retry: 2000\n\n"))
+
+    def test_finished_job_stream_ends_with_done(self):
+        job = AnalysisJob.objects.create(kind="system", query="нагрузка", dedupe_key="b", status="done")
+        body = self.events(job)
+        self.assertTrue(body.rstrip().split("\n")[-2].startswith("event: done"))
+        self.assertNotIn("retry:", body)
@@ -14,32 +14,49 @@ api_urlpatterns = [
     path('api/connect/simple/', views.connect_server_simple, name='connect-simple'),
     path('api/disconnect/', views.disconnect_server, name='disconnect'),
     path('api/status/', views.server_status, name='status'),
+    path('api/host/facts/', views.host_facts_view, name='host-facts'),
     path('api/logs/system/', views.get_system_logs, name='system-logs'),
     path('api/logs/docker/', views.get_docker_logs, name='docker-logs'),
     path('api/logs/auth/', views.get_auth_logs, name='auth-logs'),
     path('api/logs/kernel/', views.get_kernel_logs, name='kernel-logs'),
+    path('api/logs/search/', views.search_logs, name='logs-search'),
+    path('api/logs/templates/', views.log_templates, name='logs-templates'),
+    path('api/logs/timeline/', views.logs_timeline, name='logs-timeline'),
+    path('api/logs/export/', views.export_logs, name='logs-export'),
+    path('api/logs/archive/', views.log_archive, name='logs-archive'),
+    path('api/logs/archive/stats/', views.log_archive_stats, name='logs-archive-stats'),
     path('api/diagnostic/quick/', views.quick_diagnostic, name='quick-diagnostic'),
     path('api/diagnostic/resources/', views.system_resources, name='system-resources'),
     path('api/diagnostic/processes/', views.running_processes, name='running-processes'),
     path('api/diagnostic/services/', views.services_status, name='services-status'),
     path('api/diagnostic/network/', views.network_info, name='network-info'),
     path('api/docker/containers/', views.docker_containers, name='docker-containers'),
+    path('api/docker/containers/bulk/', views.docker_bulk_action, name='docker-bulk-action'),
     path('api/docker/containers/<str:container_id>/', views.docker_container_info, name='docker-container-info'),
     path('api/docker/containers/<str:container_id>/logs/', views.docker_container_logs, name='docker-container-logs'),
     path('api/docker/containers/<str:container_id>/stats/', views.docker_container_stats,
          name='docker-container-stats'),
     path('api/docker/containers/<str:container_id>/processes/', views.docker_container_processes,
          name='docker-container-processes'),
+    path('api/docker/containers/<str:container_id>/metrics/', views.docker_container_metrics,
+         name='docker-container-metrics'),
     path('api/docker/containers/<str:container_id>/<str:action>/', views.docker_container_action,
          name='docker-container-action'),
     path('api/docker/system/', views.docker_system_info, name='docker-system-info'),
+    path('api/docker/metrics/', views.docker_metrics, name='docker-metrics'),
     path('api/ai/analyze/', views.ai_analyze, name='ai-analyze'),
     path('api/ai/chat/', views.ai_chat_api, name='ai-chat-api'),
+    path('api/ai/chat/stream/', views.ai_chat_stream, name='ai-chat-stream'),
     path('api/ai/analyze/logs/', views.ai_analyze_logs, name='ai-analyze-logs'),
     path('api/ai/analyze/docker/', views.ai_analyze_docker, name='ai-analyze-docker'),
     path('api/ai/history/', views.ai_conversation_history, name='ai-history'),
     path('api/ai/clear-history/', views.ai_clear_history, name='ai-clear-history'),
+    path('api/ai/cache/', views.ai_response_cache, name='ai-response-cache'),
     path('api/ai/status/', views.ai_status, name='ai-status'),
+    path('api/ai/jobs/', views.ai_jobs, name='ai-jobs'),
+    path('api/ai/jobs/review/', views.ai_jobs_review, name='ai-jobs-review'),
+    path('api/ai/jobs/<int:job_id>/', views.ai_job_detail, name='ai-job-detail'),
+    path('api/ai/jobs/<int:job_id>/events/', views.ai_job_events, name='ai-job-events'),
     path('api/logs/docker/fixed/', views.get_docker_logs_fixed, name='docker-logs-fixed'),
     path('api/docker/containers/list/', views.get_docker_containers_list, name='docker-containers-list'),
 ]
@@ -0,0 +1,82 @@
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class TTLCache:
+    """Потокобезопасный кэш с временем жизни записей
+
+    Поддерживает фоновое обновление: устаревшее значение отдается сразу,
+    а новое загружается в отдельном потоке (stale-while-revalidate).
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+        self._refreshing = set()
+
+    def get(self, key: str, loader: Callable[[], Any], ttl: float, background: bool = False) -> Any:
+        """Получение значения из кэша, при необходимости через loader"""
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is not None:
+            stored_at, value = entry
+            if time.time() - stored_at < ttl:
+                return value
+            if background:
+                self._refresh_in_background(key, loader)
+                return value
+
+        return self._load(key, loader)
+
+    def peek(self, key: str, max_age: float = None) -> Optional[Any]:
+        """Значение без загрузки; None, если записи нет или она старше max_age"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if max_age is not None and time.time() - stored_at >= max_age:
+            return None
+        return value
+
+    def age(self, key: str) -> Optional[float]:
+        """Возраст записи в секундах"""
+        with self._lock:
+            entry = self._entries.get(key)
+        return time.time() - entry[0] if entry else None
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+
+    def invalidate(self, key: str = None):
+        """Удаление одной записи или всего кэша"""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def _load(self, key: str, loader: Callable[[], Any]) -> Any:
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def _refresh_in_background(self, key: str, loader: Callable[[], Any]):
+        with self._lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                self._load(key, loader)
+            except Exception as e:
+                print(f"⚠️ Ошибка фонового обновления кэша {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(key)
+
+        threading.Thread(target=refresh, daemon=True).start()
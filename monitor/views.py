@@ -2,10 +2,12 @@ from django.shortcuts import render, redirect
 from django.utils.html import escape
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
-from django.http import JsonResponse, HttpResponse
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 import json
+import shlex
+import time
 from django.http import JsonResponse
 
 from rest_framework.decorators import api_view
@@ -14,16 +16,32 @@ from rest_framework import status
 from django.conf import settings
 
 from .services.ssh_service import SSHService
-from .services.log_service import LogService
+from .services.host_facts import HostFactsService
+from .services.log_service import LogService, LogFilter, AUTH_FACILITIES, LOG_FIELDS
+from .services.log_index import LogIndex, parse_since
+from .services.log_storage import LogStorage
+from .services.log_templates import TemplateMiner
+from .services.log_excerpt import select_excerpt
+from .services.log_timeline import LogTimeline
+from .services.prompt_budget import PromptBudget
 from .services.diagnostic_service import DiagnosticService
 from .services.docker_service import DockerService
-from .services.ai_agent import AIAgent
+from .services.container_metrics import ContainerMetricsSampler
+from .services.ai_agent import AIAgent, DEFAULT_SESSION
+from .services.analysis_jobs import AnalysisJobService, serialize_job
+from .models import AnalysisJob
 
 ssh_service = SSHService()
-log_service = LogService(ssh_service)
-diagnostic_service = DiagnosticService(ssh_service)
+host_facts = HostFactsService(ssh_service)
+log_service = LogService(ssh_service, host_facts)
+diagnostic_service = DiagnosticService(ssh_service, host_facts)
 docker_service = DockerService(ssh_service)
-ai_agent = AIAgent(ssh_service, diagnostic_service, docker_service)
+container_metrics = ContainerMetricsSampler(ssh_service)
+log_index = LogIndex()
+log_storage = LogStorage()
+log_timeline = LogTimeline(log_service, docker_service)
+ai_agent = AIAgent(ssh_service, diagnostic_service, docker_service, log_service)
+analysis_jobs = AnalysisJobService(ai_agent, docker_service)
 
 
 def initialize_services():
@@ -45,6 +63,7 @@ def initialize_services():
 
         if success:
             print("✅ Автоподключение успешно")
+            container_metrics.start()
         else:
             print("❌ Автоподключение не удалось")
 
@@ -56,6 +75,72 @@ def initialize_services():
 initialize_services()
 
 
+def record_logs(source, logs=None, entries=None, log_type="system"):
+    """Передача полученных логов в поисковый индекс (в фоне) и, если включено, в архив"""
+    try:
+        if entries is not None:
+            records = [tuple(entry[field] for field in LOG_FIELDS) for entry in entries]
+        else:
+            records = log_service.parse_log_buffer(logs or "", log_type)
+        log_index.submit(ssh_service.host, source, records)
+
+        if settings.LOG_STORAGE['ENABLED'] and records:
+            log_storage.append(
+                source,
+                '\n'.join(record[0] for record in records),
+                host=ssh_service.host or '',
+                service_type='docker' if source.startswith('docker:') else 'system'
+            )
+    except Exception as e:
+        print(f"⚠️ Ошибка сохранения логов {source}: {e}")
+
+
+def fetch_logs_by_type(log_type, lines, service=None, container=None):
+    """Логи указанного типа (system, docker, auth, kernel) для анализа"""
+    if log_type == 'system':
+        result = log_service.get_system_logs(lines=lines, service=service)
+    elif log_type == 'docker':
+        result = log_service.get_docker_logs(container_name=container, lines=lines)
+    elif log_type == 'auth':
+        result = log_service.get_auth_logs(lines=lines)
+    elif log_type == 'kernel':
+        result = log_service.get_kernel_logs(lines=lines)
+    else:
+        return {}
+
+    if not result["success"]:
+        return {}
+    return {
+        "logs": result.get("logs", ""),
+        "source": result.get("source", ""),
+        "container": result.get("container", "")
+    }
+
+
+def filtered_logs_response(log_type, lines, log_filter, service=None, container=None, structured=True):
+    """Ответ API для логов с фильтрами, выполненными на удаленном хосте"""
+    result = log_service.query_logs(log_type, lines, log_filter, service=service, container=container)
+    if not result["success"]:
+        return Response({
+            "success": False,
+            "error": result["error"]
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    return Response({
+        "success": True,
+        "logs": result["entries"] if structured else result["logs"],
+        "lines": len(result["entries"]),
+        "total_entries": len(result["entries"]),
+        "source": result["source"],
+        "filters": {
+            "level": log_filter.level,
+            "q": log_filter.query,
+            "since": log_filter.since,
+            "until": log_filter.until
+        },
+        "pushdown": result["pushdown"]
+    })
+
 
 @api_view(['POST'])
 def connect_server(request):
@@ -192,29 +277,56 @@ def get_system_logs(request):
         lines = min(lines, 100)
 
         service = request.GET.get('service', '')
-        print(f"🔧 Получаем логи: lines={lines}, service={service}")
-
-        if service:
-            cmd = f"journalctl -u {service} -n {lines} --no-pager 2>/dev/null || echo 'Сервис {service} не найден'"
-        else:
-            cmd = f"tail -{lines} /var/log/syslog 2>/dev/null || echo 'Файл логов недоступен'"
+        cursor = request.GET.get('cursor', '')
+        print(f"🔧 Получаем логи: lines={lines}, service={service}, cursor={bool(cursor)}")
 
-        print(f"🔧 Выполняем команду: {cmd}")
+        try:
+            log_filter = LogFilter.from_params(request.GET)
+        except ValueError as e:
+            return Response({
+                "success": False,
+                "error": str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if log_filter:
+            # Фильтры выполняются на хосте: по SSH идут только подходящие строки
+            return filtered_logs_response('system', lines, log_filter, service=service or None,
+                                          structured=False)
+
+        # journald: с удаленного хоста читаются только новые записи после курсора
+        if host_facts.get().journal:
+            journal_result = log_service.tail_journal(unit=service or None, lines=lines, cursor=cursor or None)
+            if journal_result["success"]:
+                record_logs(service or "system", journal_result["logs"])
+                return Response({
+                    "success": True,
+                    "logs": journal_result["logs"],
+                    "lines": journal_result["lines"],
+                    "source": service if service else "system",
+                    "cursor": journal_result["cursor"],
+                    "incremental": bool(cursor)
+                })
+            if journal_result.get("invalid_cursor"):
+                return Response({
+                    "success": False,
+                    "error": journal_result["error"]
+                }, status=400)
 
-        result = ssh_service.execute_command(cmd)
-        print(f"🔧 Результат: success={result['success']}")
+        # Без journald - файл логов, найденный при проверке хоста
+        result = log_service.get_system_logs(lines=lines, service=service or None)
+        print(f"🔧 Результат: success={result['success']}, source={result['source']}")
 
         if result["success"]:
+            record_logs(service or "system", result["logs"])
             return Response({
                 "success": True,
-                "logs": result["output"],
+                "logs": result["logs"],
                 "lines": lines,
                 "source": service if service else "system"
             })
         else:
             return Response({
                 "success": False,
-                "error": result.get("error", "Неизвестная ошибка SSH")
+                "error": result.get("error") or "Неизвестная ошибка SSH"
             }, status=500)
 
     except Exception as e:
@@ -237,28 +349,28 @@ def get_docker_logs(request):
 
         print(f"🔧 Получение Docker логов: lines={lines}, container='{container_name}'")
 
+        try:
+            log_filter = LogFilter.from_params(request.GET)
+        except ValueError as e:
+            return Response({
+                "success": False,
+                "error": str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if log_filter:
+            # Фильтры выполняются на хосте: по SSH идут только подходящие строки
+            return filtered_logs_response('docker', lines, log_filter, container=container_name or None,
+                                          structured=False)
+
         if container_name:
             # Логи конкретного контейнера
-            cmd = f"docker logs {container_name} --tail {lines} 2>&1"
+            result = ssh_service.execute_command(f"docker logs {shlex.quote(container_name)} --tail {lines} 2>&1")
         else:
-            # Общие Docker логи - пробуем несколько источников
-            commands = [
-                f"journalctl -u docker -n {lines} --no-pager 2>&1",
-                f"sudo journalctl -u docker.service -n {lines} --no-pager 2>&1",
-                f"tail -n {lines} /var/log/docker.log 2>&1",
-                "docker system info 2>&1"  # Fallback команда
-            ]
-
-            # Используем первую успешную команду
-            cmd = commands[0]
-            for test_cmd in commands:
-                test_result = ssh_service.execute_command(test_cmd)
-                if test_result["success"] and test_result["output"].strip():
-                    if "No entries" not in test_result["output"] and "не видите сообщения" not in test_result["output"]:
-                        cmd = test_cmd
-                        break
-
-        result = ssh_service.execute_command(cmd)
+            # Логи демона из источника, найденного при проверке хоста
+            result = log_service.get_docker_daemon_logs(lines=lines)
+            if not result["success"]:
+                result = ssh_service.execute_command("docker system info 2>&1")
+            else:
+                result["output"] = result["logs"]
 
         if result["success"]:
             logs_output = result["output"].strip()
@@ -308,10 +420,36 @@ def get_auth_logs(request):
     try:
         lines = int(request.GET.get('lines', 30))
 
+        try:
+            log_filter = LogFilter.from_params(request.GET)
+        except ValueError as e:
+            return Response({
+                "success": False,
+                "error": str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if log_filter:
+            # Фильтры выполняются на хосте: по SSH идут только подходящие строки
+            return filtered_logs_response('auth', lines, log_filter)
+
+        # На хостах с journald берем готовые поля журнала вместо разбора текста
+        journal = {"success": False}
+        if host_facts.get().journal:
+            journal = log_service.get_journal_entries(lines=lines, facilities=AUTH_FACILITIES)
+        if journal["success"] and journal["entries"]:
+            record_logs("auth", entries=journal["entries"])
+            return Response({
+                "success": True,
+                "logs": journal["entries"],
+                "source": journal["source"],
+                "cursor": journal["cursor"],
+                "total_entries": len(journal["entries"])
+            })
+
         result = log_service.get_auth_logs(lines=lines)
 
         if result["success"]:
             parsed_logs = log_service.parse_log_entries(result["logs"], "auth")
+            record_logs("auth", entries=parsed_logs)
 
             return Response({
                 "success": True,
@@ -338,10 +476,35 @@ def get_kernel_logs(request):
     try:
         lines = int(request.GET.get('lines', 30))
 
+        try:
+            log_filter = LogFilter.from_params(request.GET)
+        except ValueError as e:
+            return Response({
+                "success": False,
+                "error": str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if log_filter:
+            # Фильтры выполняются на хосте: по SSH идут только подходящие строки
+            return filtered_logs_response('kernel', lines, log_filter)
+
+        journal = {"success": False}
+        if host_facts.get().journal:
+            journal = log_service.get_journal_entries(lines=lines, kernel=True)
+        if journal["success"] and journal["entries"]:
+            record_logs("kernel", entries=journal["entries"])
+            return Response({
+                "success": True,
+                "logs": journal["entries"],
+                "source": journal["source"],
+                "cursor": journal["cursor"],
+                "total_entries": len(journal["entries"])
+            })
+
         result = log_service.get_kernel_logs(lines=lines)
 
         if result["success"]:
             parsed_logs = log_service.parse_log_entries(result["logs"], "kernel")
+            record_logs("kernel", entries=parsed_logs)
 
             return Response({
                 "success": True,
@@ -362,6 +525,201 @@ def get_kernel_logs(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+def search_logs(request):
+    """Поиск по локальному индексу логов без обращения к удаленному хосту"""
+    try:
+        query = request.GET.get('q', '').strip()
+        since_param = request.GET.get('since', '')
+        since = parse_since(since_param)
+        if since_param and since is None:
+            return Response({
+                "success": False,
+                "error": "Некорректный параметр since (пример: 30m, 2h, 7d или ISO-дата)"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            limit = min(max(int(request.GET.get('limit', 100)), 1), 1000)
+        except ValueError:
+            limit = 100
+
+        try:
+            result = log_index.search(
+                query=query,
+                level=request.GET.get('level') or None,
+                since=since,
+                host=request.GET.get('host') or None,
+                source=request.GET.get('source') or None,
+                limit=limit
+            )
+        except ValueError as e:
+            return Response({
+                "success": False,
+                "error": str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "success": True,
+            "results": result["results"],
+            "total": len(result["results"]),
+            "took_ms": result["took_ms"]
+        })
+
+    except Exception as e:
+        return Response({
+            "success": False,
+            "error": f"Ошибка поиска по логам: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+def logs_timeline(request):
+    """Единая лента system, auth, kernel и docker логов, постранично от новых к старым"""
+    try:
+        if not ssh_service.connected:
+            return Response({
+                "success": False,
+                "error": "Сервер не подключен"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        sources = [s for s in request.GET.get('sources', '').split(',') if s.strip()] or None
+        containers = request.GET.get('containers')
+        containers = [c.strip() for c in containers.split(',') if c.strip()] if containers else None
+        try:
+            limit = max(int(request.GET.get('limit', settings.LOG_TIMELINE['PAGE_SIZE'])), 1)
+        except ValueError:
+            limit = settings.LOG_TIMELINE['PAGE_SIZE']
+
+        result = log_timeline.get_page(
+            sources=[s.strip() for s in sources] if sources else None,
+            containers=containers,
+            limit=limit,
+            cursor=request.GET.get('cursor') or None
+        )
+        if result.get("invalid_cursor"):
+            return Response({
+                "success": False,
+                "error": result["error"]
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(result)
+
+    except Exception as e:
+        return Response({
+            "success": False,
+            "error": f"Ошибка построения ленты логов: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+def export_logs(request):
+    """Выгрузка логов за период одним gzip-файлом (потоком, без буферизации)"""
+    if not ssh_service.connected:
+        return Response({
+            "success": False,
+            "error": "Сервер не подключен"
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    log_type = request.GET.get('type', 'system')
+    if log_type not in ('system', 'docker', 'auth', 'kernel'):
+        return Response({
+            "success": False,
+            "error": f"Неизвестный тип логов: {log_type}"
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    params = request.GET.copy()
+    if not params.get('since'):
+        params['since'] = settings.LOG_EXPORT['DEFAULT_SINCE']
+    try:
+        log_filter = LogFilter.from_params(params)
+    except ValueError as e:
+        return Response({
+            "success": False,
+            "error": str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    service = request.GET.get('service') or None
+    container = request.GET.get('container') or None
+    if log_type == 'docker' and container:
+        found, _ = docker_service.match_inventory([container])
+        if not found:
+            return Response({
+                "success": False,
+                "error": f"Контейнер {container} не найден"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        container = found[0]["name"]
+
+    # Команда собирается до ответа: ошибки источника возвращаются кодом 400, а не пустым архивом
+    try:
+        chunks = log_service.iter_export(log_type, log_filter, service=service, container=container)
+    except (RuntimeError, ValueError) as e:
+        return Response({
+            "success": False,
+            "error": str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    def stream():
+        try:
+            yield from chunks
+        except Exception as e:
+            # Заголовки уже отправлены - обрываем ответ без конца gzip, чтобы архив не выглядел целым
+            print(f"❌ Ошибка выгрузки логов {log_type}: {e}")
+            raise
+
+    name = container or service or log_type
+    filename = f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.log.gz".replace('/', '_')
+    response = StreamingHttpResponse(stream(), content_type='application/gzip')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@api_view(['GET'])
+def log_archive(request):
+    """Потоковое чтение сохраненного архива логов источника"""
+    source = request.GET.get('source', '')
+    if not source:
+        return Response({
+            "success": False,
+            "error": "Не указан источник (параметр source)"
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    host = request.GET.get('host')
+    lines = (line + '\n' for line in log_storage.iter_lines(source, host=host))
+    return StreamingHttpResponse(lines, content_type='text/plain; charset=utf-8')
+
+
+@api_view(['GET'])
+def log_archive_stats(request):
+    """Размер архива логов: исходный объем против сжатого"""
+    try:
+        return Response({
+            "success": True,
+            **log_storage.get_stats(host=request.GET.get('host'))
+        })
+    except Exception as e:
+        return Response({
+            "success": False,
+            "error": f"Ошибка получения статистики архива: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+def host_facts_view(request):
+    """Возможности подключенного хоста (утилиты, файлы логов, права)"""
+    if not ssh_service.connected:
+        return Response({
+            "success": False,
+            "error": "Сервер не подключен"
+        }, status=status.HTTP_400_BAD_REQUEST)
+
+    facts = host_facts.get(refresh=request.GET.get('refresh') == '1')
+    return Response({
+        "success": True,
+        "host": ssh_service.host,
+        "facts": facts.as_dict()
+    })
+
+
 @api_view(['GET'])
 def server_status(request):
     """Проверка статуса подключения"""
@@ -564,10 +922,30 @@ def docker_container_logs(request, container_id):
             }, status=status.HTTP_400_BAD_REQUEST)
 
         lines = int(request.GET.get('lines', 50))
+        cursor = request.GET.get('cursor', '')
+
+        # Инкрементальный режим: курсор из предыдущего ответа или явный запрос курсора
+        if cursor or request.GET.get('incremental', 'false').lower() == 'true':
+            logs_result = docker_service.get_container_logs_incremental(container_id, cursor=cursor, lines=lines)
+            if logs_result["success"]:
+                record_logs(f"docker:{container_id}", logs_result["logs"])
+                return Response({
+                    "success": True,
+                    "logs": logs_result["logs"],
+                    "container_id": container_id,
+                    "lines": logs_result["lines"],
+                    "cursor": logs_result["cursor"]
+                })
+            return Response({
+                "success": False,
+                "error": logs_result["error"]
+            }, status=status.HTTP_400_BAD_REQUEST if logs_result.get("invalid_cursor")
+                else status.HTTP_500_INTERNAL_SERVER_ERROR)
 
         logs_result = docker_service.get_container_logs(container_id, lines=lines)
 
         if logs_result["success"]:
+            record_logs(f"docker:{container_id}", logs_result["logs"])
             return Response({
                 "success": True,
                 "logs": logs_result["logs"],
@@ -629,6 +1007,126 @@ def docker_container_action(request, container_id, action):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['POST'])
+def docker_bulk_action(request):
+    """Параллельное действие над группой контейнеров (результаты потоком NDJSON)"""
+    try:
+        if not ssh_service.connected:
+            return Response({
+                "success": False,
+                "error": "Сервер не подключен"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        action = request.data.get('action', '')
+        containers = request.data.get('containers', [])
+        label = request.data.get('label', '')
+        project = request.data.get('project', '')
+
+        if action not in DockerService.VALID_ACTIONS:
+            return Response({
+                "success": False,
+                "error": f"Недопустимое действие: {action}. Допустимые: {', '.join(DockerService.VALID_ACTIONS)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        if isinstance(containers, str):
+            containers = [c.strip() for c in containers.split(',')]
+
+        try:
+            parallelism = int(request.data.get('parallelism', settings.DOCKER_BULK_PARALLELISM))
+        except (TypeError, ValueError):
+            parallelism = settings.DOCKER_BULK_PARALLELISM
+        parallelism = max(1, min(parallelism, 16))
+
+        targets = docker_service.resolve_containers(containers, label=label, project=project)
+        if not targets:
+            return Response({
+                "success": False,
+                "error": "Не выбрано ни одного контейнера"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        # Сверка с инвентарем - в сервисе: неизвестные контейнеры приходят строками с ошибкой
+        print(f"🔧 Групповое действие {action}: {len(targets)} контейнеров, параллельно {parallelism}")
+
+        def stream():
+            total = succeeded = 0
+            for result in docker_service.bulk_container_action(targets, action, parallelism=parallelism):
+                total += 1
+                succeeded += 1 if result.get("success") else 0
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+            yield json.dumps({
+                "done": True,
+                "total": total,
+                "succeeded": succeeded,
+                "failed": total - succeeded
+            }, ensure_ascii=False) + "\n"
+
+        return StreamingHttpResponse(stream(), content_type='application/x-ndjson')
+
+    except Exception as e:
+        return Response({
+            "success": False,
+            "error": f"Ошибка группового действия: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+def docker_metrics(request):
+    """Метрики и признаки проблем по всем контейнерам из накопленной истории"""
+    try:
+        if not ssh_service.connected:
+            return Response({
+                "success": False,
+                "error": "Сервер не подключен"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        container_metrics.start()
+        container_metrics.sample_if_stale()
+        containers = container_metrics.get_summary()
+
+        return Response({
+            "success": True,
+            "containers": containers,
+            "problems": [c for c in containers if c["flags"]],
+            "sampled_at": container_metrics.last_sample_at
+        })
+
+    except Exception as e:
+        return Response({
+            "success": False,
+            "error": f"Ошибка получения метрик: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET'])
+def docker_container_metrics(request, container_id):
+    """История метрик и перезапусков контейнера"""
+    try:
+        last = int(request.GET.get('last')) if request.GET.get('last') else None
+        history = container_metrics.get_history(container_id, last=last)
+        if history is None and ssh_service.connected:
+            # История хранится по имени; ID и префикс ID разрешаются через инвентарь
+            found, _ = docker_service.match_inventory([container_id])
+            if found:
+                history = container_metrics.get_history(found[0]["name"], last=last)
+
+        if history is None:
+            return Response({
+                "success": False,
+                "error": f"Нет истории для контейнера {container_id}"
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        return Response({
+            "success": True,
+            "container": history
+        })
+
+    except Exception as e:
+        return Response({
+            "success": False,
+            "error": f"Ошибка получения метрик: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @api_view(['GET'])
 def docker_system_info(request):
     """Получение информации о Docker системе"""
@@ -714,6 +1212,16 @@ def ai_analyze(request):
 
         print(f"🤖 Запрос на ИИ анализ: {user_query}")
 
+        # Долгий анализ можно поставить в очередь и опрашивать /api/ai/jobs/<id>/
+        background = request.GET.get('background') or request.POST.get('background')
+        if background in ('1', 'true'):
+            job, created = analysis_jobs.submit("system", user_query)
+            return JsonResponse({
+                "success": True,
+                "job": serialize_job(job, include_result=False),
+                "deduplicated": not created
+            }, status=202)
+
         # Выполняем анализ
         analysis_result = ai_agent.analyze_system_state(user_query)
 
@@ -759,7 +1267,7 @@ def ai_chat(request):
 
         print(f"💬 Чат с ИИ: {message}")
 
-        chat_result = ai_agent.chat_with_ai(message)
+        chat_result = ai_agent.chat_with_ai(message, chat_session_key(request))
 
         return Response(chat_result)
 
@@ -770,6 +1278,48 @@ def ai_chat(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET'])
+def log_templates(request):
+    """Сводка логов по шаблонам: число строк, уровни, время и примеры переменных"""
+    try:
+        if not ssh_service.connected:
+            return Response({
+                "success": False,
+                "error": "Сервер не подключен"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        log_type = request.GET.get('type', 'system')
+        lines = int(request.GET.get('lines', 1000))
+        logs_data = fetch_logs_by_type(log_type, lines, service=request.GET.get('service'),
+                                       container=request.GET.get('container'))
+        if not logs_data.get("logs"):
+            return Response({
+                "success": False,
+                "error": "Не удалось получить логи"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        started = time.time()
+        miner = TemplateMiner().add_records(log_service.parse_log_buffer(logs_data["logs"], log_type))
+        limit = request.GET.get('limit')
+
+        return Response({
+            "success": True,
+            "type": log_type,
+            "source": logs_data.get("source", ""),
+            "container": logs_data.get("container", ""),
+            "total_lines": miner.total_lines,
+            "total_templates": len(miner.clusters),
+            "templates": miner.templates(int(limit) if limit else None),
+            "took_ms": round((time.time() - started) * 1000, 2)
+        })
+
+    except Exception as e:
+        return Response({
+            "success": False,
+            "error": f"Ошибка построения шаблонов логов: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @api_view(['GET'])
 def ai_analyze_logs(request):
     """Анализ конкретных логов с помощью ИИ"""
@@ -784,37 +1334,8 @@ def ai_analyze_logs(request):
         lines = int(request.GET.get('lines', 50))
         service_name = request.GET.get('service')
 
-        # Получаем логи
-        logs_data = {}
-        if log_type == 'system':
-            logs_result = log_service.get_system_logs(lines=lines, service=service_name)
-            if logs_result["success"]:
-                logs_data = {
-                    "logs": logs_result.get("logs", ""),
-                    "source": logs_result.get("source", "")
-                }
-        elif log_type == 'docker':
-            container_name = request.GET.get('container')
-            logs_result = log_service.get_docker_logs(container_name=container_name, lines=lines)
-            if logs_result["success"]:
-                logs_data = {
-                    "logs": logs_result.get("logs", ""),
-                    "container": logs_result.get("container", "")
-                }
-        elif log_type == 'auth':
-            logs_result = log_service.get_auth_logs(lines=lines)
-            if logs_result["success"]:
-                logs_data = {
-                    "logs": logs_result.get("logs", ""),
-                    "source": logs_result.get("source", "")
-                }
-        elif log_type == 'kernel':
-            logs_result = log_service.get_kernel_logs(lines=lines)
-            if logs_result["success"]:
-                logs_data = {
-                    "logs": logs_result.get("logs", ""),
-                    "source": logs_result.get("source", "")
-                }
+        logs_data = fetch_logs_by_type(log_type, lines, service=service_name,
+                                       container=request.GET.get('container'))
 
         if not logs_data.get("logs"):
             return Response({
@@ -822,14 +1343,36 @@ def ai_analyze_logs(request):
                 "error": "Не удалось получить логи для анализа"
             }, status=status.HTTP_400_BAD_REQUEST)
 
-        # Анализируем логи через ИИ
-        query = f"Проанализируй эти {log_type} логи и выяви проблемы:\n\n{logs_data['logs'][:3000]}"
-        analysis_result = ai_agent.analyze_system_state(query)
+        user_query = request.GET.get('query', '')
+        analysis_tokens = settings.AI_PROMPT_BUDGET['ANALYSIS_TOKENS']
+
+        # Вместо обрезки начала логов передаем ИИ сводку по шаблонам всех строк
+        # и самые полезные строки (ошибки, редкие, свежие, по словам вопроса)
+        miner = TemplateMiner()
+        excerpt = select_excerpt(log_service.parse_log_buffer(logs_data["logs"], log_type), query=user_query,
+                                 max_tokens=min(settings.LOG_EXCERPT['TOKENS'], analysis_tokens // 2), miner=miner)
+        task = (f"Проанализируй эти {log_type} логи и выяви проблемы. "
+                f"Строки сгруппированы в шаблоны (<*> - переменная часть), "
+                f"указано число повторений, уровень и интервал времени. "
+                f"После сводки - отобранные строки лога (ошибки, редкие и свежие):")
+        if user_query:
+            task = f"Вопрос: {user_query}\n{task}"
+        query, prompt_report = (PromptBudget(analysis_tokens)
+                                .add("task", task, required=True)
+                                .add("templates", miner.summary_text(), priority=20)
+                                .add("excerpt", excerpt["text"], priority=10)
+                                .compile())
+        # Логи уже в запросе; конвейер добавляет только контекст ресурсов и сервисов
+        analysis_result = ai_agent.analyze_system_state(query, sources=("resources", "services"))
+        analysis_result["query_prompt"] = prompt_report
 
         # Добавляем информацию о логах в ответ
         analysis_result["log_info"] = {
             "type": log_type,
-            "lines_analyzed": lines,
+            "lines_analyzed": miner.total_lines,
+            "templates": len(miner.clusters),
+            "excerpt_lines": excerpt["selected"],
+            "excerpt_tokens": excerpt["tokens"],
             "source": logs_data.get("source", ""),
             "container": logs_data.get("container", "")
         }
@@ -843,6 +1386,36 @@ def ai_analyze_logs(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def build_docker_analysis_query(container_id, docker_data):
+    """Запрос на анализ Docker в пределах бюджета: сначала состояние, затем статистика и свежие логи"""
+    budget = PromptBudget(settings.AI_PROMPT_BUDGET['ANALYSIS_TOKENS'])
+    if container_id:
+        budget.add("task", f"Проанализируй состояние Docker контейнера {container_id}:", required=True)
+        container = docker_data.get("container", {})
+        budget.add("container", compact_json(container), priority=10,
+                   compressor=lambda text: compact_json({key: value for key, value in container.items()
+                                                         if key not in ("env_variables", "mounts")}))
+        budget.add("stats", compact_json(docker_data.get("stats", {})), priority=20)
+        # Из логов важнее всего последние строки
+        budget.add("logs", docker_data.get("logs", ""), priority=30, keep="tail")
+    else:
+        budget.add("task", "Проанализируй общее состояние Docker системы:", required=True)
+        containers = docker_data.get("containers", [])
+        budget.add("containers", "\n".join(
+            f"{c.get('name', 'N/A')} | {c.get('image', '')} | {c.get('status', '')}" for c in containers
+        ), priority=10, compressor=lambda text: "\n".join([
+            "Запущены: " + ", ".join(c.get('name', 'N/A') for c in containers if c.get("is_running")),
+            "Остановлены: " + ", ".join(f"{c.get('name', 'N/A')} ({c.get('status', '')})"
+                                        for c in containers if not c.get("is_running"))
+        ]))
+        budget.add("system_info", compact_json(docker_data.get("system_info", {})), priority=20)
+    return budget.compile()
+
+
+def compact_json(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
 @api_view(['GET'])
 def ai_analyze_docker(request):
     """Анализ Docker состояния с помощью ИИ"""
@@ -875,13 +1448,11 @@ def ai_analyze_docker(request):
                 "system_info": system_info
             }
 
-        # Анализируем через ИИ
-        if container_id:
-            query = f"Проанализируй состояние Docker контейнера {container_id}:\n\n{str(docker_data)[:2000]}"
-        else:
-            query = f"Проанализируй общее состояние Docker системы:\n\n{str(docker_data)[:2000]}"
+        # Анализируем через ИИ: данные укладываются в бюджет токенов по важности
+        query, prompt_report = build_docker_analysis_query(container_id, docker_data)
 
-        analysis_result = ai_agent.analyze_system_state(query)
+        analysis_result = ai_agent.analyze_system_state(query, sources=("resources",))
+        analysis_result["query_prompt"] = prompt_report
         analysis_result["docker_info"] = {
             "container_id": container_id,
             "containers_total": len(docker_data.get("containers", [])),
@@ -901,7 +1472,7 @@ def ai_analyze_docker(request):
 def ai_conversation_history(request):
     """Получение истории разговора с ИИ"""
     try:
-        history = ai_agent.get_conversation_history()
+        history = ai_agent.get_conversation_history(chat_session_key(request))
         return Response({
             "success": True,
             "history": history,
@@ -919,7 +1490,7 @@ def ai_conversation_history(request):
 def ai_clear_history(request):
     """Очистка истории разговора с ИИ"""
     try:
-        ai_agent.clear_conversation_history()
+        ai_agent.clear_conversation_history(chat_session_key(request))
         return Response({
             "success": True,
             "message": "История разговора очищена"
@@ -932,15 +1503,193 @@ def ai_clear_history(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@api_view(['GET', 'DELETE'])
+def ai_response_cache(request):
+    """Статистика кэша ответов ИИ (GET) и его очистка (DELETE)"""
+    try:
+        if request.method == 'DELETE':
+            cleared = ai_agent.response_cache.clear()
+            return Response({
+                "success": True,
+                "cleared": cleared,
+                "message": "Кэш ответов ИИ очищен"
+            })
+
+        return Response({
+            "success": True,
+            **ai_agent.response_cache.stats()
+        })
+
+    except Exception as e:
+        return Response({
+            "success": False,
+            "error": f"Ошибка кэша ответов ИИ: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET', 'POST'])
+def ai_jobs(request):
+    """Фоновые анализы ИИ: список (GET) и постановка в очередь (POST)
+
+    POST: kind (system, logs, container), query, container, priority
+    (high, normal, low или 0-9). Такая же задача в работе не дублируется.
+    """
+    try:
+        if request.method == 'POST':
+            if not ssh_service.connected:
+                return Response({
+                    "success": False,
+                    "error": "Сервер не подключен"
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            params = {}
+            if request.data.get('container'):
+                params["container"] = request.data.get('container')
+            try:
+                job, created = analysis_jobs.submit(
+                    request.data.get('kind', 'system'),
+                    request.data.get('query', ''),
+                    params=params,
+                    priority=request.data.get('priority')
+                )
+            except ValueError as e:
+                return Response({
+                    "success": False,
+                    "error": str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+
+            return Response({
+                "success": True,
+                "job": serialize_job(job, include_result=False),
+                "deduplicated": not created
+            }, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+        jobs = AnalysisJob.objects.all()
+        if request.GET.get('status'):
+            jobs = jobs.filter(status=request.GET['status'])
+        if request.GET.get('batch'):
+            jobs = jobs.filter(batch=request.GET['batch'])
+        limit = int(request.GET.get('limit', 50))
+
+        return Response({
+            "success": True,
+            "jobs": [serialize_job(job, include_result=False) for job in jobs[:limit]],
+            "batch": analysis_jobs.batch_summary(request.GET['batch']) if request.GET.get('batch') else None,
+            "stats": analysis_jobs.stats()
+        })
+
+    except Exception as e:
+        return Response({
+            "success": False,
+            "error": f"Ошибка фоновых анализов: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@api_view(['GET', 'DELETE'])
+def ai_job_detail(request, job_id):
+    """Прогресс и результат фонового анализа (GET), отмена задачи в очереди (DELETE)"""
+    try:
+        job = AnalysisJob.objects.filter(pk=job_id).first()
+        if job is None:
+            return Response({
+                "success": False,
+                "error": f"Задача {job_id} не найдена"
+            }, status=status.HTTP_404_NOT_FOUND)
+
+        if request.method == 'DELETE':
+            if not analysis_jobs.cancel(job_id):
+                return Response({
+                    "success": False,
+                    "error": "Отменить можно только задачу, которая еще в очереди"
+                }, status=status.HTTP_409_CONFLICT)
+            job.refresh_from_db()
+
+        return Response({
+            "success": True,
+            "job": serialize_job(job)
+        })
+
+    except Exception as e:
+        return Response({
+            "success": False,
+            "error": f"Ошибка фонового анализа: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@require_http_methods(["GET"])
+def ai_job_events(request, job_id):
+    """Прогресс фонового анализа потоком SSE: progress при каждом изменении, в конце done
+
+    Поток длится не дольше EVENTS_MAX_SECONDS и, если задача еще идет,
+    завершается полем retry: EventSource сам переподключится и получит
+    текущее состояние, а воркер не занят на все время анализа. После done
+    клиент закрывает EventSource.
+    """
+    if not AnalysisJob.objects.filter(pk=job_id).exists():
+        return JsonResponse({
+            "success": False,
+            "error": f"Задача {job_id} не найдена"
+        }, status=404)
+
+    def stream():
+        yield ": stream open\n\n"
+        last = None
+        deadline = time.time() + settings.AI_JOBS['EVENTS_MAX_SECONDS']
+        while True:
+            job = AnalysisJob.objects.get(pk=job_id)
+            state = (job.status, job.stage, job.progress)
+            if state != last:
+                last = state
+                if job.status in AnalysisJob.ACTIVE_STATUSES:
+                    yield sse_event("progress", serialize_job(job, include_result=False))
+                else:
+                    yield sse_event("done", serialize_job(job))
+                    return
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(settings.AI_JOBS['EVENTS_POLL_INTERVAL'], remaining))
+        # Зависшую задачу переводит в failed сама очередь (TIMEOUT), клиент увидит это после переподключения
+        yield f"retry: {settings.AI_JOBS['EVENTS_RETRY_MS']}\n\n"
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@api_view(['POST'])
+def ai_jobs_review(request):
+    """Внеплановый пакетный обзор всех контейнеров (тот же, что ночной)"""
+    try:
+        if not ssh_service.connected:
+            return Response({
+                "success": False,
+                "error": "Сервер не подключен"
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            "success": True,
+            **analysis_jobs.review_containers(priority=request.data.get('priority'))
+        }, status=status.HTTP_202_ACCEPTED)
+
+    except Exception as e:
+        return Response({
+            "success": False,
+            "error": f"Ошибка обзора контейнеров: {str(e)}"
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
 @api_view(['GET'])
 def ai_status(request):
     """Проверка статуса ИИ агента"""
     try:
-        status_info = ai_agent.get_status()
+        status_info = ai_agent.get_status(chat_session_key(request))
 
         return Response({
             "success": True,
-            **status_info
+            **status_info,
+            "jobs": analysis_jobs.stats()
         })
 
     except Exception as e:
@@ -985,6 +1734,22 @@ def ai_chat(request):
         return ai_chat_api(request)
 
 
+def chat_session_key(request):
+    """Ключ разговора с ИИ: явный session_id (API клиенты) или сессия Django браузера"""
+    explicit = (request.GET.get('session_id') or request.POST.get('session_id')
+                or request.headers.get('X-Chat-Session'))
+    if explicit:
+        return f"api:{explicit[:56]}"
+    try:
+        if not request.session.session_key:
+            request.session.save()
+        return request.session.session_key
+    except Exception as e:
+        # Без таблицы сессий все браузеры делят общий разговор
+        print(f"⚠️ Сессия недоступна, общий разговор: {e}")
+        return DEFAULT_SESSION
+
+
 def format_ai_response(text):
     """Форматирует ответ ИИ для HTML отображения"""
     if not text:
@@ -1006,6 +1771,91 @@ def format_ai_response(text):
     return ''.join(formatted_paragraphs)
 
 
+def render_suggested_commands(suggested_commands):
+    """HTML блока предложенных команд под ответом ИИ"""
+    if not suggested_commands:
+        return ""
+
+    html = """
+                    <div class="mt-3 pt-3 border-t border-gray-200">
+                        <p class="font-semibold text-sm text-gray-700 mb-2">💡 Предложенные команды:</p>
+                        <div class="space-y-1">
+                """
+    for cmd in suggested_commands[:3]:
+        escaped_cmd = escape(cmd)
+        html += f'''
+                            <div class="flex items-center space-x-2">
+                                <code class="bg-gray-800 text-green-400 px-2 py-1 rounded text-xs font-mono flex-1 overflow-x-auto">
+                                    {escaped_cmd}
+                                </code>
+                                <button onclick="copyToClipboard(\"{escaped_cmd}\")" 
+                                        class="bg-gray-600 text-white px-2 py-1 rounded text-xs hover:bg-gray-700 transition-colors">
+                                    📋
+                                </button>
+                            </div>
+                    '''
+    html += """
+                        </div>
+                    </div>
+                """
+    return html
+
+
+def sse_event(event, data):
+    """Одно событие Server-Sent Events с JSON данными"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@require_http_methods(["POST"])
+@csrf_exempt
+def ai_chat_stream(request):
+    """Чат с ИИ агентом потоком SSE: части ответа по мере генерации, команды в конце
+
+    События: delta (текст очередной части), done (полный ответ в HTML,
+    предложенные команды и время до первого токена) или error.
+    """
+    message = request.POST.get('message', '').strip()
+    if not message:
+        return JsonResponse({
+            "success": False,
+            "error": "Сообщение не может быть пустым"
+        }, status=400)
+
+    if not ssh_service.connected:
+        return JsonResponse({
+            "success": False,
+            "error": "Основной сервер не подключен. Сначала подключитесь к серверу."
+        }, status=503)
+
+    print(f"💬 Чат с ИИ (стриминг): {message}")
+    # Ключ сессии берется до начала потока: cookie сессии должна уйти в заголовках
+    session_key = chat_session_key(request)
+
+    def stream():
+        # Первое событие уходит сразу: прокси и браузер открывают поток до сбора данных
+        yield ": stream open\n\n"
+        for event in ai_agent.stream_chat(message, session_key):
+            if event["type"] == "delta":
+                yield sse_event("delta", {"text": event["text"]})
+            elif event["type"] == "done":
+                yield sse_event("done", {
+                    "response": event["response"],
+                    "html": format_ai_response(event["response"]),
+                    "commands_html": render_suggested_commands(event["suggested_commands"]),
+                    "suggested_commands": event["suggested_commands"],
+                    "ttft_ms": event["ttft_ms"],
+                    "total_ms": event["total_ms"]
+                })
+            else:
+                yield sse_event("error", {"error": event["error"]})
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream; charset=utf-8')
+    response['Cache-Control'] = 'no-cache'
+    # nginx не должен буферизовать поток
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
 @require_http_methods(["POST"])
 @csrf_exempt
 def ai_chat_api(request):
@@ -1041,7 +1891,7 @@ def ai_chat_api(request):
         """
 
         # Получаем ответ от ИИ
-        chat_result = ai_agent.chat_with_ai(message)
+        chat_result = ai_agent.chat_with_ai(message, chat_session_key(request))
 
         # ВАЖНО: Проверяем что chat_result - словарь
         if not isinstance(chat_result, dict):
@@ -1071,29 +1921,7 @@ def ai_chat_api(request):
                         {formatted_response}
             """
 
-            if suggested_commands:
-                ai_html += """
-                    <div class="mt-3 pt-3 border-t border-gray-200">
-                        <p class="font-semibold text-sm text-gray-700 mb-2">💡 Предложенные команды:</p>
-                        <div class="space-y-1">
-                """
-                for cmd in suggested_commands[:3]:
-                    escaped_cmd = escape(cmd)
-                    ai_html += f'''
-                            <div class="flex items-center space-x-2">
-                                <code class="bg-gray-800 text-green-400 px-2 py-1 rounded text-xs font-mono flex-1 overflow-x-auto">
-                                    {escaped_cmd}
-                                </code>
-                                <button onclick="copyToClipboard(\"{escaped_cmd}\")" 
-                                        class="bg-gray-600 text-white px-2 py-1 rounded text-xs hover:bg-gray-700 transition-colors">
-                                    📋
-                                </button>
-                            </div>
-                    '''
-                ai_html += """
-                        </div>
-                    </div>
-                """
+            ai_html += render_suggested_commands(suggested_commands)
 
             ai_html += """
                     </div>
@@ -1238,29 +2066,34 @@ def get_docker_logs_fixed(request):
         lines = int(request.GET.get('lines', 20))
         container_name = request.GET.get('container', '')
 
+        containers = [c for c in request.GET.get('containers', '').split(',') if c]
+
         print(f"🔧 Получение Docker логов: lines={lines}, container={container_name}")
 
+        if not container_name:
+            # Объединенные по времени логи выбранных (или всех запущенных) контейнеров
+            merged = docker_service.get_merged_logs(containers or None, lines=lines)
+            if merged["entries"]:
+                return Response({
+                    "success": True,
+                    "logs": merged["logs"],
+                    "entries": merged["entries"],
+                    "lines": len(merged["entries"]),
+                    "container": "all",
+                    "containers": merged["containers"],
+                    "errors": merged["errors"]
+                })
+
         if container_name:
             # Логи конкретного контейнера
-            cmd = f"docker logs {container_name} --tail {lines} 2>&1"
+            result = ssh_service.execute_command(f"docker logs {shlex.quote(container_name)} --tail {lines} 2>&1")
         else:
-            # Пробуем разные источники Docker логов
-            commands = [
-                f"docker logs --tail {lines} $(docker ps -q) 2>&1 | head -{lines}",
-                f"journalctl -u docker.service -n {lines} --no-pager 2>&1",
-                f"tail -{lines} /var/log/docker.log 2>&1",
-                "echo 'Docker logs not available in standard locations'"
-            ]
-
-            # Пробуем команды по очереди пока не получим результат
-            result = {"success": False, "error": "No logs available"}
-            for cmd in commands:
-                temp_result = ssh_service.execute_command(cmd)
-                if temp_result["success"] and temp_result["output"].strip():
-                    result = temp_result
-                    break
-
-        result = ssh_service.execute_command(cmd)
+            # Логи демона из источника, найденного при проверке хоста
+            result = log_service.get_docker_daemon_logs(lines=lines)
+            result["output"] = result["logs"]
+            if not result["success"]:
+                # Пустой вывод ниже заменяется списком контейнеров
+                result = {"success": True, "output": ""}
 
         if result["success"]:
             logs_output = result["output"].strip()
@@ -1334,7 +2167,16 @@ def pretty_logs(request):
             result = log_service.get_system_logs(lines=lines)
         elif log_type == 'docker':
             # Используем исправленный метод для Docker логов
-            if container_name:
+            if container_name == '*':
+                # Объединенные по времени логи всех запущенных контейнеров
+                merged = docker_service.get_merged_logs(lines=lines)
+                result = {
+                    "success": merged["success"],
+                    "logs": merged["logs"] or "📝 Запущенные контейнеры не писали в лог",
+                    "error": "; ".join(f"{name}: {error}" for name, error in merged["errors"].items()),
+                    "source": "merged"
+                }
+            elif container_name:
                 # Логи конкретного контейнера
                 cmd = f"docker logs {container_name} --tail {lines} 2>&1"
                 container_result = ssh_service.execute_command(cmd)
@@ -1350,26 +2192,11 @@ def pretty_logs(request):
                         "error": f"Не удалось получить логи контейнера {container_name}"
                     }
             else:
-                # Общие Docker логи - пробуем несколько источников
-                commands = [
-                    f"journalctl -u docker -n {lines} --no-pager 2>&1",
-                    f"sudo journalctl -u docker.service -n {lines} --no-pager 2>&1",
-                    f"docker logs --tail {lines} $(docker ps -q) 2>&1 | head -{lines}",
-                    f"tail -n {lines} /var/log/docker.log 2>&1",
-                ]
-
+                # Логи демона из источника, найденного при проверке хоста
                 result = {"success": False, "error": "Не удалось получить Docker логи"}
-                for cmd in commands:
-                    temp_result = ssh_service.execute_command(cmd)
-                    if temp_result["success"] and temp_result["output"].strip():
-                        if "No entries" not in temp_result["output"] and "не видите сообщения" not in temp_result[
-                            "output"]:
-                            result = {
-                                "success": True,
-                                "logs": temp_result["output"],
-                                "source": cmd.split()[0] if ' ' in cmd else cmd
-                            }
-                            break
+                daemon_result = log_service.get_docker_daemon_logs(lines=lines)
+                if daemon_result["success"] and daemon_result["logs"].strip():
+                    result = daemon_result
 
                 # Если все команды вернули пустой результат, показываем информацию о контейнерах
                 if not result["success"]:
@@ -1452,7 +2279,7 @@ def pretty_services(request):
 def pretty_ai_status(request):
     """Красивая страница статуса AI агента"""
     try:
-        status_info = ai_agent.get_status()
+        status_info = ai_agent.get_status(chat_session_key(request))
 
         context = {
             'status': status_info,
@@ -1471,7 +2298,7 @@ def pretty_ai_status(request):
 def pretty_ai_history(request):
     """Красивая страница истории разговоров с AI"""
     try:
-        history = ai_agent.get_conversation_history()
+        history = ai_agent.get_conversation_history(chat_session_key(request))
 
         context = {
             'history': history,
@@ -1513,12 +2340,8 @@ def pretty_ai_analyze_docker(request):
             }
 
         # Анализируем через ИИ
-        if container_id:
-            query = f"Проанализируй состояние Docker контейнера {container_id}"
-        else:
-            query = "Проанализируй общее состояние Docker системы"
-
-        analysis_result = ai_agent.analyze_system_state(query)
+        query, _ = build_docker_analysis_query(container_id, docker_data)
+        analysis_result = ai_agent.analyze_system_state(query, sources=("resources",))
 
         context = {
             'analysis': analysis_result,
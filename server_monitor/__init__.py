@@ -0,0 +1,7 @@
+# Celery необязателен: без него фоновые анализы ИИ выполняются потоками процесса
+try:
+    from .celery import app as celery_app
+except ImportError:
+    celery_app = None
+
+__all__ = ('celery_app',)
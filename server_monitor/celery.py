@@ -0,0 +1,19 @@
+import os
+from celery import Celery
+from celery.schedules import crontab
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'server_monitor.settings')
+
+app = Celery('server_monitor')
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
+
+from django.conf import settings  # noqa: E402
+
+# Пакетные анализы вне пути запроса: запуск через celery -A server_monitor beat
+app.conf.beat_schedule = {
+    'nightly-container-review': {
+        'task': 'monitor.tasks.nightly_container_review',
+        'schedule': crontab(hour=settings.AI_JOBS['REVIEW_HOUR'], minute=settings.AI_JOBS['REVIEW_MINUTE']),
+    },
+}
@@ -99,8 +99,226 @@ AI_SSH_CONFIG = {
     'PASSWORD': os.getenv('AI_SSH_PASSWORD', ''),
 }
 
+# Размер окна последних строк журнала, хранимого на сервере для каждого хоста/юнита
+JOURNAL_BUFFER_LINES = int(os.getenv('JOURNAL_BUFFER_LINES', '1000'))
+# Сколько окон (хост/юнит) держать в памяти; самые давно не читавшиеся вытесняются
+JOURNAL_TAILS_MAX = int(os.getenv('JOURNAL_TAILS_MAX', '64'))
+
+# Локальный полнотекстовый индекс логов (SQLite FTS5)
+LOG_INDEX = {
+    'PATH': os.getenv('LOG_INDEX_PATH', str(BASE_DIR / 'log_index.sqlite3')),
+    'RETENTION_DAYS': int(os.getenv('LOG_INDEX_RETENTION_DAYS', '7')),
+    'BATCH_SIZE': 2000,
+    'PURGE_INTERVAL': 600,
+}
+
+# Фильтрация логов на удаленном хосте: сколько последних строк источника просматривать
+LOG_PUSHDOWN = {
+    'SCAN_LINES': int(os.getenv('LOG_PUSHDOWN_SCAN_LINES', '20000')),
+}
+
+# Потоковая выгрузка логов в gzip
+LOG_EXPORT = {
+    'DEFAULT_SINCE': os.getenv('LOG_EXPORT_DEFAULT_SINCE', '24h'),
+    'TIMEOUT': int(os.getenv('LOG_EXPORT_TIMEOUT', '300')),
+    'CHUNK_SIZE': 65536,
+    'COMPRESSION_LEVEL': 6,
+}
+
+# Единая лента логов из нескольких источников
+LOG_TIMELINE = {
+    'PAGE_SIZE': 200,
+    'MAX_PAGE_SIZE': 1000,
+    'SCAN_LINES': 5000,
+    'MAX_CONTAINERS': 20,
+    # Окно в секундах для страниц логов docker в прошлое; расширяется в 4 раза до MAX
+    'DOCKER_WINDOW': 600,
+    'DOCKER_MAX_WINDOW': 90 * 24 * 3600,
+}
+
+# Кластеризация строк логов в шаблоны перед анализом
+LOG_TEMPLATES = {
+    'DEPTH': 4,
+    'SIMILARITY': 0.5,
+    'MAX_CHILDREN': 100,
+    'MAX_CLUSTERS': 1000,
+    'PROMPT_CHARS': 6000,
+}
+
+# Отбор строк логов для запроса к ИИ: оценка по уровню, редкости шаблона,
+# свежести и ключевым словам запроса (сумма весов - 1)
+LOG_EXCERPT = {
+    'TOKENS': int(os.getenv('LOG_EXCERPT_TOKENS', '700')),
+    'WEIGHTS': {
+        'SEVERITY': 0.4,
+        'RARITY': 0.25,
+        'RECENCY': 0.15,
+        'KEYWORDS': 0.2,
+    },
+    'BUCKETS': 100,
+    'MAX_PER_TEMPLATE': 3,
+    'MAX_LINE_CHARS': 400,
+    'MIN_LINE_TOKENS': 8,
+}
+
+# Сжатое хранение снимков логов в БД (ServiceLog + LogChunk)
+LOG_STORAGE = {
+    'ENABLED': os.getenv('LOG_STORAGE_ENABLED', 'False').lower() == 'true',
+    'CHUNK_LINES': 2000,
+    'OVERLAP_WINDOW': 2000,
+    'COMPRESSION_LEVEL': 6,
+}
+
+# Docker
+DOCKER_BULK_PARALLELISM = int(os.getenv('DOCKER_BULK_PARALLELISM', '4'))
+DOCKER_CACHE_TTL = {
+    'VERSION': 6 * 3600,
+    'INFO': 300,
+    'DF': int(os.getenv('DOCKER_DF_TTL', '600')),
+    'INVENTORY': int(os.getenv('DOCKER_INVENTORY_TTL', '10')),
+}
+
+# История метрик контейнеров (INTERVAL=0 отключает фоновый сбор)
+CONTAINER_METRICS = {
+    'INTERVAL': int(os.getenv('CONTAINER_METRICS_INTERVAL', '30')),
+    'HISTORY': int(os.getenv('CONTAINER_METRICS_HISTORY', '720')),
+    'CRASH_LOOP_RESTARTS': 3,
+    'CRASH_LOOP_WINDOW': 600,
+    'OOM_PERCENT': 90,
+    'LEAK_SAMPLES': 20,
+    'LEAK_MIN_GROWTH': 0.1,
+}
+
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4')
+# Другой совместимый сервер, например локальный mock (manage.py mock_openai)
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL') or None
+
+# Клиент модели: пул соединений, параллельность, повторы и размыкание цепи
+AI_CLIENT = {
+    'MAX_CONCURRENCY': int(os.getenv('AI_CLIENT_MAX_CONCURRENCY', '4')),
+    'MAX_CONNECTIONS': int(os.getenv('AI_CLIENT_MAX_CONNECTIONS', '10')),
+    'REQUEST_TIMEOUT': float(os.getenv('AI_CLIENT_REQUEST_TIMEOUT', '30')),
+    # Общий дедлайн запроса вместе с ожиданием слота и повторами
+    'DEADLINE': float(os.getenv('AI_CLIENT_DEADLINE', '60')),
+    'MAX_RETRIES': int(os.getenv('AI_CLIENT_MAX_RETRIES', '3')),
+    'BACKOFF_BASE': 0.5,
+    'BACKOFF_MAX': 8.0,
+    'BREAKER_FAILURES': int(os.getenv('AI_CLIENT_BREAKER_FAILURES', '5')),
+    'BREAKER_RESET': float(os.getenv('AI_CLIENT_BREAKER_RESET', '30')),
+}
+
+# Бюджет свежести разделов снимка системы для AI-агента (секунды)
+AI_SNAPSHOT_TTL = {
+    'resources': int(os.getenv('AI_SNAPSHOT_RESOURCES_TTL', '15')),
+    'processes': int(os.getenv('AI_SNAPSHOT_PROCESSES_TTL', '15')),
+    'docker': int(os.getenv('AI_SNAPSHOT_DOCKER_TTL', '30')),
+    'services': int(os.getenv('AI_SNAPSHOT_SERVICES_TTL', '60')),
+    'network': int(os.getenv('AI_SNAPSHOT_NETWORK_TTL', '120')),
+}
+
+# Кэш ответов ИИ: ключ - смысл вопроса и огрубленное состояние системы
+AI_RESPONSE_CACHE = {
+    'ENABLED': os.getenv('AI_RESPONSE_CACHE_ENABLED', 'True').lower() == 'true',
+    'TTL': int(os.getenv('AI_RESPONSE_CACHE_TTL', '300')),
+    'MAX_ENTRIES': int(os.getenv('AI_RESPONSE_CACHE_MAX_ENTRIES', '256')),
+    # Хранить записи в БД (нужна миграция ai_response_cache)
+    'PERSIST': os.getenv('AI_RESPONSE_CACHE_PERSIST', 'False').lower() == 'true',
+    # Ширина корзины для процентов: 41% и 43% CPU считаются одним состоянием
+    'PERCENT_BUCKET': 5,
+}
+
+# Бюджет промпта ИИ в токенах (без tiktoken - оценка по символам)
+AI_PROMPT_BUDGET = {
+    'TOTAL_TOKENS': int(os.getenv('AI_PROMPT_BUDGET_TOKENS', '3000')),
+    # Данные для анализа логов и Docker внутри запроса
+    'ANALYSIS_TOKENS': int(os.getenv('AI_PROMPT_ANALYSIS_TOKENS', '1500')),
+    # Меньше этого раздел не обрезается, а выбрасывается
+    'MIN_SECTION_TOKENS': 40,
+    'ASCII_CHARS_PER_TOKEN': 4,
+    'OTHER_CHARS_PER_TOKEN': 2.5,
+}
+
+# История разговоров с ИИ по сессиям (модели Conversation/ConversationMessage)
+AI_CONVERSATION = {
+    'PERSIST': os.getenv('AI_CONVERSATION_PERSIST', 'True').lower() == 'true',
+    # Сколько сессий держать в памяти процесса (LRU)
+    'MAX_SESSIONS': int(os.getenv('AI_CONVERSATION_MAX_SESSIONS', '200')),
+    # Выше этого объема реплик старые сворачиваются в сводку
+    'COMPACT_TOKENS': int(os.getenv('AI_CONVERSATION_COMPACT_TOKENS', '1500')),
+    'KEEP_RECENT': 4,
+    'SUMMARY_TOKENS': 300,
+    'SUMMARY_LINE_CHARS': 160,
+}
+
+# Стриминг ответов ИИ в чат (SSE)
+AI_STREAMING = {
+    # Сколько последних ответов учитывать в метриках TTFT
+    'METRICS_WINDOW': int(os.getenv('AI_STREAMING_METRICS_WINDOW', '100')),
+}
+
+# Чат с вызовом инструментов: модель сама запрашивает нужные данные сервера
+AI_TOOLS = {
+    'ENABLED': os.getenv('AI_TOOLS_ENABLED', 'True').lower() == 'true',
+    # Раундов вызовов до обязательного текстового ответа
+    'MAX_ROUNDS': int(os.getenv('AI_TOOLS_MAX_ROUNDS', '3')),
+    # Результат одного инструмента в промпте не длиннее (токенов)
+    'RESULT_TOKENS': 800,
+    'MAX_LOG_LINES': 500,
+    'PARALLELISM': 6,
+}
+
+# Фоновые анализы ИИ (AnalysisJob): celery - воркеры Celery, thread - потоки процесса
+AI_JOBS = {
+    'BACKEND': os.getenv('AI_JOBS_BACKEND', 'thread'),
+    # Потоков при BACKEND=thread (и при недоступном брокере)
+    'WORKERS': int(os.getenv('AI_JOBS_WORKERS', '2')),
+    # Выполняемая дольше этого задача считается потерянной (с момента начала работы)
+    'TIMEOUT': int(os.getenv('AI_JOBS_TIMEOUT', '3600')),
+    # Задача, которую за это время не взял ни один воркер, считается потерянной
+    'QUEUE_TIMEOUT': int(os.getenv('AI_JOBS_QUEUE_TIMEOUT', '86400')),
+    'KEEP_DAYS': 7,
+    # Ночной обзор всех контейнеров (Celery beat)
+    'REVIEW_HOUR': int(os.getenv('AI_JOBS_REVIEW_HOUR', '3')),
+    'REVIEW_MINUTE': 0,
+    'REVIEW_PRIORITY': 9,
+    # Интервал опроса БД для SSE прогресса задачи (секунды)
+    'EVENTS_POLL_INTERVAL': 0.5,
+    # Одно SSE подключение держит воркер не дольше этого; затем клиент переподключается
+    'EVENTS_MAX_SECONDS': int(os.getenv('AI_JOBS_EVENTS_MAX_SECONDS', '30')),
+    # Пауза перед переподключением EventSource (поле retry, миллисекунды)
+    'EVENTS_RETRY_MS': 1000,
+}
+
+# Celery (брокер redis с приоритетами 0-9, 0 - высший)
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', 'redis://localhost:6379/0')
+# Результаты и прогресс задач хранятся в AnalysisJob
+CELERY_TASK_IGNORE_RESULT = True
+CELERY_TASK_ACKS_LATE = True
+# Длинные задачи не накапливаются у одного воркера и не обходят приоритеты
+CELERY_WORKER_PREFETCH_MULTIPLIER = 1
+CELERY_TASK_DEFAULT_PRIORITY = 5
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'sep': ':',
+    'queue_order_strategy': 'priority',
+}
+CELERY_TIMEZONE = TIME_ZONE
+
+# Конвейер анализа системы (AIAgent.analyze_system_state)
+AI_ANALYSIS = {
+    # Сколько строк логов (уровня warning и выше) сводится в шаблоны
+    'LOG_LINES': int(os.getenv('AI_ANALYSIS_LOG_LINES', '500')),
+    # Сколько упомянутых в запросе контейнеров разбирать через docker inspect
+    'MAX_CONTAINERS': 2,
+    'CONTAINER_LOG_LINES': 200,
+    # Общее ожидание сборщиков; опоздавшие попадают в отчет как ошибка
+    'COLLECT_TIMEOUT': float(os.getenv('AI_ANALYSIS_COLLECT_TIMEOUT', '20')),
+    # Пороги находок по правилам: (внимание, критично), %
+    'CPU_THRESHOLDS': (80, 95),
+    'MEMORY_THRESHOLDS': (85, 95),
+    'DISK_THRESHOLDS': (85, 95),
+}
 
 # CSRF settings
 CSRF_TRUSTED_ORIGINS = [